@@ -0,0 +1,288 @@
+import Estimator
+import GraphReader
+import SyntheticGraphs
+
+import json
+import numpy
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+'''
+	Writes a random graph with numVertices vertices and (about) numEdges
+	edges in the format of the *_G.txt files. Some of the edges are repeated
+	or reversed, as it can happen in the raw datasets.
+'''
+def writeRandomGraphFile(graphFile, numVertices, numEdges, seed=0):
+	rng = numpy.random.default_rng(seed)
+
+	us = rng.integers(0, numVertices, size=numEdges)
+	vs = rng.integers(0, numVertices, size=numEdges)
+	weights = rng.choice([1.0, 0.5, 2.0], size=numEdges)
+
+	numDuplicates = numEdges // 20
+	duplicates = rng.integers(0, numEdges, size=numDuplicates)
+	us = numpy.concatenate((us, vs[duplicates]))
+	vs = numpy.concatenate((vs, us[duplicates]))
+	weights = numpy.concatenate((weights, weights[duplicates]))
+
+	with open(graphFile, 'w') as fp:
+		fp.write(f'{numVertices}\n')
+		for u, v, weight in zip(us.tolist(), vs.tolist(), weights.tolist()):
+			fp.write(f'{u} {v} {weight}\n')
+
+'''
+	Writes random opinion and measures files for a graph with numVertices
+	vertices.
+'''
+def writeRandomOpinionFiles(prefix, numVertices, seed=0):
+	rng = numpy.random.default_rng(seed)
+
+	for opinionsFile in [f'{prefix}_z.txt', f'{prefix}_s.txt']:
+		with open(opinionsFile, 'w') as fp:
+			for opinion in rng.random(numVertices).tolist():
+				fp.write(f'{opinion}\n')
+
+	with open(f'{prefix}_measures.txt', 'w') as fp:
+		for measure in ['ac', 'ap', 'aci', 'aidc', 'ad', 'norms', 'sumop']:
+			fp.write(f'{measure} {rng.random() * numVertices}\n')
+
+'''
+	Returns True if both graphs have the same vertices, the same neighbors in
+	the same order and exactly the same cumulated weights.
+'''
+def graphsAreIdentical(G, H):
+	if G.numVertices != H.numVertices or G.numEdges != H.numEdges:
+		return False
+	if G.totalEdgeWeights != H.totalEdgeWeights:
+		return False
+
+	for u in range(G.numVertices):
+		if list(G.neighbors[u]) != list(H.neighbors[u]):
+			return False
+		if list(G.cumulatedWeights[u]) != list(H.cumulatedWeights[u]):
+			return False
+
+	return True
+
+'''
+	Compares the line-by-line reader against the bulk reader on a random
+	graph and prints the loading times and the speedup.
+'''
+def benchmarkGraphReader(numVertices=200000, numEdges=2000000):
+	with tempfile.TemporaryDirectory() as directory:
+		prefix = os.path.join(directory, 'Synthetic')
+		writeRandomGraphFile(f'{prefix}_G.txt', numVertices, numEdges)
+		writeRandomOpinionFiles(prefix, numVertices)
+
+		files = (f'{prefix}_G.txt', f'{prefix}_z.txt', f'{prefix}_s.txt', f'{prefix}_measures.txt')
+
+		t = time.time()
+		G = GraphReader.graphFromSparseCSV(*files, separator=' ')
+		timeLineByLine = time.time() - t
+
+		t = time.time()
+		H = GraphReader.graphFromSparseCSV(*files, separator=' ', compact=True)
+		timeBulk = time.time() - t
+
+		identical = graphsAreIdentical(G, H)
+
+	print(f'Graph with {numVertices} vertices and {G.numEdges} edges.')
+	print(f'	line-by-line reader: {timeLineByLine:.2f}s')
+	print(f'	bulk reader: {timeBulk:.2f}s')
+	print(f'	speedup: {timeLineByLine/timeBulk:.1f}x')
+	print(f'	identical graphs: {identical}')
+
+	return timeLineByLine, timeBulk, identical
+
+'''
+	Runs the benchmark suite on synthetic graphs of every generator (see
+	SyntheticGraphs.generators) and size, and writes the results as JSON to
+	resultsFile. The results of two runs (e.g., of two commits) can be
+	compared with compareBenchmarkResults.
+
+	For every graph, we measure the time to load it with GraphReader, the
+	neighbor and edge sampling throughput of Graph, the time of
+	Estimator.estimateInnateOpinions, the time of the oracle (in-process,
+	and with ./oracle if it exists) and the throughput of a dynamic graph
+	under a mixed workload of edge updates and neighbor samples (see
+	benchmarkDynamicUpdates).
+'''
+def runBenchmarkSuite(resultsFile,
+					  sizes=[10000, 100000],
+					  averageDegree=10,
+					  numQueryVertices=1000,
+					  seed=0):
+	numpy.random.seed(seed)
+
+	results = dict()
+	with tempfile.TemporaryDirectory() as directory:
+		for generator in SyntheticGraphs.generators:
+			for numVertices in sizes:
+				name = f'{generator}{numVertices}'
+				print(f'Benchmarking {name}.')
+
+				prefix = SyntheticGraphs.writeSyntheticDataset(directory, name, generator, numVertices, averageDegree, seed=seed)
+				results[name] = benchmarkDataset(prefix, numQueryVertices)
+				results[name]['generator'] = generator
+
+				for metric, value in results[name].items():
+					print(f'	{metric}: {value}')
+
+	output = {
+		'commit': gitCommit(),
+		'date': time.strftime('%Y-%m-%d %H:%M:%S'),
+		'python': platform.python_version(),
+		'numpy': numpy.__version__,
+		'results': results
+	}
+
+	with open(resultsFile, 'w') as fp:
+		json.dump(output, fp, indent=1)
+
+	return output
+
+def benchmarkDataset(prefix, numQueryVertices):
+	files = (f'{prefix}_G.txt', f'{prefix}_Uniform_z.txt', f'{prefix}_Uniform_s.txt', f'{prefix}_Uniform_measures.txt')
+
+	result = dict()
+
+	t = time.time()
+	G = GraphReader.graphFromSparseCSV(*files, separator=' ', compact=True)
+	result['loadTime'] = time.time() - t
+	result['numVertices'] = G.numVertices
+	result['numEdges'] = int(G.numEdges)
+
+	vertices = numpy.random.choice(numpy.flatnonzero(G.degrees() > 0), size=numQueryVertices, replace=True)
+
+	numNeighborSamples = 100
+	t = time.time()
+	G.sampleNeighborsOfVertices(vertices, numNeighborSamples)
+	result['aliasTablesTime'] = time.time() - t
+
+	t = time.time()
+	G.sampleNeighborsOfVertices(vertices, numNeighborSamples)
+	result['neighborSamplesPerSecond'] = len(vertices) * numNeighborSamples / (time.time() - t)
+
+	numEdgeSamples = 1000000
+	t = time.time()
+	G.sampleEdges(numEdgeSamples)
+	result['edgeSamplesPerSecond'] = numEdgeSamples / (time.time() - t)
+
+	t = time.time()
+	Estimator.estimateInnateOpinions(G, vertices, {'numSamples': 100, 'repetitions': 3})
+	result['estimateInnateOpinionsTime'] = time.time() - t
+
+	' the in-process oracle, forward push and the hybrid engine, with the mean absolute error of their estimates (see Graph.forwardPush for the range of rMax) '
+	oracleVertices = vertices[:100]
+	z = numpy.asarray(G.z, dtype=numpy.float64)
+	parameters = {'numSteps': 100, 'numWalks': 100}
+	for engine, engineParameters in [('native', {}), ('push', {'rMax': 1e-4}), ('hybrid', {'rMax': 1e-3, 'epsilon': 0.01})]:
+		t = time.time()
+		opinions, _ = Estimator.estimateExpressedOpinions(G, oracleVertices, dict(parameters, engine=engine, **engineParameters))
+		result[f'{engine}OracleTime'] = time.time() - t
+		result[f'{engine}OracleError'] = float(numpy.mean([abs(opinion - z[u]) for u, opinion in opinions.items()]))
+
+	if os.path.exists('./oracle'):
+		parameters['engine'] = 'external'
+		t = time.time()
+		Estimator.estimateExpressedOpinions(G, oracleVertices.tolist(), parameters)
+		result['externalOracleTime'] = time.time() - t
+
+		import OracleModule
+		OracleModule.closeSession(G.graphFile, G.innateOpinionsFile)
+
+	' this converts G to a dynamic graph, so it has to come last '
+	result['makeDynamicTime'], result['dynamicOperationsPerSecond'] = benchmarkDynamicUpdates(G)
+
+	return result
+
+'''
+	Converts G to a dynamic graph and runs numOperations operations on
+	uniformly random edges (u,v): a fraction updateFraction of them changes
+	the weight of (u,v) (every fifth of these removes the edge and adds it
+	again with the new weight instead), the others sample a weighted random
+	neighbor of u. Returns the time of the conversion and the number of
+	operations per second.
+'''
+def benchmarkDynamicUpdates(G, numOperations=200000, updateFraction=0.5):
+	us, vs = G.sampleEdges(numOperations)
+	weights = 1 + numpy.random.random(numOperations)
+	updates = numpy.random.random(numOperations) < updateFraction
+	removals = numpy.random.random(numOperations) < 0.2
+
+	t = time.time()
+	G.makeDynamic()
+	makeDynamicTime = time.time() - t
+
+	t = time.time()
+	for u, v, weight, update, removal in zip(us.tolist(), vs.tolist(), weights.tolist(), updates.tolist(), removals.tolist()):
+		if not update:
+			G.weightedRandomNeighborIndex(u)
+		elif removal:
+			G.removeEdge(u, v)
+			G.addEdge(u, v, weight)
+		else:
+			G.updateEdgeWeight(u, v, weight)
+
+	return makeDynamicTime, numOperations / (time.time() - t)
+
+def gitCommit():
+	try:
+		return subprocess.run(['git', 'rev-parse', 'HEAD'],
+							  cwd=os.path.dirname(os.path.abspath(__file__)),
+							  capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+'''
+	Prints the metrics of two results files of runBenchmarkSuite side by
+	side and returns the metrics that got worse by more than the factor
+	threshold (times that increased and throughputs that decreased).
+'''
+def compareBenchmarkResults(oldResultsFile, newResultsFile, threshold=1.2):
+	with open(oldResultsFile) as fp:
+		oldResults = json.load(fp)
+	with open(newResultsFile) as fp:
+		newResults = json.load(fp)
+
+	print(f'old: {oldResults["commit"]} ({oldResults["date"]})')
+	print(f'new: {newResults["commit"]} ({newResults["date"]})')
+
+	regressions = []
+	for name, newMetrics in newResults['results'].items():
+		oldMetrics = oldResults['results'].get(name)
+		if oldMetrics is None:
+			continue
+
+		print(name)
+		for metric, newValue in newMetrics.items():
+			oldValue = oldMetrics.get(metric)
+			if not metric.endswith('Time') and not metric.endswith('PerSecond'):
+				continue
+			if oldValue is None or oldValue == 0 or newValue == 0:
+				continue
+
+			' ratio > 1 means that the new commit is slower '
+			ratio = newValue / oldValue if metric.endswith('Time') else oldValue / newValue
+			marker = ''
+			if ratio > threshold:
+				marker = ' <- regression'
+				regressions.append((name, metric, ratio))
+
+			print(f'	{metric}: {oldValue:.4g} -> {newValue:.4g} ({ratio:.2f}x){marker}')
+
+	return regressions
+
+if __name__ == '__main__':
+	if len(sys.argv) >= 2 and sys.argv[1] == 'suite':
+		resultsFile = sys.argv[2] if len(sys.argv) >= 3 else 'benchmark.json'
+		sizes = [int(size) for size in sys.argv[3:]] or [10000, 100000]
+		runBenchmarkSuite(resultsFile, sizes=sizes)
+	elif len(sys.argv) == 4 and sys.argv[1] == 'compare':
+		compareBenchmarkResults(sys.argv[2], sys.argv[3])
+	else:
+		benchmarkGraphReader()
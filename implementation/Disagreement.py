@@ -1,6 +1,7 @@
-import GraphReader
 import Eval
 import Estimator
+import Instrumentation
+import OracleModule
 
 import numpy
 
@@ -11,27 +12,30 @@ def runExperimentsDisagreement(datasets, opinionDistributions):
 
 	for dataset in datasets:
 		for opinionDistribution in opinionDistributions:
-			runExperimentsDisagreementWithValues(dataset, opinionDistribution, ks, None)
-
 			G = Eval.loadGraphForParameters(dataset, opinionDistribution)
-			runExperimentsDisagreementWithValues(dataset, opinionDistribution, ks, G)
+
+			runExperimentsDisagreementWithValues(dataset, opinionDistribution, ks, G, useOracle=False)
+			runExperimentsDisagreementWithValues(dataset, opinionDistribution, ks, G, useOracle=True)
+			OracleModule.closeSession(G.graphFile, G.innateOpinionsFile)
 
 '''
-	if G == None, uses the true expressed opinions from z, otherwise uses the
-	random walk oracle
+	The edges are sampled from G (see Graph.sampleEdges).
+
+	if useOracle == False, uses the true expressed opinions from G.z,
+	otherwise uses the random walk oracle
 '''
-def runExperimentsDisagreementWithValues(dataset, opinionDistribution, ks, G):
+def runExperimentsDisagreementWithValues(dataset, opinionDistribution, ks, G, useOracle):
 	meanErrors = []
 	stdErrors = []
 
 	for k in ks:
 		print(f'Running disagreement experiments for k={k} on {dataset}')
-		meanError, stdError = estimateDisagreement(dataset, opinionDistribution, k, G)
+		meanError, stdError = estimateDisagreement(G, k, useOracle)
 
 		meanErrors.append(meanError)
 		stdErrors.append(stdError)
 
-	suffix = 'z' if G==None else 's'
+	suffix = 's' if useOracle else 'z'
 
 	import matplotlib.pyplot as plt
 	plt.errorbar(ks,meanErrors,stdErrors,marker='o')
@@ -42,100 +46,58 @@ def runExperimentsDisagreementWithValues(dataset, opinionDistribution, ks, G):
 	plt.savefig(f'../plots_disagreement/{dataset}_{opinionDistribution}_{suffix}_error.pdf', bbox_inches='tight')
 	plt.close('all')
 
-def estimateDisagreement(dataset, opinionDistribution, numberOfEdges, G):
-	edges, z, _, measures = loadEdgeListForParameters(dataset, opinionDistribution)
-	m = len(edges)
+'''
+	The edges of all repetitions are drawn at once and arranged as a
+	(numRepetitions, numberOfEdges) matrix.
+'''
+@Instrumentation.timed('Disagreement.estimateDisagreement')
+def estimateDisagreement(G, numberOfEdges, useOracle):
+	m = G.numEdges
+	z = numpy.asarray(G.z, dtype=numpy.float64)
+
+	sampledUs, sampledVs = G.sampleEdges(numRepetitions * numberOfEdges)
+	sampledUs = sampledUs.reshape(numRepetitions, numberOfEdges)
+	sampledVs = sampledVs.reshape(numRepetitions, numberOfEdges)
 
-	errors= []
+	if not useOracle:
+		errors = estimateDisagreementForEdges(sampledUs, sampledVs, z, m, G.measures)
+	else:
+		parameters = {
+			'numSteps': 600,
+			'numWalks': 4000
+		}
 
-	for repetition in range(numRepetitions):
-		print(f'	running repetition {repetition}')
-		experimentType = f'disagreement{numberOfEdges}'
-		
-		sampledIndices = numpy.random.choice(range(len(edges)), size=numberOfEdges, replace=True)
-		sampledEdges = [edges[i] for i in sampledIndices]
+		errors = numpy.zeros(numRepetitions)
+		for repetition in range(numRepetitions):
+			print(f'	running repetition {repetition}')
 
-		if G is not None:
-			parameters = {
-				'numSteps': 600,
-				'numWalks': 4000
-			}
-			sampledVertices = set()
-			for (u,v) in sampledEdges:
-				sampledVertices.add(u)
-				sampledVertices.add(v)
-			sampledVertices = list(sampledVertices)
-			z, _ = Estimator.estimateExpressedOpinions(G, sampledVertices, parameters)
+			sampledVertices = numpy.union1d(sampledUs[repetition], sampledVs[repetition])
+			opinions, _ = Estimator.estimateExpressedOpinions(G, sampledVertices.tolist(), parameters)
 
-		error = estimateDisagreementForEdges(sampledEdges, z, m, measures)
+			estimatedZ = numpy.zeros(len(z))
+			estimatedZ[list(opinions.keys())] = list(opinions.values())
 
-		errors.append(error)
+			errors[repetition] = estimateDisagreementForEdges(sampledUs[repetition], sampledVs[repetition], estimatedZ, m, G.measures)
 
 	meanError = numpy.mean(errors)
 	stdError = numpy.std(errors)
 
 	return meanError, stdError
 
-def estimateDisagreementForEdges(edges, z, m, measures):
-	estimatedDisagreement = 0
-
-	for (u,v) in edges:
-		estimatedDisagreement += (z[u] - z[v])**2
+'''
+	us and vs contain the endpoints of the sampled edges. If they are
+	matrices, every row is one sample and the error of every row is
+	returned.
+'''
+@Instrumentation.timed('Disagreement.estimateDisagreementForEdges')
+def estimateDisagreementForEdges(us, vs, z, m, measures):
+	differences = z[us] - z[vs]
+	estimatedDisagreement = numpy.sum(differences * differences, axis=-1)
 
-	estimatedDisagreement = estimatedDisagreement * m / len(edges)
+	estimatedDisagreement = estimatedDisagreement * m / us.shape[-1]
 	
 	trueDisagreement = measures['ad']
 
 	error = numpy.absolute(estimatedDisagreement - trueDisagreement)/trueDisagreement
 
 	return error
-
-def loadEdgeListForParameters(dataset, opinionDistribution):
-	prefix = '../include/OpinionQuantities-mine/outputs'
-	graphFile = f'{prefix}/{dataset}_G.txt'
-	expressedOpinionsFile = f'{prefix}/{dataset}_{opinionDistribution}_z.txt'
-	innateOpinionsFile = f'{prefix}/{dataset}_{opinionDistribution}_s.txt'
-	measuresFile = f'{prefix}/{dataset}_{opinionDistribution}_measures.txt'
-
-	edges, z, s, measures = edgeListFromSparseCSV(graphFile,
-									   expressedOpinionsFile,
-									   innateOpinionsFile,
-									   measuresFile,
-									   separator=' ')
-	print(f'	Read edge list for {dataset} with {len(edges)} edges.')
-
-	edges = list(edges)
-
-	return edges, z, s, measures
-
-def edgeListFromSparseCSV(graphFile, expressedOpinionsFile, innateOpinionsFile, measuresFilePath, separator=',', skipHeader=False, inputIsZeroIndexed=False):
-	'''
-		since the input file might contain some edges multiple times or as
-		directed edges, we start by summing over all of these weights
-	'''
-	edges = set()
-
-	with open(graphFile) as fp:
-		line = fp.readline()
-		if skipHeader:
-			line = fp.readline()
-
-		n = int(line)
-
-		line = fp.readline()
-		while line:
-			lineSplit = str.split(line.strip(), separator)
-
-			u = int(lineSplit[0])
-			v = int(lineSplit[1])
-
-			edges.add( (u,v) )
-
-			line = fp.readline()
-
-	z = GraphReader.readOpinionsFile(expressedOpinionsFile)
-	s = GraphReader.readOpinionsFile(innateOpinionsFile)
-	measures = GraphReader.readMeasuresFile(measuresFilePath, separator)
-
-	return edges, z, s, measures
-
@@ -0,0 +1,173 @@
+import Graph
+import GraphCache
+import Instrumentation
+
+import json
+import numpy
+import os
+
+'''
+	On-disk adjacency index, from which a lazy graph view only pages in the
+	neighborhoods that are queried (through mmap). This is meant for the
+	givenZ experiments, where Estimator.estimateInnateOpinions only reads
+	the neighborhoods of the sampled vertices and the expressed opinions of
+	their neighbors, so the I/O scales with the number of samples instead of
+	the size of the graph.
+
+	The index of outputs/Advogato_G.txt is the directory
+	outputs/Advogato_G.txt.index/ with the files
+	- offsets.bin: indptr of the CSR format (numVertices+1 int64 values),
+	- adjacency.bin: for every vertex u one block of 2*degree(u) 8-byte
+	  words at word offset 2*indptr[u], which contains the neighbors of u
+	  (int64) followed by their cumulated weights (float64), so that a
+	  neighborhood is usually read with a single page fault,
+	- meta.json: the number of vertices and edges, the total edge weight,
+	  and the size and mtime of the source file.
+	The opinions are memory-mapped from the binary opinion files (see
+	GraphReader.readOpinionsBinary).
+
+	The index is built from the CSR arrays of GraphCache (so the text file
+	is only parsed once) and rebuilt if the source file changed.
+'''
+
+indexVersion = 1
+indexSuffix = '.index'
+
+'''
+	Read-only view over the packed blocks of adjacency.bin: rows[u] returns
+	the neighbors (if part is 'neighbors') or the cumulated weights (if
+	part is 'cumulatedWeights') of u.
+'''
+class PackedRows:
+	def __init__(self, offsets, words, part):
+		self.offsets = offsets
+		self.words = words
+		self.part = part
+
+	def __getitem__(self, u):
+		start = int(self.offsets[u])
+		end = int(self.offsets[u+1])
+		degree = end - start
+
+		if Instrumentation.enabled:
+			Instrumentation.count('DiskGraph.bytesRead', 8 * degree)
+
+		if self.part == 'neighbors':
+			return self.words[2*start:2*start+degree]
+		return self.words[2*start+degree:2*end].view(numpy.float64)
+
+	' the packed blocks as Graph.RowArrays, e.g., for the random walks of OracleModule '
+	def rowArrays(self):
+		return Graph.RowArrays(self.offsets, self.words, self.words.view(numpy.float64), packed=True)
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def __iter__(self):
+		for u in range(len(self)):
+			yield self[u]
+
+'''
+	Same as GraphCache.loadGraph, but returns a lazy view on the disk index
+	of graphFile (which is built if necessary): neighbors[u] and
+	cumulatedWeights[u] are read from the memory-mapped adjacency.bin, and
+	z and s are memory-mapped float64 arrays. The view is read-only. The
+	random walks of OracleModule run directly on the packed blocks (see
+	PackedRows.rowArrays), but compact() reads the whole graph into memory.
+'''
+@Instrumentation.timed('DiskGraph.loadGraph')
+def loadGraph(graphFile, expressedOpinionsFile, innateOpinionsFile, measuresFilePath, separator=','):
+	directory = indexDirectory(graphFile)
+	info = loadIndexInfo(graphFile)
+	if info is None:
+		buildIndex(graphFile, separator)
+		info = loadIndexInfo(graphFile)
+
+	offsets = memoryMap(os.path.join(directory, 'offsets.bin'), numpy.int64)
+	words = memoryMap(os.path.join(directory, 'adjacency.bin'), numpy.int64)
+
+	G = Graph.Graph()
+	G.graphFile = graphFile
+	G.expressedOpinionsFile = expressedOpinionsFile
+	G.innateOpinionsFile = innateOpinionsFile
+
+	G.neighbors = PackedRows(offsets, words, 'neighbors')
+	G.cumulatedWeights = PackedRows(offsets, words, 'cumulatedWeights')
+	G.numVertices = info['numVertices']
+	G.numEdges = info['numEdges']
+	G.totalEdgeWeights = info['totalEdgeWeights']
+
+	G.z = GraphCache.loadOpinions(expressedOpinionsFile, G.numVertices)
+	G.s = GraphCache.loadOpinions(innateOpinionsFile, G.numVertices)
+	G.measures = GraphCache.loadMeasures(measuresFilePath, separator)
+
+	return G
+
+'''
+	Writes the disk index of graphFile (see the description of this module).
+'''
+@Instrumentation.timed('DiskGraph.buildIndex')
+def buildIndex(graphFile, separator=','):
+	arrays, info = GraphCache.loadCSR(graphFile, separator)
+	indptr = numpy.asarray(arrays['indptr'], dtype=numpy.int64)
+	degrees = numpy.diff(indptr)
+
+	' entry j of vertex u goes to word 2*indptr[u] + (j-indptr[u]), its weight degree(u) words later '
+	entries = numpy.arange(indptr[-1])
+	entryOffsets = numpy.repeat(indptr[:-1], degrees)
+	words = numpy.empty(2*indptr[-1], dtype=numpy.int64)
+	words[entryOffsets + entries] = arrays['indices']
+	words.view(numpy.float64)[entryOffsets + entries + numpy.repeat(degrees, degrees)] = arrays['cumweights']
+
+	directory = indexDirectory(graphFile)
+	os.makedirs(directory, exist_ok=True)
+
+	metaFilePath = os.path.join(directory, 'meta.json')
+	if os.path.exists(metaFilePath):
+		os.remove(metaFilePath)
+
+	writeRawFile(os.path.join(directory, 'offsets.bin'), indptr)
+	writeRawFile(os.path.join(directory, 'adjacency.bin'), words)
+
+	' the meta file is written last, so an index is never used before it is complete '
+	stat = os.stat(graphFile)
+	meta = {
+		'version': indexVersion,
+		'size': stat.st_size,
+		'mtime': stat.st_mtime_ns,
+		'info': info
+	}
+	temporaryFilePath = f'{metaFilePath}.{os.getpid()}.tmp'
+	with open(temporaryFilePath, 'w') as fp:
+		json.dump(meta, fp)
+	os.replace(temporaryFilePath, metaFilePath)
+
+def indexDirectory(graphFile):
+	return graphFile + indexSuffix
+
+' returns the info of the index of graphFile, or None if there is no up-to-date index '
+def loadIndexInfo(graphFile):
+	try:
+		with open(os.path.join(indexDirectory(graphFile), 'meta.json')) as fp:
+			meta = json.load(fp)
+	except (OSError, ValueError):
+		return None
+
+	stat = os.stat(graphFile)
+	if meta.get('version') != indexVersion or meta['size'] != stat.st_size or meta['mtime'] != stat.st_mtime_ns:
+		return None
+
+	return meta['info']
+
+def writeRawFile(filePath, array):
+	temporaryFilePath = f'{filePath}.{os.getpid()}.tmp'
+	with open(temporaryFilePath, 'wb') as fp:
+		numpy.ascontiguousarray(array).tofile(fp)
+	os.replace(temporaryFilePath, filePath)
+
+' numpy.memmap cannot map empty files '
+def memoryMap(filePath, dtype):
+	if os.path.getsize(filePath) == 0:
+		return numpy.zeros(0, dtype=dtype)
+
+	return numpy.memmap(filePath, dtype=dtype, mode='r')
@@ -1,8 +1,12 @@
+import Instrumentation
 import OracleModule
 
 import numpy
 import time
 
+' maximum number of neighbor samples that estimateInnateOpinions draws at once '
+maxSamplesPerBatch = 1 << 23
+
 def getGroundTruthExpressedOpinions(G, sampledVertices, parameters=None):
 	opinions = {}
 	for u in sampledVertices:
@@ -15,9 +19,33 @@ def getGroundTruthInnateOpinions(G, sampledVertices, parameters=None):
 		opinions[u] = G.s[u]
 	return opinions
 
+'''
+	Estimates the expressed opinions with random walks. parameters['engine']
+	selects the oracle: 'external' (default) calls the ./oracle binary,
+	'native' runs the random walks in-process on G, and 'adaptive' runs them
+	in-process until the estimates are precise enough (see
+	estimateExpressedOpinionsAdaptively). 'push' and 'hybrid' use forward
+	push instead of (or before) the random walks (see
+	estimateExpressedOpinionsWithPush and estimateExpressedOpinionsHybrid).
+'''
+@Instrumentation.timed('Estimator.estimateExpressedOpinions')
 def estimateExpressedOpinions(G, sampledVertices, parameters):
 	numSteps = parameters['numSteps']
 	numWalks = parameters['numWalks']
+	engine = parameters.get('engine', 'external')
+
+	if engine == 'native':
+		return OracleModule.estimateOpinionsInProcess(G, sampledVertices, numSteps, numWalks)
+	elif engine == 'adaptive':
+		opinions, timeForQueries, _ = estimateExpressedOpinionsAdaptively(G, sampledVertices, parameters)
+		return opinions, timeForQueries
+	elif engine == 'push':
+		return estimateExpressedOpinionsWithPush(G, sampledVertices, parameters)
+	elif engine == 'hybrid':
+		return estimateExpressedOpinionsHybrid(G, sampledVertices, parameters)
+	elif engine != 'external':
+		raise ValueError(f'Unknown oracle engine {engine}.')
+
 	opinions, timeForQueries = OracleModule.estimateOpinionsOfGivenVertices(sampledVertices,
 									G.graphFile,
 									numSteps,
@@ -26,6 +54,102 @@ def estimateExpressedOpinions(G, sampledVertices, parameters):
 
 	return opinions, timeForQueries
 
+'''
+	Runs the walks of every vertex in batches of parameters['walkBatchSize']
+	(default 100) until the confidence interval of its estimate has
+	half-width at most parameters['epsilon'] with probability at least
+	1-parameters['delta'] (default 0.05), but runs at most
+	parameters['numWalks'] walks per vertex. The walks are the terminal
+	walks of OracleModule.simulateTerminalWalks, so parameters['numSteps']
+	is not used.
+
+	Returns the opinions, the time and the number of walks used per vertex.
+'''
+def estimateExpressedOpinionsAdaptively(G, sampledVertices, parameters):
+	return OracleModule.estimateOpinionsAdaptively(G,
+												   sampledVertices,
+												   parameters['numWalks'],
+												   parameters['epsilon'],
+												   delta=parameters.get('delta', 0.05),
+												   walkBatchSize=parameters.get('walkBatchSize', 100))
+
+'''
+	Deterministic estimates of the expressed opinions with forward push (see
+	Graph.forwardPush) with threshold parameters['rMax']. The opinions are
+	in [min(s), max(s)], so the remaining term sum_v r_v z_v is estimated by
+	the total residual R times the middle of this range. The error is at
+	most R*(max(s)-min(s))/2.
+
+	If supports is a dict, supports[u] is set to the vertices touched by the
+	push from u (as an array): the estimate of u only depends on their
+	opinions and edges, and on min(s) and max(s).
+'''
+def estimateExpressedOpinionsWithPush(G, sampledVertices, parameters, supports=None):
+	rMax = parameters['rMax']
+	s = numpy.asarray(G.s, dtype=numpy.float64)
+	middleOpinion = (s.min() + s.max()) / 2
+
+	t = time.time()
+
+	opinions = dict()
+	for u in numpy.unique(sampledVertices).tolist():
+		touchedVertices = set() if supports is not None else None
+		estimate, _, residuals = G.forwardPush(u, s, rMax, touchedVertices=touchedVertices)
+		opinions[u] = float(estimate + residuals.sum() * middleOpinion)
+
+		if supports is not None:
+			supports[u] = numpy.fromiter(touchedVertices, dtype=numpy.int64, count=len(touchedVertices))
+
+	return opinions, time.time() - t
+
+'''
+	Hybrid of forward push and random walks: after the push with threshold
+	parameters['rMax'], the remaining term sum_v r_v z_v = R E[z_V], where V
+	is drawn with probability r_v/R, is estimated with walks from such
+	vertices V (see OracleModule.simulateTerminalWalks). Their values are in
+	[min(s), max(s)], so by Hoeffding's inequality
+	R^2 (max(s)-min(s))^2 log(2/delta) / (2 epsilon^2) walks give an
+	additive error of at most parameters['epsilon'] with probability at
+	least 1-parameters['delta'] (default 0.05). The push makes R small, so
+	far fewer walks are needed than without it (R=1).
+'''
+def estimateExpressedOpinionsHybrid(G, sampledVertices, parameters):
+	rMax = parameters['rMax']
+	epsilon = parameters['epsilon']
+	logTerm = numpy.log(2 / parameters.get('delta', 0.05))
+
+	s = numpy.asarray(G.s, dtype=numpy.float64)
+	rangeOfS = s.max() - s.min()
+
+	t = time.time()
+
+	vertices = numpy.unique(sampledVertices).tolist()
+	estimates = numpy.zeros(len(vertices))
+	totalResiduals = numpy.zeros(len(vertices))
+	startVertices = []
+	owners = []
+	for i, u in enumerate(vertices):
+		estimates[i], residualVertices, residualValues = G.forwardPush(u, s, rMax)
+		if len(residualVertices) == 0:
+			continue
+
+		totalResiduals[i] = residualValues.sum()
+
+		numWalks = max(1, int(numpy.ceil((totalResiduals[i] * rangeOfS)**2 * logTerm / (2 * epsilon**2))))
+		startVertices.append(numpy.random.choice(residualVertices, size=numWalks, p=residualValues/totalResiduals[i]))
+		owners.append(numpy.full(numWalks, i, dtype=numpy.int64))
+
+	if startVertices:
+		owners = numpy.concatenate(owners)
+		terminalValues = OracleModule.simulateTerminalWalks(G, s, numpy.concatenate(startVertices))
+		numWalks = numpy.bincount(owners, minlength=len(vertices))
+		sums = numpy.bincount(owners, weights=terminalValues, minlength=len(vertices))
+		estimates += totalResiduals * sums / numpy.maximum(numWalks, 1)
+
+	opinions = dict(zip(vertices, estimates.tolist()))
+
+	return opinions, time.time() - t
+
 def weightedNeighborSum(G, u, selectedNeighborIndices):
 	neighborSum = 0
 
@@ -51,9 +175,7 @@ def estimateInnateOpinion(G, u, parameters):
 	else:
 		estimatedSums = []
 		for _ in range(repetitions):
-			selectedNeighborIndices = []
-			for i in range(numSamples):
-				selectedNeighborIndices.append(G.weightedRandomNeighborIndex(u))
+			selectedNeighborIndices = G.sampleNeighbors(u, numSamples)
 			estimatedSum = weightedNeighborSum(G, u, selectedNeighborIndices)
 			estimatedSum *= G.cumulatedWeights[u][-1] / numSamples # do re-scaling
 			estimatedSums.append(estimatedSum)
@@ -65,13 +187,59 @@ def estimateInnateOpinion(G, u, parameters):
 
 	return opinion
 
+'''
+	Same as calling estimateInnateOpinion for all sampled vertices, but all
+	vertices are handled at once: we draw the neighbor samples of all
+	vertices, repetitions and samples as one matrix, gather z and the edge
+	weights, and take the medians over the repetitions with numpy.
+'''
+@Instrumentation.timed('Estimator.estimateInnateOpinions')
 def estimateInnateOpinions(G, sampledVertices, parameters=None):
 	t = time.time()
 
-	opinions = dict()
-	for u in sampledVertices:
-		opinion = estimateInnateOpinion(G, u, parameters)
-		opinions[u] = opinion
+	numSamples = parameters['numSamples']
+	repetitions = parameters['repetitions']
+
+	vertices = numpy.unique(numpy.asarray(sampledVertices, dtype=numpy.int64))
+	z = numpy.asarray(G.z, dtype=numpy.float64)
+
+	offsets, neighbors, cumulatedWeights = G.neighborhoods(vertices)
+	degrees = numpy.diff(offsets)
+	hasNeighbors = degrees > 0
+
+	' cumulatedWeights[i] - cumulatedWeights[i-1] within each neighborhood '
+	previousWeights = numpy.zeros(len(cumulatedWeights))
+	previousWeights[1:] = cumulatedWeights[:-1]
+	previousWeights[offsets[:-1][hasNeighbors]] = 0
+	weightedOpinions = (cumulatedWeights - previousWeights) * z[neighbors]
+
+	totalWeights = numpy.zeros(len(vertices))
+	totalWeights[hasNeighbors] = cumulatedWeights[offsets[1:][hasNeighbors]-1]
+
+	opinions = (1 + totalWeights) * z[vertices]
+
+	' vertices with few neighbors: compute the weighted sum exactly '
+	exact = degrees <= numSamples
+	neighborSums = numpy.zeros(len(vertices))
+	neighborSums[hasNeighbors] = numpy.add.reduceat(weightedOpinions, offsets[:-1][hasNeighbors])
+	opinions[exact] -= neighborSums[exact]
+
+	' vertices with many neighbors: take the median of the sampled sums '
+	sampled = numpy.flatnonzero(~exact)
+	verticesPerBatch = max(1, maxSamplesPerBatch // (repetitions * numSamples))
+	for batchStart in range(0, len(sampled), verticesPerBatch):
+		batch = sampled[batchStart:batchStart+verticesPerBatch]
+
+		selectedNeighborIndices = G.sampleNeighborsOfVertices(vertices[batch], repetitions * numSamples)
+		positions = offsets[batch,None] + selectedNeighborIndices
+
+		estimatedSums = weightedOpinions[positions].reshape(len(batch), repetitions, numSamples).sum(axis=2)
+		estimatedSums *= (totalWeights[batch] / numSamples)[:,None] # do re-scaling
+
+		opinions[batch] -= numpy.median(estimatedSums, axis=1)
+
+	opinions = numpy.clip(opinions, 0, 1)
+	opinions = dict(zip(vertices.tolist(), opinions.tolist()))
 
 	totalTime = time.time() - t
 
@@ -178,3 +346,292 @@ def estimateDisagreement(G, expressedOpinions, innateOpinions):
 
 	return disagreement
 
+
+'''
+	Computes the sufficient statistics of the sampled opinions, where z and
+	s are aligned arrays with the expressed and innate opinions of the
+	sampled vertices. All measures can be derived from these sums (see
+	estimateMeasuresFromStatistics).
+'''
+def sufficientStatistics(z, s):
+	z = numpy.asarray(z, dtype=numpy.float64)
+	s = numpy.asarray(s, dtype=numpy.float64)
+	difference = z - s
+
+	statistics = {
+		'numSamples': len(z),
+		'sumZ': z.sum(),
+		'sumS': s.sum(),
+		'sumZSquared': numpy.dot(z, z),
+		'sumSSquared': numpy.dot(s, s),
+		'sumZS': numpy.dot(z, s),
+		'sumDifferenceSquared': numpy.dot(difference, difference)
+	}
+
+	return statistics
+
+'''
+	Keeps the sufficient statistics (see sufficientStatistics) of a stream
+	of sampled opinions, which arrive in chunks. Instead of the raw sums, we
+	store the means and the centered (co-)moments, which we merge with the
+	pairwise update of Chan et al. (the chunked version of Welford's
+	algorithm). This is numerically stable even for many samples.
+'''
+class RunningStatistics:
+	def __init__(self):
+		self.numSamples = 0
+		self.meanZ = 0
+		self.meanS = 0
+		self.squaredDeviationsZ = 0
+		self.squaredDeviationsS = 0
+		self.coDeviationsZS = 0
+
+	def update(self, z, s):
+		z = numpy.asarray(z, dtype=numpy.float64)
+		s = numpy.asarray(s, dtype=numpy.float64)
+
+		numNewSamples = len(z)
+		if numNewSamples == 0:
+			return
+
+		meanZ = z.mean()
+		meanS = s.mean()
+		deviationsZ = z - meanZ
+		deviationsS = s - meanS
+
+		numSamples = self.numSamples + numNewSamples
+		deltaZ = meanZ - self.meanZ
+		deltaS = meanS - self.meanS
+		factor = self.numSamples * numNewSamples / numSamples
+
+		self.squaredDeviationsZ += numpy.dot(deviationsZ, deviationsZ) + deltaZ * deltaZ * factor
+		self.squaredDeviationsS += numpy.dot(deviationsS, deviationsS) + deltaS * deltaS * factor
+		self.coDeviationsZS += numpy.dot(deviationsZ, deviationsS) + deltaZ * deltaS * factor
+
+		self.meanZ += deltaZ * numNewSamples / numSamples
+		self.meanS += deltaS * numNewSamples / numSamples
+		self.numSamples = numSamples
+
+	' returns the statistics in the format of sufficientStatistics '
+	def statistics(self):
+		k = self.numSamples
+		meanDifference = self.meanZ - self.meanS
+
+		statistics = {
+			'numSamples': k,
+			'sumZ': k * self.meanZ,
+			'sumS': k * self.meanS,
+			'sumZSquared': self.squaredDeviationsZ + k * self.meanZ**2,
+			'sumSSquared': self.squaredDeviationsS + k * self.meanS**2,
+			'sumZS': self.coDeviationsZS + k * self.meanZ * self.meanS,
+			'sumDifferenceSquared': self.squaredDeviationsZ + self.squaredDeviationsS - 2 * self.coDeviationsZS + k * meanDifference**2
+		}
+
+		return statistics
+
+'''
+	Returns the same estimates as estimateControversy,
+	estimateSumOfExpressedOpinions, estimatePolarization,
+	estimateInternalConflict, estimateDisCon, estimateSquaredNormS and
+	estimateDisagreement (including their clipping), but derives all of them
+	from the sufficient statistics. The keys of the returned dict are the
+	names in G.measures.
+
+	Since the sums of the innate and the expressed opinions are the same,
+	the sum of opinions can be estimated from either of them. If
+	sumFromInnateOpinions is True, it is estimated from s, otherwise from z.
+	The polarization is computed around the resulting average opinion.
+'''
+@Instrumentation.timed('Estimator.estimateMeasuresFromStatistics')
+def estimateMeasuresFromStatistics(G, statistics, sumFromInnateOpinions=False):
+	numVerticesToSample = statistics['numSamples']
+	scale = G.numVertices / numVerticesToSample
+
+	sumZ = statistics['sumZ']
+	sumZSquared = statistics['sumZSquared']
+
+	controversy = scale * sumZSquared
+
+	sumOfOpinions = statistics['sumS'] if sumFromInnateOpinions else sumZ
+	sumop = scale * sumOfOpinions
+	avgop = sumop / G.numVertices
+
+	' sum of (z-avgop)^2 '
+	polarization = scale * (sumZSquared - avgop * (2*sumZ - numVerticesToSample*avgop))
+
+	internalConflict = scale * statistics['sumDifferenceSquared']
+
+	disCon = scale * statistics['sumZS']
+	disCon = max(disCon, 0)
+	disCon = min(disCon, G.numVertices)
+
+	squaredNormS = scale * statistics['sumSSquared']
+
+	disagreement = (squaredNormS - controversy - internalConflict)/2
+	disagreement = max(disagreement, 0)
+	disagreement = min(disagreement, G.totalEdgeWeights)
+
+	measures = {
+		'ac': controversy,
+		'sumop': sumop,
+		'ap': polarization,
+		'aci': internalConflict,
+		'aidc': disCon,
+		'norms': squaredNormS,
+		'ad': disagreement
+	}
+
+	return {measure: float(value) for measure, value in measures.items()}
+
+'''
+	Estimates all measures from aligned arrays of expressed and innate
+	opinions in a single pass (see estimateMeasuresFromStatistics).
+'''
+@Instrumentation.timed('Estimator.estimateMeasures')
+def estimateMeasures(G, z, s, sumFromInnateOpinions=False):
+	statistics = sufficientStatistics(z, s)
+	return estimateMeasuresFromStatistics(G, statistics, sumFromInnateOpinions)
+
+'''
+	Returns the contribution of every sampled vertex to the measures, i.e.,
+	each measure is the sum of these values over all vertices. For the
+	polarization, the opinions are centered around the mean of the given z.
+	The contribution to the disagreement is (s^2 - z^2 - (z-s)^2)/2 = z(s-z)
+	(see estimateDisagreement).
+'''
+def measureContributions(z, s):
+	z = numpy.asarray(z, dtype=numpy.float64)
+	s = numpy.asarray(s, dtype=numpy.float64)
+
+	contributions = {
+		'ac': z*z,
+		'sumop': z,
+		'ap': (z - numpy.mean(z))**2,
+		'aci': (z-s)**2,
+		'aidc': z*s,
+		'norms': s*s,
+		'ad': z*(s-z)
+	}
+
+	return contributions
+
+'''
+	Neyman allocation of numSamples samples to strata of the given sizes,
+	i.e., stratum h gets a number of samples proportional to
+	stratumSizes[h]*stratumDeviations[h], where stratumDeviations are the
+	standard deviations of the sampled quantity within the strata. Every
+	stratum gets at least minSamples samples (which can be an array with one
+	value per stratum) and at most as many samples as it has vertices. Raises
+	a ValueError if numSamples is smaller than the total minimum.
+
+	If all deviations are zero (or stratumDeviations is None), the samples
+	are allocated proportionally to the stratum sizes.
+'''
+def neymanAllocation(stratumSizes, stratumDeviations, numSamples, minSamples=2):
+	stratumSizes = numpy.asarray(stratumSizes, dtype=numpy.int64)
+	if stratumDeviations is None:
+		stratumDeviations = numpy.ones(len(stratumSizes))
+
+	allocation = numpy.minimum(stratumSizes, minSamples).astype(numpy.int64)
+	if allocation.sum() > numSamples:
+		raise ValueError(f'Cannot allocate {numSamples} samples to {len(stratumSizes)} strata with at least {allocation.sum()} samples in total.')
+
+	while True:
+		remainingSamples = numSamples - allocation.sum()
+		capacities = stratumSizes - allocation
+		if remainingSamples <= 0 or capacities.sum() == 0:
+			break
+
+		weights = numpy.where(capacities > 0, stratumSizes * stratumDeviations, 0)
+		if weights.sum() <= 0:
+			weights = capacities.astype(numpy.float64)
+
+		shares = numpy.minimum(numpy.floor(remainingSamples * weights / weights.sum()).astype(numpy.int64), capacities)
+		if shares.sum() == 0:
+			' give the remaining samples one by one to the strata with the largest weights '
+			shares[numpy.argsort(-weights, kind='stable')[:remainingSamples]] = 1
+			shares = numpy.minimum(shares, capacities)
+
+		allocation += shares
+
+	return allocation
+
+'''
+	Samples allocation[h] distinct vertices uniformly at random from every
+	stratum h of the degree index (see Graph.degreeIndex), without the
+	vertices in excludedVertices. Returns the sampled vertices and their
+	strata.
+'''
+def sampleStrata(sortedVertices, strataStarts, allocation, excludedVertices=None):
+	sampledVertices = []
+	strata = []
+	for h in range(len(allocation)):
+		stratum = sortedVertices[strataStarts[h]:strataStarts[h+1]]
+		if excludedVertices is not None:
+			stratum = stratum[~numpy.isin(stratum, excludedVertices)]
+
+		sampledVertices.append(numpy.random.choice(stratum, size=allocation[h], replace=False))
+		strata.append(numpy.full(allocation[h], h, dtype=numpy.int64))
+
+	return numpy.concatenate(sampledVertices), numpy.concatenate(strata)
+
+'''
+	Returns the standard deviation of the given per-vertex values within
+	each stratum (0 for strata with less than two values).
+'''
+def stratumDeviations(values, strata, numStrata):
+	counts = numpy.bincount(strata, minlength=numStrata)
+	sums = numpy.bincount(strata, weights=values, minlength=numStrata)
+	sumSquares = numpy.bincount(strata, weights=values*values, minlength=numStrata)
+
+	safeCounts = numpy.maximum(counts, 1)
+	variances = (sumSquares - sums*sums / safeCounts) / numpy.maximum(counts-1, 1)
+
+	return numpy.where(counts > 1, numpy.sqrt(numpy.maximum(variances, 0)), 0)
+
+'''
+	Returns the ratio of the variance of the stratified estimate of a mean
+	with the given allocation to the variance of the mean of a uniform
+	sample of the same size, where totalDeviation is the standard deviation
+	over all vertices (ignoring finite population corrections). A uniform
+	sample needs 1/ratio times as many vertices (i.e., oracle calls) for the
+	same variance.
+'''
+def stratificationVarianceRatio(stratumSizes, stratumDeviations, allocation, totalDeviation):
+	stratumShares = numpy.asarray(stratumSizes, dtype=numpy.float64) / numpy.sum(stratumSizes)
+	allocation = numpy.asarray(allocation, dtype=numpy.float64)
+
+	stratifiedVariance = numpy.sum(stratumShares**2 * stratumDeviations**2 / numpy.maximum(allocation, 1))
+	uniformVariance = totalDeviation**2 / allocation.sum()
+	if uniformVariance == 0:
+		return 1.0
+
+	return stratifiedVariance / uniformVariance
+
+'''
+	Stratified version of sufficientStatistics: the sample of stratum h
+	(with stratumSizes[h] vertices, of which allocation[h] were sampled
+	without replacement) is weighted by stratumSizes[h]/allocation[h], so
+	every weighted sum is an unbiased estimate of the sum over all vertices.
+	Hence, numSamples is the total number of vertices, which makes
+	estimateMeasuresFromStatistics use these sums without further scaling.
+'''
+def stratifiedStatistics(z, s, strata, stratumSizes, allocation):
+	z = numpy.asarray(z, dtype=numpy.float64)
+	s = numpy.asarray(s, dtype=numpy.float64)
+	difference = z - s
+
+	stratumWeights = numpy.asarray(stratumSizes, dtype=numpy.float64) / numpy.maximum(allocation, 1)
+	weights = stratumWeights[strata]
+
+	statistics = {
+		'numSamples': int(numpy.sum(stratumSizes)),
+		'sumZ': numpy.dot(weights, z),
+		'sumS': numpy.dot(weights, s),
+		'sumZSquared': numpy.dot(weights, z*z),
+		'sumSSquared': numpy.dot(weights, s*s),
+		'sumZS': numpy.dot(weights, z*s),
+		'sumDifferenceSquared': numpy.dot(weights, difference*difference)
+	}
+
+	return statistics
@@ -1,6 +1,10 @@
 import numpy
+import os
 
-import GraphReader
+import DiskGraph
+import GraphCache
+import Instrumentation
+import ResultsStore
 
 import Estimator
 import OracleModule
@@ -8,14 +12,114 @@ import OracleModule
 numRepetitions = 10
 experimentsOutputFolderPath = '../results/'
 
+' if larger than 1, the experiments run on a process pool (see Scheduler) '
+numWorkers = 1
+
+'''
+	Oracle engine of the parameter sets that do not choose one (see
+	Estimator.estimateExpressedOpinions). It is the same for the sequential
+	experiments and for the process pool of Scheduler, so numWorkers does
+	not change the estimator behind the results.
+'''
+oracleEngine = 'external'
+
+'''
+	If True, the givenS experiments simulate the random walks of all
+	parameter sets of a repetition at once with the in-process oracle (see
+	runExperimentsEstimateMeasuresSweep).
+'''
+reuseWalks = False
+
+'''
+	If True, the measures for all numbers of sampled vertices are computed
+	from the prefixes of a single permuted sample (see
+	writeNestedMeasuresResultsToFile).
+'''
+nestedSubsamples = False
+
+'''
+	Settings of the stratified experiments, whose experiment type contains
+	'Stratified' (see runExperimentsEstimateMeasuresStratified). The
+	samples are allocated to the strata to minimize the variance of the
+	estimate of stratificationMeasure.
+'''
+numStrata = 10
+pilotFraction = 0.2
+stratificationMeasure = 'ad'
+
+' if True, runExperiments also runs the experiments givenSStratified and givenZStratified '
+stratifiedExperiments = False
+
+'''
+	If True, the graphs are loaded as lazy views on their disk index (see
+	DiskGraph), so the givenZ experiments only read the neighborhoods of the
+	sampled vertices. The in-process oracle walks of the givenS experiments
+	only read the neighborhoods they visit (but Scheduler copies the whole
+	graph into shared memory).
+'''
+useDiskIndex = False
+
+' results database in experimentsOutputFolderPath (see ResultsStore) '
+resultsDatabaseFileName = 'results.sqlite'
+resultsStore = None
+
+def getResultsStore():
+	global resultsStore
+	if resultsStore is None:
+		resultsStore = openResultsStore()
+
+	return resultsStore
+
+' opens a new store on the results database, e.g., in a worker of Scheduler '
+def openResultsStore():
+	os.makedirs(experimentsOutputFolderPath, exist_ok=True)
+	return ResultsStore.ResultsStore(os.path.join(experimentsOutputFolderPath, resultsDatabaseFileName))
+
+'''
+	Writes the contents of the results database to the CSV files used by
+	the plotting scripts.
+'''
+@Instrumentation.timed('Eval.exportResultsToCSV')
+def exportResultsToCSV():
+	getResultsStore().exportToCSV(experimentsOutputFolderPath)
+
+'''
+	Returns the values of the parameters of parameterSet that are stored
+	with the results of experimentType.
+'''
+def parameterValues(parameterSet, experimentType):
+	if 'givenS' in experimentType:
+		return (int(parameterSet['numSteps']), int(parameterSet['numWalks']))
+	return (int(parameterSet['numSamples']), int(parameterSet['repetitions']))
+
+' returns a copy of parameterSet that uses oracleEngine if it does not choose an engine '
+def withOracleEngine(parameterSet):
+	parameterSet = dict(parameterSet)
+	parameterSet.setdefault('engine', oracleEngine)
+	return parameterSet
+
+' whether the experiments of experimentType use runExperimentsEstimateMeasuresSweep '
+def usesWalkSweep(experimentType):
+	return reuseWalks and 'givenS' in experimentType and 'Stratified' not in experimentType
+
 def runExperimentsWithDegreeBuckets(datasets, opinionDistributions):
 	numBuckets = 20
 	verticesPerBucket = 500
 
-	parameterSet = {
+	parameterSet = withOracleEngine({
 		'numSteps': 600,
 		'numWalks': 4000
-	}
+	})
+
+	if numWorkers > 1:
+		import Scheduler
+		Scheduler.runExperimentsWithDegreeBuckets(datasets,
+												  opinionDistributions,
+												  parameterSet,
+												  numBuckets,
+												  verticesPerBucket,
+												  numWorkers=numWorkers)
+		return
 
 	for dataset in datasets:
 		for opinionDistribution in opinionDistributions:
@@ -43,12 +147,13 @@ def runExperimentsWithDegreeBucketsForSetting(dataset,
 	for repetition in range(numRepetitions):
 		print(f'	running repetition {repetition}')
 		for numBucket in range(numBuckets):
-			experimentType = f'givenSBucket{numBucket}'
-			
-			sampledVertices = numpy.random.choice(bucketizedVertices[numBucket], size=verticesPerBucket, replace=True)
-
-			innateOpinions = Estimator.getGroundTruthInnateOpinions(G, sampledVertices, parameters=parameterSet)
-			expressedOpinions, errors, time = runExperimentsEstimateOpinions(G, dataset, opinionDistribution, sampledVertices, parameterSet, experimentType, writeOpinions=True)
+			errors, time = runExperimentsForDegreeBucket(G,
+														 dataset,
+														 opinionDistribution,
+														 parameterSet,
+														 bucketizedVertices[numBucket],
+														 numBucket,
+														 verticesPerBucket)
 
 			errorsBucket[numBucket].extend(errors)
 			timesBucket[numBucket].append(time)
@@ -56,6 +161,39 @@ def runExperimentsWithDegreeBucketsForSetting(dataset,
 			errorsAll.extend(errors)
 			timesAll.append(time)
 
+	OracleModule.closeSession(G.graphFile, G.innateOpinionsFile)
+	getResultsStore().flush()
+
+	plotDegreeBucketResults(dataset,
+							opinionDistribution,
+							numBuckets,
+							errorsBucket,
+							timesBucket,
+							errorsAll,
+							timesAll)
+
+def runExperimentsForDegreeBucket(G,
+								  dataset,
+								  opinionDistribution,
+								  parameterSet,
+								  bucket,
+								  numBucket,
+								  verticesPerBucket):
+	experimentType = f'givenSBucket{numBucket}'
+
+	sampledVertices = numpy.random.choice(bucket, size=verticesPerBucket, replace=True)
+
+	expressedOpinions, errors, time = runExperimentsEstimateOpinions(G, dataset, opinionDistribution, sampledVertices, parameterSet, experimentType, writeOpinions=True)
+
+	return errors, time
+
+def plotDegreeBucketResults(dataset,
+							opinionDistribution,
+							numBuckets,
+							errorsBucket,
+							timesBucket,
+							errorsAll,
+							timesAll):
 	avgErrorAll = numpy.mean(errorsAll)
 	stdErrorAll = numpy.std(errorsAll)
 
@@ -146,11 +284,40 @@ def runExperiments(datasets, opinionDistributions):
 								 numVertexSamples,
 								 'givenS')
 
+	'''
+		experiments givenSStratified and givenZStratified, which can be
+		compared with the same parameters in givenS and givenZ
+	'''
+	if stratifiedExperiments:
+		runExperimentsWithParameters(datasets,
+									 opinionDistributions,
+									 [{'numSteps': 400, 'numWalks': 2000}],
+									 numVertexSamples,
+									 'givenSStratified')
+
+		runExperimentsWithParameters(datasets,
+									 opinionDistributions,
+									 [{'numSamples': 400, 'repetitions': 3}],
+									 numVertexSamples,
+									 'givenZStratified')
+
 def runExperimentsWithParameters(datasets,
 								 opinionDistributions,
 								 parameters,
 								 numVertexSamples,
 								 experimentType):
+	parameters = [withOracleEngine(parameterSet) for parameterSet in parameters]
+
+	if numWorkers > 1:
+		import Scheduler
+		Scheduler.runExperimentsWithParameters(datasets,
+											   opinionDistributions,
+											   parameters,
+											   numVertexSamples,
+											   experimentType,
+											   numWorkers=numWorkers)
+		return
+
 	for opinionDistribution in opinionDistributions:
 		for i in range(len(datasets)):
 			dataset = datasets[i]
@@ -160,6 +327,15 @@ def runExperimentsWithParameters(datasets,
 
 			for i in range(numRepetitions):
 				print(f'	Starting repetition {i}.')
+				if usesWalkSweep(experimentType):
+					runExperimentsEstimateMeasuresSweep(G,
+														dataset,
+														numVertexSamples,
+														opinionDistribution,
+														parameters,
+														experimentType)
+					continue
+
 				for parameterSet in parameters:
 					runExperimentsEstimateMeasures(G,
 												   dataset,
@@ -167,66 +343,199 @@ def runExperimentsWithParameters(datasets,
 												   opinionDistribution,
 												   parameterSet,
 												   experimentType)
-	
+
+			OracleModule.closeSession(G.graphFile, G.innateOpinionsFile)
+			getResultsStore().flush()
+
+'''
+	Runs one repetition of runExperimentsEstimateMeasures for all parameter
+	sets of a givenS experiment. All parameter sets use the same sampled
+	vertices, and the random walks are simulated only once for the largest
+	numSteps and numWalks (see OracleModule.estimateOpinionsForSweep). The
+	time in the stats file is the time of this single simulation.
+'''
+@Instrumentation.timed('Eval.runExperimentsEstimateMeasuresSweep')
+def runExperimentsEstimateMeasuresSweep(G,
+										dataset,
+										numVertexSamples,
+										opinionDistribution,
+										parameters,
+										experimentType):
+	numVerticesToSample = numpy.max(numVertexSamples)
+	vertices = range(G.numVertices)
+	sampledVertices = numpy.random.choice(vertices, size=numVerticesToSample, replace=True)
+
+	configurations = [(parameterSet['numSteps'], parameterSet['numWalks']) for parameterSet in parameters]
+	opinionsPerConfiguration, totalTime = OracleModule.estimateOpinionsForSweep(G, sampledVertices, configurations)
+
+	for parameterSet, opinions in zip(parameters, opinionsPerConfiguration):
+		runExperimentsEstimateMeasures(G,
+									   dataset,
+									   numVertexSamples,
+									   opinionDistribution,
+									   parameterSet,
+									   experimentType,
+									   sampledVertices=sampledVertices,
+									   estimatedOpinions=(opinions, totalTime))
+
+'''
+	If sampledVertices is None, the vertices are sampled uniformly at
+	random (or stratified by degree if experimentType contains
+	'Stratified'). If estimatedOpinions is not None, it contains the already
+	estimated opinions and the time it took (see
+	runExperimentsEstimateOpinions).
+'''
+@Instrumentation.timed('Eval.runExperimentsEstimateMeasures')
 def runExperimentsEstimateMeasures(G,
 								   dataset,
 								   numVertexSamples,
 								   opinionDistribution,
 								   parameterSet,
-								   experimentType):
+								   experimentType,
+								   sampledVertices=None,
+								   estimatedOpinions=None):
+
+	if sampledVertices is None and 'Stratified' in experimentType:
+		runExperimentsEstimateMeasuresStratified(G,
+												 dataset,
+												 numVertexSamples,
+												 opinionDistribution,
+												 parameterSet,
+												 experimentType)
+		return
+
+	if sampledVertices is None:
+		numVerticesToSample = numpy.max(numVertexSamples)
+		vertices = range(G.numVertices)
+		sampledVertices = numpy.random.choice(vertices, size=numVerticesToSample, replace=True)
+
+	expressedOpinions = dict()
+	innateOpinions = dict()
+	if 'givenS' in experimentType:
+		innateOpinions = Estimator.getGroundTruthInnateOpinions(G, sampledVertices, parameters=parameterSet)
+		expressedOpinions,_,_ = runExperimentsEstimateOpinions(G, dataset, opinionDistribution, sampledVertices, parameterSet, experimentType, writeOpinions=True, estimatedOpinions=estimatedOpinions)
+	else: # givenZ
+		expressedOpinions = Estimator.getGroundTruthExpressedOpinions(G, sampledVertices, parameters=parameterSet)
+		innateOpinions,_,_ = runExperimentsEstimateOpinions(G, dataset, opinionDistribution, sampledVertices, parameterSet, experimentType, writeOpinions=True, estimatedOpinions=estimatedOpinions)
 
-	numVerticesToSample = numpy.max(numVertexSamples)
-	vertices = range(G.numVertices)
-	sampledVertices = numpy.random.choice(vertices, size=numVerticesToSample, replace=True)
+	resultsKey = (dataset, opinionDistribution, experimentType)
 
-	measuresFilePath = f"{experimentsOutputFolderPath}/{dataset}_measures_{opinionDistribution}_{experimentType}.csv"
-
-	with open(measuresFilePath, 'a') as measuresFile:
-		expressedOpinions = dict()
-		innateOpinions = dict()
-		paramString = ''
-		if 'givenS' in experimentType:
-			innateOpinions = Estimator.getGroundTruthInnateOpinions(G, sampledVertices, parameters=parameterSet)
-			expressedOpinions,_,_ = runExperimentsEstimateOpinions(G, dataset, opinionDistribution, sampledVertices, parameterSet, experimentType, writeOpinions=True)
-
-			measuresFile.write(f'measure,trueValue,estimatedValue,numSteps,numWalks,numSampledVertices\n')
-			paramString = f'{parameterSet["numSteps"]},{parameterSet["numWalks"]}'
-		else: # givenZ
-			expressedOpinions = Estimator.getGroundTruthExpressedOpinions(G, sampledVertices, parameters=parameterSet)
-			innateOpinions,_,_ = runExperimentsEstimateOpinions(G, dataset, opinionDistribution, sampledVertices, parameterSet, experimentType, writeOpinions=True)
-
-			measuresFile.write(f'measure,trueValue,estimatedValue,numSamples,repetitions,numSampledVertices\n')
-			paramString = f'{parameterSet["numSamples"]},{parameterSet["repetitions"]}'
-
-		'''
-			Now we subsample from sampledVertices for each number of vertices
-			contained in numVertexSamples. For each of these samples, we
-			estimate the measures and write the results to the disk.
-		'''
-		for numVerticesToSample in numVertexSamples:
-			parameterSet['numVerticesToSample'] = numVerticesToSample
-
-			subsampledVertices = numpy.random.choice(sampledVertices, size=numVerticesToSample, replace=True)
-			expressedOpinionsSubsampled = dict()
-			innateOpinionsSubsampled = dict()
-			for vertex in subsampledVertices:
-				expressedOpinionsSubsampled[vertex] = expressedOpinions[vertex]
-				innateOpinionsSubsampled[vertex] = innateOpinions[vertex]
-			
-			writeMeasuresResultsToFile(measuresFile, G, expressedOpinionsSubsampled, innateOpinionsSubsampled, numVerticesToSample, paramString, experimentType)
+	'''
+		Now we subsample from sampledVertices for each number of vertices
+		contained in numVertexSamples. For each of these samples, we
+		estimate the measures and write the results to the disk.
+
+		The opinions are stored in arrays aligned with the distinct
+		sampled vertices. As before, every vertex of a subsample is
+		only counted once.
+	'''
+	distinctVertices = numpy.unique(sampledVertices)
+	z = numpy.array([expressedOpinions[vertex] for vertex in distinctVertices.tolist()])
+	s = numpy.array([innateOpinions[vertex] for vertex in distinctVertices.tolist()])
+
+	if nestedSubsamples:
+		writeNestedMeasuresResults(resultsKey, G, sampledVertices, distinctVertices, z, s, numVertexSamples, parameterSet)
+		return
+
+	for numVerticesToSample in numVertexSamples:
+		parameterSet['numVerticesToSample'] = numVerticesToSample
+
+		subsampledVertices = numpy.random.choice(sampledVertices, size=numVerticesToSample, replace=True)
+		positions = numpy.unique(numpy.searchsorted(distinctVertices, subsampledVertices))
+
+		writeMeasuresResults(resultsKey, G, z[positions], s[positions], numVerticesToSample, parameterSet)
+
+'''
+	Stratified version of runExperimentsEstimateMeasures: for every number
+	of vertices in numVertexSamples, we sample that many distinct vertices
+	from the numStrata strata of the degree index (see Graph.degreeIndex).
+
+	First, a pilot sample of pilotFraction of the vertices is allocated
+	proportionally to the stratum sizes. The opinions of the pilot sample
+	give the standard deviations of the contributions to
+	stratificationMeasure within the strata, and the remaining vertices are
+	sampled according to the Neyman allocation (see
+	Estimator.neymanAllocation). The measures are estimated from the
+	reweighted sums of the whole sample (see Estimator.stratifiedStatistics).
+	The stats contain the total time of both rounds of queries. We print how
+	many vertices a uniform sample would need for the same variance (as
+	estimated from the pilot sample).
+
+	Every number of vertices must be at least 2*numStrata, so that the pilot
+	sample has two vertices in every stratum.
+'''
+@Instrumentation.timed('Eval.runExperimentsEstimateMeasuresStratified')
+def runExperimentsEstimateMeasuresStratified(G,
+											 dataset,
+											 numVertexSamples,
+											 opinionDistribution,
+											 parameterSet,
+											 experimentType):
+	resultsKey = (dataset, opinionDistribution, experimentType)
+	sortedVertices, strataStarts = G.degreeIndex(numStrata)
+	stratumSizes = numpy.diff(strataStarts)
+
+	if numpy.min(numVertexSamples) < 2*numStrata:
+		raise ValueError(f'Stratified experiments need at least {2*numStrata} vertices per sample.')
+
+	for numVerticesToSample in numVertexSamples:
+		parameterSet['numVerticesToSample'] = numVerticesToSample
+
+		numPilotSamples = max(int(pilotFraction * numVerticesToSample), 2*numStrata)
+		pilotAllocation = Estimator.neymanAllocation(stratumSizes, None, numPilotSamples)
+		pilotVertices, pilotStrata = Estimator.sampleStrata(sortedVertices, strataStarts, pilotAllocation)
+		opinions, pilotTime = estimateOpinionsOfSample(G, pilotVertices, parameterSet, experimentType)
+
+		z, s = opinionsOfSample(G, pilotVertices, opinions, experimentType)
+		contributions = Estimator.measureContributions(z, s)[stratificationMeasure]
+		deviations = Estimator.stratumDeviations(contributions, pilotStrata, numStrata)
+
+		allocation = Estimator.neymanAllocation(stratumSizes, deviations, numVerticesToSample, minSamples=pilotAllocation)
+
+		varianceRatio = Estimator.stratificationVarianceRatio(stratumSizes, deviations, allocation, numpy.std(contributions, ddof=1))
+		print(f'	Stratified sample of {numVerticesToSample} vertices has the variance of a uniform sample of {numVerticesToSample / max(varianceRatio, 1e-12):.0f} vertices.')
+		vertices, strata = Estimator.sampleStrata(sortedVertices, strataStarts, allocation - pilotAllocation, excludedVertices=pilotVertices)
+		newOpinions, queryTime = estimateOpinionsOfSample(G, vertices, parameterSet, experimentType)
+		opinions.update(newOpinions)
+
+		sampledVertices = numpy.concatenate((pilotVertices, vertices))
+		strata = numpy.concatenate((pilotStrata, strata))
+		runExperimentsEstimateOpinions(G, dataset, opinionDistribution, sampledVertices, parameterSet, experimentType, writeOpinions=True, estimatedOpinions=(opinions, pilotTime + queryTime))
+
+		z, s = opinionsOfSample(G, sampledVertices, opinions, experimentType)
+		statistics = Estimator.stratifiedStatistics(z, s, strata, stratumSizes, allocation)
+		sumFromInnateOpinions = 'givenS' in experimentType
+		estimates = Estimator.estimateMeasuresFromStatistics(G, statistics, sumFromInnateOpinions)
+
+		writeMeasureEstimates(resultsKey, G, estimates, numVerticesToSample, parameterSet)
+
+def estimateOpinionsOfSample(G, sampledVertices, parameterSet, experimentType):
+	if 'givenS' in experimentType:
+		return Estimator.estimateExpressedOpinions(G, sampledVertices, parameterSet)
+	return Estimator.estimateInnateOpinions(G, sampledVertices, parameterSet)
+
+'''
+	Returns the expressed and innate opinions of the sampled vertices as
+	aligned arrays, where the opinions that are not estimated are the
+	ground truth.
+'''
+def opinionsOfSample(G, sampledVertices, estimatedOpinions, experimentType):
+	estimates = numpy.array([estimatedOpinions[u] for u in sampledVertices.tolist()])
+
+	if 'givenS' in experimentType:
+		return estimates, numpy.asarray(G.s, dtype=numpy.float64)[sampledVertices]
+	return numpy.asarray(G.z, dtype=numpy.float64)[sampledVertices], estimates
 
 
+@Instrumentation.timed('Eval.runExperimentsEstimateOpinions')
 def runExperimentsEstimateOpinions(G,
 								  dataset,
 								  opinionDistribution,
 								  sampledVertices,
 								  parameterSet,
 								  experimentType,
-								  writeOpinions=False):
-	filePrefix = f"{experimentsOutputFolderPath}/{dataset}_opinions_{opinionDistribution}_{experimentType}"
-	opinionsFilePath = f"{filePrefix}.csv"
-	statsFilePath = f"{filePrefix}_stats.csv"
-
+								  writeOpinions=False,
+								  estimatedOpinions=None):
 	groundTruthOpinions = None
 	estimateOpinionsFunction = None
 	if 'givenS' in experimentType:
@@ -236,93 +545,122 @@ def runExperimentsEstimateOpinions(G,
 		groundTruthOpinions = G.s
 		estimateOpinionsFunction = Estimator.estimateInnateOpinions
 
-	opinions, totalTime = estimateOpinionsFunction(G, sampledVertices, parameterSet)
-	
-	''' write the stats file '''
-	statsFile = open(statsFilePath, 'a')
-
-	if 'givenS' in experimentType:
-		statsFile.write(f'numSampledVertices,numSteps,NumWalks,time,numActualVertices\n')
+	walkCounts = None
+	if estimatedOpinions is not None:
+		opinions, totalTime = estimatedOpinions
+	elif 'givenS' in experimentType and parameterSet.get('engine') == 'adaptive':
+		opinions, totalTime, walkCounts = Estimator.estimateExpressedOpinionsAdaptively(G, sampledVertices, parameterSet)
 	else:
-		statsFile.write(f'numSampledVertices,numSamples,repetitions,time\n')
-		
-		
-	line = f'{len(sampledVertices)},'
-	if 'givenS' in experimentType:
-		line += f'{parameterSet["numSteps"]},{parameterSet["numWalks"]}'
-	else:
-		line += f'{parameterSet["numSamples"]},{parameterSet["repetitions"]}'
-	line += f',{totalTime},{len(opinions)}\n'
-	statsFile.write(line)
+		opinions, totalTime = estimateOpinionsFunction(G, sampledVertices, parameterSet)
 
-	''' write the opinions file if necessary '''
-	if writeOpinions:
-		opinionsFile = open(opinionsFilePath, 'a')
-
-		if 'givenS' in experimentType:
-			opinionsFile.write('vertexId,trueOpinions,estimatedOpinion,numSteps,numWalks\n')
-		else:
-			opinionsFile.write('vertexId,trueOpinions,estimatedOpinion,numSamples,repetitions\n')
-
-		for u in opinions:
-			line = f'{u},{groundTruthOpinions[u]},{opinions[u]},'
-			if 'givenS' in experimentType:
-				line += f'{parameterSet["numSteps"]},{parameterSet["numWalks"]}\n'
-			else:
-				line += f'{parameterSet["numSamples"]},{parameterSet["repetitions"]}\n'
-				
-			opinionsFile.write(line)
-
-	errors = []
-	for u in opinions:
-		error = numpy.abs(opinions[u] - groundTruthOpinions[u])
-		errors.append(error)
+	store = getResultsStore()
+	values = parameterValues(parameterSet, experimentType)
 
-	return opinions, errors, totalTime
+	''' write the stats '''
+	store.addStats(dataset, opinionDistribution, experimentType, len(sampledVertices), values, totalTime, len(opinions))
 
-def writeMeasuresResultsToFile(measuresFile,
-							   G,
-							   expressedOpinions,
-							   innateOpinions,
-							   numVerticesToSample,
-							   paramString,
-							   experimentType):
-	''' controversy '''
-	ac = Estimator.estimateControversy(G, expressedOpinions)
-	measuresFile.write(f'controversy,{G.measures["ac"]},{ac},{paramString},{numVerticesToSample}\n')
+	''' write the number of walks per vertex of the adaptive oracle '''
+	if walkCounts is not None:
+		store.addWalkCounts(dataset, opinionDistribution, experimentType, walkCounts, values, parameterSet['epsilon'])
 
-	''' sum of opinions
-		here we exploit that the sum of innate and expressed opinions is
-		the same.
-	'''
-	sumop = 0
-	if 'givenS' in experimentType:
-		sumop = Estimator.estimateSumOfExpressedOpinions(G, innateOpinions)
-	else:
-		sumop = Estimator.estimateSumOfExpressedOpinions(G, expressedOpinions)
-	measuresFile.write(f'sumExpOpinions,{G.measures["sumop"]},{sumop},{paramString},{numVerticesToSample}\n')
+		numWalksUsed = sum(walkCounts.values())
+		fixedBudget = len(walkCounts) * parameterSet['numWalks']
+		print(f'	Adaptive oracle used {numWalksUsed} of {fixedBudget} walks ({100 * numWalksUsed / fixedBudget:.1f}%).')
 
-	''' polarization '''
-	avgop = sumop / G.numVertices
-	ap = Estimator.estimatePolarization(G, expressedOpinions, avgop)
-	measuresFile.write(f'polarization,{G.measures["ap"]},{ap},{paramString},{numVerticesToSample}\n')
+	trueOpinions = [groundTruthOpinions[u] for u in opinions]
 
-	''' internal conflict '''
-	aci = Estimator.estimateInternalConflict(G, expressedOpinions, innateOpinions)
-	measuresFile.write(f'internalConflict,{G.measures["aci"]},{aci},{paramString},{numVerticesToSample}\n')
+	''' write the opinions if necessary '''
+	if writeOpinions:
+		store.addOpinions(dataset, opinionDistribution, experimentType, opinions.keys(), trueOpinions, opinions.values(), values)
 
-	''' disagreement--controversy '''
-	aidc = Estimator.estimateDisCon(G, expressedOpinions, innateOpinions)
-	measuresFile.write(f'disCon,{G.measures["aidc"]},{aidc},{paramString},{numVerticesToSample}\n')
+	errors = numpy.abs(numpy.fromiter(opinions.values(), dtype=numpy.float64, count=len(opinions)) - numpy.array(trueOpinions, dtype=numpy.float64)).tolist()
 
-	''' squared norm innate opinions '''
-	norms = Estimator.estimateSquaredNormS(G, innateOpinions)
-	measuresFile.write(f'norms,{G.measures["norms"]},{norms},{paramString},{numVerticesToSample}\n')
+	return opinions, errors, totalTime
 
-	''' disagreement '''
-	ad = Estimator.estimateDisagreement(G, expressedOpinions, innateOpinions)
-	measuresFile.write(f'ad,{G.measures["ad"]},{ad},{paramString},{numVerticesToSample}\n')
+'''
+	Writes the estimates of all measures for the sampled vertices, whose
+	expressed and innate opinions are given by the aligned arrays z and s.
+	resultsKey is the triple (dataset, opinionDistribution, experimentType).
+'''
+def writeMeasuresResults(resultsKey,
+						 G,
+						 z,
+						 s,
+						 numVerticesToSample,
+						 parameterSet):
+	''' sum of opinions
+		here we exploit that the sum of innate and expressed opinions is
+		the same, so we use the ground-truth opinions.
+	'''
+	sumFromInnateOpinions = 'givenS' in resultsKey[2]
+	estimates = Estimator.estimateMeasures(G, z, s, sumFromInnateOpinions)
+
+	writeMeasureEstimates(resultsKey, G, estimates, numVerticesToSample, parameterSet)
+
+'''
+	Streaming version of the subsampling loop in
+	runExperimentsEstimateMeasures: instead of drawing a new subsample for
+	every number of vertices in numVertexSamples, we randomly permute
+	sampledVertices once and use its prefixes as (nested) subsamples. The
+	statistics are updated incrementally from one prefix to the next, so the
+	total work is O(max(numVertexSamples)) instead of O(sum(numVertexSamples)).
+	As before, every vertex is only counted once per subsample.
+'''
+def writeNestedMeasuresResults(resultsKey,
+							   G,
+							   sampledVertices,
+							   distinctVertices,
+							   z,
+							   s,
+							   numVertexSamples,
+							   parameterSet):
+	permutedVertices = numpy.random.permutation(sampledVertices)
+	positions = numpy.searchsorted(distinctVertices, permutedVertices)
+
+	_, firstOccurrences = numpy.unique(positions, return_index=True)
+	isFirstOccurrence = numpy.zeros(len(positions), dtype=bool)
+	isFirstOccurrence[firstOccurrences] = True
+
+	sumFromInnateOpinions = 'givenS' in resultsKey[2]
+	statistics = Estimator.RunningStatistics()
+	prefixLength = 0
+	for numVerticesToSample in sorted(numVertexSamples):
+		parameterSet['numVerticesToSample'] = numVerticesToSample
+
+		newPositions = positions[prefixLength:numVerticesToSample]
+		newPositions = newPositions[isFirstOccurrence[prefixLength:numVerticesToSample]]
+		statistics.update(z[newPositions], s[newPositions])
+		prefixLength = numVerticesToSample
+
+		estimates = Estimator.estimateMeasuresFromStatistics(G, statistics.statistics(), sumFromInnateOpinions)
+		writeMeasureEstimates(resultsKey, G, estimates, numVerticesToSample, parameterSet)
+
+@Instrumentation.timed('Eval.writeMeasureEstimates')
+def writeMeasureEstimates(resultsKey,
+						  G,
+						  estimates,
+						  numVerticesToSample,
+						  parameterSet):
+	measureNames = [
+		('controversy', 'ac'),
+		('sumExpOpinions', 'sumop'),
+		('polarization', 'ap'),
+		('internalConflict', 'aci'),
+		('disCon', 'aidc'),
+		('norms', 'norms'),
+		('ad', 'ad')
+	]
+
+	dataset, opinionDistribution, experimentType = resultsKey
+	measureValues = [(name, G.measures[measure], estimates[measure]) for name, measure in measureNames]
+	getResultsStore().addMeasures(dataset,
+								  opinionDistribution,
+								  experimentType,
+								  measureValues,
+								  parameterValues(parameterSet, experimentType),
+								  numVerticesToSample)
 
+@Instrumentation.timed('Eval.loadGraphForParameters')
 def loadGraphForParameters(dataset, opinionDistribution):
 	prefix = '../include/OpinionQuantities-mine/outputs'
 	graphFile = f'{prefix}/{dataset}_G.txt'
@@ -330,11 +668,12 @@ def loadGraphForParameters(dataset, opinionDistribution):
 	innateOpinionsFile = f'{prefix}/{dataset}_{opinionDistribution}_s.txt'
 	measuresFile = f'{prefix}/{dataset}_{opinionDistribution}_measures.txt'
 
-	G = GraphReader.graphFromSparseCSV(graphFile,
-									   expressedOpinionsFile,
-									   innateOpinionsFile,
-									   measuresFile,
-									   separator=' ')
+	loadGraph = DiskGraph.loadGraph if useDiskIndex else GraphCache.loadGraph
+	G = loadGraph(graphFile,
+				  expressedOpinionsFile,
+				  innateOpinionsFile,
+				  measuresFile,
+				  separator=' ')
 	print(f'	Read graph {dataset} with {G.numVertices} vertices and {G.numEdges} edges.')
 
 	return G
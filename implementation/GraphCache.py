@@ -0,0 +1,211 @@
+import Graph
+import GraphReader
+import Instrumentation
+
+import hashlib
+import json
+import numpy
+import os
+
+'''
+	Binary cache for the text files in outputs/.
+
+	For every source file (e.g., outputs/Advogato_G.txt) the cache is stored
+	in a directory next to it (outputs/Advogato_G.txt.cache/). It contains
+	one .npy file per array, which is memory-mapped when loading, and a file
+	meta.json with the cache version, the size, mtime and hash of the source
+	file, and some additional information (e.g., the number of edges).
+
+	A cache is used if its version matches cacheVersion and the source file
+	did not change. If the mtime or size of the source file changed, we
+	compare the hashes: if the content is still the same, the cache is kept,
+	otherwise it is rebuilt.
+
+	The opinions are not kept in the cache but in the binary opinion files
+	of GraphReader, which are next to the text files.
+'''
+
+cacheVersion = 1
+cacheSuffix = '.cache'
+metaFileName = 'meta.json'
+
+'''
+	Same as GraphReader.graphFromSparseCSV with compact=True, but uses the
+	cache for the graph, the opinions and the measures. The arrays of the
+	returned graph are read-only memory maps.
+'''
+@Instrumentation.timed('GraphCache.loadGraph')
+def loadGraph(graphFile, expressedOpinionsFile, innateOpinionsFile, measuresFilePath, separator=','):
+	arrays, info = loadCSR(graphFile, separator)
+
+	G = Graph.Graph()
+	G.graphFile = graphFile
+	G.expressedOpinionsFile = expressedOpinionsFile
+	G.innateOpinionsFile = innateOpinionsFile
+
+	G.setCSR(arrays['indptr'], arrays['indices'], arrays['cumweights'])
+	G.numVertices = info['numVertices']
+	G.numEdges = info['numEdges']
+	G.totalEdgeWeights = info['totalEdgeWeights']
+
+	G.z = loadOpinions(expressedOpinionsFile, G.numVertices)
+	G.s = loadOpinions(innateOpinionsFile, G.numVertices)
+	G.measures = loadMeasures(measuresFilePath, separator)
+
+	return G
+
+'''
+	Returns the CSR arrays indptr, indices and cumweights of graphFile (as
+	memory maps) and a dict with numVertices, numEdges and
+	totalEdgeWeights.
+'''
+def loadCSR(graphFile, separator=','):
+	arrays, info = loadCache(graphFile, ['indptr', 'indices', 'cumweights'])
+	if arrays is None:
+		n, us, vs, weights = GraphReader.readEdgeArrays(graphFile, separator)
+		indptr, indices, cumweights, numEdges, totalEdgeWeights = GraphReader.csrFromEdgeArrays(n, us, vs, weights)
+		del us, vs, weights
+
+		arrays = {
+			'indptr': indptr,
+			'indices': indices,
+			'cumweights': cumweights
+		}
+		info = {
+			'numVertices': n,
+			'numEdges': int(numEdges),
+			'totalEdgeWeights': float(totalEdgeWeights)
+		}
+		writeCache(graphFile, arrays, info)
+		arrays, info = loadCache(graphFile, ['indptr', 'indices', 'cumweights'])
+
+	return arrays, info
+
+'''
+	Returns the opinions stored in opinionsFilePath as a read-only
+	numpy.memmap of the binary opinion file next to it (see
+	GraphReader.readOpinions), which is converted from the text file if it
+	is missing, was converted from another version of the text file (see
+	GraphReader.isConverted) or is corrupted. If numVertices is given, the
+	number of opinions must match it.
+'''
+@Instrumentation.timed('GraphCache.loadOpinions')
+def loadOpinions(opinionsFilePath, numVertices=None):
+	binaryFilePath = GraphReader.binaryOpinionsPath(opinionsFilePath)
+
+	opinions = None
+	if GraphReader.isConverted(binaryFilePath, opinionsFilePath):
+		try:
+			opinions = GraphReader.readOpinionsBinary(binaryFilePath, verifyChecksum=True)
+		except ValueError:
+			if not os.path.exists(opinionsFilePath):
+				raise
+
+	if opinions is None:
+		GraphReader.convertOpinionsFile(opinionsFilePath, binaryFilePath)
+		opinions = GraphReader.readOpinionsBinary(binaryFilePath)
+
+	GraphReader.checkNumOpinions(opinionsFilePath, opinions, numVertices)
+
+	return opinions
+
+'''
+	Returns the measures stored in measuresFilePath as a dict. The measures
+	are kept in the meta file of the cache.
+'''
+@Instrumentation.timed('GraphCache.loadMeasures')
+def loadMeasures(measuresFilePath, separator=','):
+	_, info = loadCache(measuresFilePath, [])
+	if info is None:
+		info = {'measures': GraphReader.readMeasuresFile(measuresFilePath, separator)}
+		writeCache(measuresFilePath, {}, info)
+
+	return info['measures']
+
+def cacheDirectory(sourceFile):
+	return sourceFile + cacheSuffix
+
+def fileHash(filePath):
+	sha1 = hashlib.sha1()
+	with open(filePath, 'rb') as fp:
+		while True:
+			data = fp.read(1 << 24)
+			if not data:
+				break
+			sha1.update(data)
+
+	return sha1.hexdigest()
+
+'''
+	Returns the arrays (as memory maps) and the additional information that
+	were stored for sourceFile. Returns (None, None) if there is no cache or
+	if it is stale.
+'''
+def loadCache(sourceFile, arrayNames):
+	directory = cacheDirectory(sourceFile)
+	metaFilePath = os.path.join(directory, metaFileName)
+
+	try:
+		with open(metaFilePath) as fp:
+			meta = json.load(fp)
+	except (OSError, ValueError):
+		return None, None
+
+	if meta.get('version') != cacheVersion:
+		return None, None
+
+	stat = os.stat(sourceFile)
+	if stat.st_size != meta['size'] or stat.st_mtime_ns != meta['mtime']:
+		if stat.st_size != meta['size'] or fileHash(sourceFile) != meta['hash']:
+			return None, None
+
+		' the file was touched but did not change '
+		meta['mtime'] = stat.st_mtime_ns
+		writeMeta(directory, meta)
+
+	try:
+		arrays = dict()
+		for name in arrayNames:
+			arrays[name] = numpy.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r')
+	except (OSError, ValueError):
+		return None, None
+
+	return arrays, meta['info']
+
+'''
+	Stores the arrays and the additional information (which must be JSON
+	serializable) for sourceFile. The meta file is written last, so that
+	a cache is never used before it is complete.
+'''
+def writeCache(sourceFile, arrays, info):
+	directory = cacheDirectory(sourceFile)
+	os.makedirs(directory, exist_ok=True)
+
+	metaFilePath = os.path.join(directory, metaFileName)
+	if os.path.exists(metaFilePath):
+		os.remove(metaFilePath)
+
+	stat = os.stat(sourceFile)
+	meta = {
+		'version': cacheVersion,
+		'size': stat.st_size,
+		'mtime': stat.st_mtime_ns,
+		'hash': fileHash(sourceFile),
+		'info': info
+	}
+
+	for name in arrays:
+		arrayFilePath = os.path.join(directory, f'{name}.npy')
+		temporaryFilePath = f'{arrayFilePath}.{os.getpid()}.tmp'
+		with open(temporaryFilePath, 'wb') as fp:
+			numpy.save(fp, numpy.ascontiguousarray(arrays[name]))
+		os.replace(temporaryFilePath, arrayFilePath)
+
+	writeMeta(directory, meta)
+
+def writeMeta(directory, meta):
+	metaFilePath = os.path.join(directory, metaFileName)
+	temporaryFilePath = f'{metaFilePath}.{os.getpid()}.tmp'
+	with open(temporaryFilePath, 'w') as fp:
+		json.dump(meta, fp)
+	os.replace(temporaryFilePath, metaFilePath)
@@ -1,6 +1,34 @@
+import io
 import numpy
+import os
+import struct
+import sys
+import zlib
 
 import Graph
+import Instrumentation
+
+' number of bytes that graphFromSparseCSVBulk parses at once '
+bulkChunkSize = 1 << 26
+
+'''
+	Binary opinion files (e.g., outputs/Advogato_Uniform_z.bin next to
+	outputs/Advogato_Uniform_z.txt) start with a header of
+	opinionsHeaderSize bytes: the magic bytes, the format version, the
+	numpy dtype of the values (always float64 when written here), the
+	number of values n, the CRC32 of the values, and the size and mtime (in
+	nanoseconds) of the text file it was converted from (-1 if there is
+	none). The n values follow directly, so they can be memory-mapped.
+
+	A converted file is only used instead of its text file if the size and
+	mtime of the text file still match the header (see isConverted).
+'''
+opinionsMagic = b'FJOP'
+opinionsVersion = 2
+opinionsHeaderFormat = '<4sI8sQIqq'
+opinionsHeaderSize = 64
+opinionsTextSuffix = '.txt'
+opinionsBinarySuffix = '.bin'
 
 '''
 	Reads a sparse csv file and returns a Graph object.
@@ -8,8 +36,22 @@ import Graph
 	Assumes that the csv-file has the following format:
 	u,v,edgeWeight
 	where u and v are integers and edgeWeight is a float
+
+	If compact is True, the graph is stored as CSR arrays (see
+	Graph.compact()), which needs much less memory, and it is read with the
+	much faster graphFromSparseCSVBulk.
 '''
-def graphFromSparseCSV(graphFile, expressedOpinionsFile, innateOpinionsFile, measuresFilePath, separator=',', skipHeader=False, inputIsZeroIndexed=False):
+@Instrumentation.timed('GraphReader.graphFromSparseCSV')
+def graphFromSparseCSV(graphFile, expressedOpinionsFile, innateOpinionsFile, measuresFilePath, separator=',', skipHeader=False, inputIsZeroIndexed=False, compact=False):
+	if compact:
+		return graphFromSparseCSVBulk(graphFile,
+									  expressedOpinionsFile,
+									  innateOpinionsFile,
+									  measuresFilePath,
+									  separator=separator,
+									  skipHeader=skipHeader,
+									  inputIsZeroIndexed=inputIsZeroIndexed)
+
 	'''
 		since the input file might contain some edges multiple times or as
 		directed edges, we start by summing over all of these weights
@@ -66,12 +108,263 @@ def graphFromSparseCSV(graphFile, expressedOpinionsFile, innateOpinionsFile, mea
 				edgeWeight = neighbors[u][v]
 				G.addEdge(u,v,edgeWeight)
 
-	G.z = readOpinionsFile(expressedOpinionsFile)
-	G.s = readOpinionsFile(innateOpinionsFile)
+	G.z = readOpinions(expressedOpinionsFile, n)
+	G.s = readOpinions(innateOpinionsFile, n)
 	G.measures = readMeasuresFile(measuresFilePath, separator)
 
 	return G
 
+'''
+	Same as graphFromSparseCSV, but parses the file in large chunks into numpy
+	arrays and builds the CSR arrays of a compact graph directly.
+
+	The result is bit-identical to the compacted result of the line-by-line
+	reader: the neighbors of each vertex appear in the same order, duplicate
+	and reversed edges are summed in the order of the file, and the cumulated
+	weights are summed sequentially.
+'''
+@Instrumentation.timed('GraphReader.graphFromSparseCSVBulk')
+def graphFromSparseCSVBulk(graphFile, expressedOpinionsFile, innateOpinionsFile, measuresFilePath, separator=',', skipHeader=False, inputIsZeroIndexed=False):
+	n, us, vs, weights = readEdgeArrays(graphFile, separator, skipHeader)
+
+	if inputIsZeroIndexed:
+		us += 1
+		vs += 1
+
+	if len(us) > 0 and (min(us.min(), vs.min()) < 0 or max(us.max(), vs.max()) >= n):
+		raise ValueError(f'{graphFile} contains vertex ids outside of [0,{n}).')
+
+	G = Graph.Graph()
+	G.graphFile = graphFile
+	G.expressedOpinionsFile = expressedOpinionsFile
+	G.innateOpinionsFile = innateOpinionsFile
+
+	G.numVertices = n
+	indptr, indices, cumweights, numEdges, totalEdgeWeights = csrFromEdgeArrays(n, us, vs, weights)
+	G.setCSR(indptr, indices, cumweights)
+	G.numEdges = numEdges
+	G.totalEdgeWeights = totalEdgeWeights
+
+	G.z = readOpinions(expressedOpinionsFile, n)
+	G.s = readOpinions(innateOpinionsFile, n)
+	G.measures = readMeasuresFile(measuresFilePath, separator)
+
+	return G
+
+'''
+	Reads the edges of a graph file into three arrays (in the order of the
+	file). Returns n together with the arrays us, vs and weights.
+
+	All edge lines must have the same number of columns. If the weights are
+	missing, all edges get weight 1.
+'''
+@Instrumentation.timed('GraphReader.readEdgeArrays')
+def readEdgeArrays(graphFile, separator=',', skipHeader=False):
+	with open(graphFile) as fp:
+		line = fp.readline()
+		if skipHeader:
+			line = fp.readline()
+
+		n = int(line)
+
+		values, numColumns = readEdgeValues(fp, separator)
+
+	us = values['u'].copy()
+	vs = values['v'].copy()
+	if numColumns > 2:
+		weights = values['weight'].copy()
+	else:
+		weights = numpy.ones(len(us))
+
+	return n, us, vs, weights
+
+'''
+	Reads the remaining lines of the open file fp in chunks of bulkChunkSize
+	bytes. Returns the values as a structured array with the fields u, v
+	(int64) and weight (float64, if there are more than two columns)
+	together with the number of columns (see edgeDtype). If separator is None or whitespace, the
+	columns are separated by arbitrary whitespace.
+'''
+def readEdgeValues(fp, separator):
+	chunks = []
+	numColumns = 0
+
+	remainder = ''
+	while True:
+		data = fp.read(bulkChunkSize)
+		if not data:
+			break
+		Instrumentation.count('GraphReader.bytesRead', len(data))
+
+		data = remainder + data
+		lastNewline = data.rfind('\n')
+		if lastNewline == -1:
+			remainder = data
+			continue
+		remainder = data[lastNewline+1:]
+		data = data[:lastNewline+1]
+
+		if numColumns == 0:
+			firstLine = data.strip().split('\n', 1)[0]
+			numColumns = len(str.split(firstLine.strip(), separator))
+
+		chunks.append(parseEdgeChunk(data, separator, numColumns))
+
+	if len(remainder.strip()) > 0:
+		if numColumns == 0:
+			numColumns = len(str.split(remainder.strip(), separator))
+		chunks.append(parseEdgeChunk(remainder, separator, numColumns))
+
+	if len(chunks) == 0:
+		return numpy.zeros(0, dtype=edgeDtype(3)), 3
+
+	return numpy.concatenate(chunks), numColumns
+
+' the vertex ids are integers, the weight and any further columns (e.g., timestamps in raw datasets) are floats '
+def edgeDtype(numColumns):
+	if numColumns < 2:
+		raise ValueError(f'Could not parse edge list: expected at least 2 columns, but found {numColumns}.')
+
+	columns = [('u', numpy.int64), ('v', numpy.int64), ('weight', numpy.float64)]
+	columns += [(f'column{j}', numpy.float64) for j in range(3, numColumns)]
+
+	return columns[:numColumns]
+
+' numpy.loadtxt rejects malformed values, non-integral vertex ids and lines with a different number of columns '
+def parseEdgeChunk(data, separator, numColumns):
+	if separator is not None and separator.strip() == '':
+		separator = None
+
+	try:
+		return numpy.loadtxt(io.StringIO(data), dtype=edgeDtype(numColumns), delimiter=separator, comments=None, ndmin=1)
+	except ValueError as error:
+		raise ValueError(f'Could not parse edge list: {error}') from None
+
+'''
+	Builds the CSR arrays of an undirected graph from an edge list in the
+	same way graphFromSparseCSV does it: self-loops are dropped, the weights
+	of duplicate and reversed edges are summed up, and the neighbors of a
+	vertex u are first its neighbors v < u in increasing order and then its
+	neighbors v > u in the order of their first appearance in the edge list.
+
+	Returns indptr, indices, cumweights, numEdges and totalEdgeWeights.
+'''
+@Instrumentation.timed('GraphReader.csrFromEdgeArrays')
+def csrFromEdgeArrays(n, us, vs, weights):
+	keep = us != vs
+	us = us[keep]
+	vs = vs[keep]
+	weights = weights[keep]
+
+	smaller = numpy.minimum(us, vs)
+	larger = numpy.maximum(us, vs)
+
+	' a stable sort keeps duplicate edges in the order of the file '
+	order = numpy.argsort(smaller * n + larger, kind='stable')
+	smaller = smaller[order]
+	larger = larger[order]
+	weights = weights[order]
+
+	isFirst = numpy.ones(len(order), dtype=bool)
+	isFirst[1:] = (smaller[1:] != smaller[:-1]) | (larger[1:] != larger[:-1])
+	groupStarts = numpy.flatnonzero(isFirst)
+	groupSizes = numpy.diff(numpy.append(groupStarts, len(order)))
+
+	' sum up duplicates sequentially to get the same rounding as the dicts '
+	groupEnds = groupStarts + groupSizes
+	edgeWeights = cumulateRows(numpy.append(groupStarts, len(order)), weights)[groupEnds-1]
+
+	smaller = smaller[groupStarts]
+	larger = larger[groupStarts]
+	firstPositions = order[groupStarts]
+	numEdges = len(groupStarts)
+
+	'''
+		Each edge creates two entries. In row larger, it is sorted by the
+		smaller endpoint; in row smaller, it comes after all of those and is
+		sorted by its first position in the file.
+	'''
+	rows = numpy.concatenate((larger, smaller))
+	cols = numpy.concatenate((smaller, larger))
+	secondaryKeys = numpy.concatenate((smaller, n + firstPositions))
+	maxSecondaryKey = n + len(order)
+	if n * maxSecondaryKey < numpy.iinfo(numpy.int64).max:
+		entryOrder = numpy.argsort(rows * maxSecondaryKey + secondaryKeys)
+	else:
+		entryOrder = numpy.lexsort((secondaryKeys, rows))
+	rows = rows[entryOrder]
+
+	indices = cols[entryOrder].astype(Graph.indexDtype(n))
+	entryWeights = numpy.concatenate((edgeWeights, edgeWeights))[entryOrder]
+
+	degrees = numpy.bincount(rows, minlength=n)
+	indptr = numpy.zeros(n+1, dtype=numpy.int64)
+	numpy.cumsum(degrees, out=indptr[1:])
+
+	cumweights = cumulateRows(indptr, entryWeights)
+
+	' graphFromSparseCSV adds the edges in the order of the upper entries '
+	isUpper = entryOrder >= numEdges
+	totalEdgeWeights = 0
+	if numEdges > 0:
+		totalEdgeWeights = numpy.cumsum(entryWeights[isUpper])[-1]
+
+	return indptr, indices, cumweights, numEdges, totalEdgeWeights
+
+'''
+	Computes the prefix sums of the values within each row of a CSR matrix.
+	The additions are done sequentially within each row (and thus with the
+	same rounding as appending to a list), but for all rows at once:
+	iteration j updates the j-th entry of every row with more than j entries.
+'''
+def cumulateRows(indptr, values):
+	cumulated = values.copy()
+
+	degrees = numpy.diff(indptr)
+	rowsByDegree = numpy.argsort(-degrees, kind='stable')
+	starts = indptr[:-1][rowsByDegree]
+	sortedDegrees = degrees[rowsByDegree]
+
+	maxDegree = sortedDegrees[0] if len(sortedDegrees) > 0 else 0
+	numActiveRows = numpy.searchsorted(-sortedDegrees, -numpy.arange(1, maxDegree), side='left')
+	for j in range(1, maxDegree):
+		positions = starts[:numActiveRows[j-1]] + j
+		cumulated[positions] += cumulated[positions-1]
+
+	return cumulated
+
+'''
+	Returns the opinions of opinionsFilePath: a read-only memory map if it
+	is a binary opinion file or if the binary file next to it was converted
+	from the current text file (see binaryOpinionsPath and isConverted),
+	otherwise a list. The checksum of a converted file is verified, and if
+	it is corrupted, the text file is read instead. If numVertices is given,
+	the number of opinions must match it.
+'''
+def readOpinions(opinionsFilePath, numVertices=None):
+	binaryFilePath = binaryOpinionsPath(opinionsFilePath)
+	opinions = None
+	if binaryFilePath == opinionsFilePath:
+		opinions = readOpinionsBinary(binaryFilePath)
+	elif isConverted(binaryFilePath, opinionsFilePath):
+		try:
+			opinions = readOpinionsBinary(binaryFilePath, verifyChecksum=True)
+		except ValueError:
+			if not os.path.exists(opinionsFilePath):
+				raise
+
+	if opinions is None:
+		opinions = readOpinionsFile(opinionsFilePath)
+
+	checkNumOpinions(opinionsFilePath, opinions, numVertices)
+
+	return opinions
+
+def checkNumOpinions(opinionsFilePath, opinions, numVertices):
+	if numVertices is not None and len(opinions) != numVertices:
+		raise ValueError(f'{opinionsFilePath} contains {len(opinions)} opinions, but the graph has {numVertices} vertices.')
+
+@Instrumentation.timed('GraphReader.readOpinionsFile')
 def readOpinionsFile(opinionsFilePath):
 	opinions = []
 
@@ -85,6 +378,120 @@ def readOpinionsFile(opinionsFilePath):
 
 	return opinions
 
+'''
+	Returns the values of a binary opinion file as a read-only numpy.memmap.
+	If verifyChecksum is True, all values are read to compare their CRC32
+	with the header.
+'''
+@Instrumentation.timed('GraphReader.readOpinionsBinary')
+def readOpinionsBinary(opinionsFilePath, verifyChecksum=False):
+	dtype, n, checksum, _ = readOpinionsHeader(opinionsFilePath)
+	if os.path.getsize(opinionsFilePath) != opinionsHeaderSize + n * dtype.itemsize:
+		raise ValueError(f'{opinionsFilePath} is truncated: expected {n} values.')
+
+	' numpy.memmap cannot map zero bytes '
+	if n == 0:
+		return numpy.zeros(0, dtype=dtype)
+
+	opinions = numpy.memmap(opinionsFilePath, dtype=dtype, mode='r', offset=opinionsHeaderSize, shape=(n,))
+	if verifyChecksum and zlib.crc32(opinions) != checksum:
+		raise ValueError(f'{opinionsFilePath} is corrupted: checksum mismatch.')
+
+	return opinions
+
+'''
+	Returns the dtype, the number of values, the CRC32 and the (size, mtime)
+	of the source file from the header of a binary opinion file.
+'''
+def readOpinionsHeader(opinionsFilePath):
+	with open(opinionsFilePath, 'rb') as fp:
+		header = fp.read(opinionsHeaderSize)
+
+	if len(header) < opinionsHeaderSize:
+		raise ValueError(f'{opinionsFilePath} is not a binary opinion file.')
+
+	magic, version, dtype, n, checksum, sourceSize, sourceMtime = struct.unpack_from(opinionsHeaderFormat, header)
+	if magic != opinionsMagic or version != opinionsVersion:
+		raise ValueError(f'{opinionsFilePath} is not a binary opinion file of version {opinionsVersion}.')
+
+	return numpy.dtype(dtype.rstrip(b'\0').decode()), n, checksum, (sourceSize, sourceMtime)
+
+'''
+	Writes the opinions as a binary opinion file. The file is written to a
+	temporary file first, so readers never see a partial file. sourceStamp
+	is the size and mtime of the text file the opinions were read from (see
+	fileStamp), if any.
+'''
+def writeOpinionsBinary(opinionsFilePath, opinions, sourceStamp=(-1, -1)):
+	opinions = numpy.ascontiguousarray(opinions, dtype=numpy.float64)
+	sourceSize, sourceMtime = sourceStamp
+	header = struct.pack(opinionsHeaderFormat,
+						 opinionsMagic,
+						 opinionsVersion,
+						 opinions.dtype.str.encode(),
+						 len(opinions),
+						 zlib.crc32(opinions),
+						 sourceSize,
+						 sourceMtime)
+
+	temporaryFilePath = f'{opinionsFilePath}.{os.getpid()}.tmp'
+	with open(temporaryFilePath, 'wb') as fp:
+		fp.write(header.ljust(opinionsHeaderSize, b'\0'))
+		opinions.tofile(fp)
+	os.replace(temporaryFilePath, opinionsFilePath)
+
+'''
+	Converts the text opinion file textFilePath (one value per line) into a
+	binary opinion file, by default next to it (see binaryOpinionsPath).
+	Returns the path of the binary file.
+'''
+@Instrumentation.timed('GraphReader.convertOpinionsFile')
+def convertOpinionsFile(textFilePath, binaryFilePath=None):
+	if binaryFilePath is None:
+		binaryFilePath = binaryOpinionsPath(textFilePath)
+
+	' the stamp is taken before reading, so a text file that changes meanwhile is converted again later '
+	sourceStamp = fileStamp(textFilePath)
+	with open(textFilePath) as fp:
+		opinions = numpy.array(fp.read().split(), dtype=numpy.float64)
+
+	writeOpinionsBinary(binaryFilePath, opinions, sourceStamp)
+
+	return binaryFilePath
+
+' outputs/Advogato_Uniform_z.txt -> outputs/Advogato_Uniform_z.bin '
+def binaryOpinionsPath(opinionsFilePath):
+	if opinionsFilePath.endswith(opinionsTextSuffix):
+		return opinionsFilePath[:-len(opinionsTextSuffix)] + opinionsBinarySuffix
+	if opinionsFilePath.endswith(opinionsBinarySuffix):
+		return opinionsFilePath
+	return opinionsFilePath + opinionsBinarySuffix
+
+'''
+	Returns True if binaryFilePath is a binary opinion file that was
+	converted from the current version of textFilePath, i.e., the size and
+	mtime of textFilePath match the header. Also True if only binaryFilePath
+	exists.
+'''
+def isConverted(binaryFilePath, textFilePath):
+	if not os.path.exists(binaryFilePath):
+		return False
+	if not os.path.exists(textFilePath):
+		return True
+
+	try:
+		_, _, _, sourceStamp = readOpinionsHeader(binaryFilePath)
+	except ValueError:
+		return False
+
+	return sourceStamp == fileStamp(textFilePath)
+
+' size and mtime (in nanoseconds) of a file '
+def fileStamp(filePath):
+	stat = os.stat(filePath)
+	return stat.st_size, stat.st_mtime_ns
+
+@Instrumentation.timed('GraphReader.readMeasuresFile')
 def readMeasuresFile(measuresFilePath, separator=','):
 	measures = dict()
 
@@ -101,3 +508,11 @@ def readMeasuresFile(measuresFilePath, separator=','):
 
 	return measures
 
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		print(f'usage: python {sys.argv[0]} <opinions file> [<opinions file> ...]')
+		sys.exit(1)
+
+	for textFilePath in sys.argv[1:]:
+		binaryFilePath = convertOpinionsFile(textFilePath)
+		print(f'Converted {textFilePath} to {binaryFilePath}.')
@@ -0,0 +1,259 @@
+import GraphReader
+
+import numpy
+import scipy.sparse
+import scipy.sparse.csgraph
+import scipy.sparse.linalg
+import sys
+import time
+
+'''
+	Python version of include/OpinionQuantities-mine/Main.jl: computes the
+	largest connected component of a raw dataset, the innate opinions, the
+	expressed opinions and the measures, and writes them to outputs/ in the
+	same format as the Julia code.
+
+	Unlike Main.jl, the raw graph is only read once per dataset (and not
+	once per opinion distribution), and the linear systems (I+L)z=s of all
+	opinion distributions are solved together in one call of the conjugate
+	gradient method (see solveOpinions).
+
+	Usage (from implementation/):
+		python GroundTruth.py Advogato
+		python GroundTruth.py Advogato,weighted Uniform Exponential
+'''
+
+dataFolderPath = '../include/OpinionQuantities-mine/data'
+outputsFolderPath = '../include/OpinionQuantities-mine/outputs'
+
+opinionDistributions = ['Uniform', 'Exponential', 'Eigenvalue']
+
+def runPipeline(dataset, networkType='unweighted', opinionDistributions=opinionDistributions, seed=None):
+	rng = numpy.random.default_rng(seed)
+
+	rawGraphFile = f'{dataFolderPath}/{dataset}.txt'
+	numVertices, us, vs, weights = readRawGraph(rawGraphFile, networkType == 'weighted')
+	numVertices, us, vs, weights = largestConnectedComponent(numVertices, us, vs, weights)
+	print(f'	LCC of {dataset} has {numVertices} vertices and {len(us)} edges.')
+
+	prefix = f'{outputsFolderPath}/{dataset}'
+	writeGraphFile(f'{prefix}_G.txt', numVertices, us, vs, weights)
+	writeOpinionsAndMeasures(prefix, numVertices, us, vs, weights, opinionDistributions, rng)
+
+'''
+	Reads a raw dataset as readGraph in Graph.jl: the vertices are relabeled
+	0..n-1 in the order of their first appearance, self-loops are dropped
+	and every edge (u,v,w) is only kept once. If weighted is False, all
+	edges get weight 1.
+'''
+def readRawGraph(rawGraphFile, weighted=False):
+	with open(rawGraphFile) as fp:
+		values, numColumns = GraphReader.readEdgeValues(fp, None)
+
+	us = values['u'].copy()
+	vs = values['v'].copy()
+	if weighted:
+		weights = values['weight'].copy()
+	else:
+		weights = numpy.ones(len(us))
+	del values
+
+	keep = us != vs
+	us = us[keep]
+	vs = vs[keep]
+	weights = weights[keep]
+
+	' relabel the vertices in the order in which they appear (u before v) '
+	endpoints = numpy.column_stack((us, vs)).ravel()
+	originalIds, firstOccurrences, labels = numpy.unique(endpoints, return_index=True, return_inverse=True)
+	order = numpy.argsort(firstOccurrences, kind='stable')
+	ranks = numpy.empty(len(order), dtype=numpy.int64)
+	ranks[order] = numpy.arange(len(order))
+	labels = ranks[labels].reshape(-1, 2)
+	us = labels[:,0]
+	vs = labels[:,1]
+
+	' remove duplicate edges (with the same weight) '
+	smaller = numpy.minimum(us, vs)
+	larger = numpy.maximum(us, vs)
+	_, firstOccurrences = numpy.unique(numpy.column_stack((smaller, larger, weights.view(numpy.int64))), axis=0, return_index=True)
+	firstOccurrences.sort()
+
+	return len(originalIds), smaller[firstOccurrences], larger[firstOccurrences], weights[firstOccurrences]
+
+'''
+	Returns the largest connected component, where the vertices are
+	relabeled 0..n'-1 (keeping their order). If there are several largest
+	components, the one with the smallest vertex is returned.
+'''
+def largestConnectedComponent(numVertices, us, vs, weights):
+	adjacency = scipy.sparse.coo_matrix((numpy.ones(len(us)), (us, vs)), shape=(numVertices, numVertices))
+	_, components = scipy.sparse.csgraph.connected_components(adjacency, directed=False)
+
+	largestComponent = numpy.argmax(numpy.bincount(components))
+	inComponent = components == largestComponent
+	labels = numpy.cumsum(inComponent) - 1
+
+	keep = inComponent[us]
+	return int(numpy.sum(inComponent)), labels[us[keep]], labels[vs[keep]], weights[keep]
+
+'''
+	Returns I+L as a sparse CSR matrix. The weights of parallel edges are
+	summed up.
+'''
+def identityPlusLaplacian(numVertices, us, vs, weights):
+	adjacency = scipy.sparse.coo_matrix((weights, (us, vs)), shape=(numVertices, numVertices)).tocsr()
+	adjacency = adjacency + adjacency.T
+	degrees = numpy.asarray(adjacency.sum(axis=1)).ravel()
+
+	return (scipy.sparse.diags(1 + degrees) - adjacency).tocsr()
+
+'''
+	Returns innate opinions in [0,1] as generated by Tools.jl. The
+	Eigenvalue opinions need the Laplacian L.
+'''
+def innateOpinions(opinionDistribution, numVertices, rng, laplacian=None):
+	if opinionDistribution == 'Uniform':
+		return rng.random(numVertices)
+	elif opinionDistribution == 'Exponential':
+		x = 1 - numpy.log(1 - rng.random(numVertices))
+		return x / numpy.max(x)
+	elif opinionDistribution == 'Eigenvalue':
+		return eigenvalueOpinions(laplacian, rng)
+
+	raise ValueError(f'Unknown opinion distribution {opinionDistribution}.')
+
+'''
+	Returns the eigenvector of the second smallest eigenvalue of L, shifted
+	and scaled to [0,1] (see eigenvalueOpinions in Tools.jl).
+'''
+def eigenvalueOpinions(laplacian, rng, tolerance=1e-6, maxIterations=1000):
+	numVertices = laplacian.shape[0]
+	firstEigenvector = numpy.full((numVertices, 1), 1 / numpy.sqrt(numVertices))
+	preconditioner = scipy.sparse.diags(1 / (1 + laplacian.diagonal()))
+
+	_, eigenvectors = scipy.sparse.linalg.lobpcg(laplacian,
+												 rng.random((numVertices, 1)),
+												 M=preconditioner,
+												 Y=firstEigenvector,
+												 tol=tolerance,
+												 maxiter=maxIterations,
+												 largest=False)
+
+	y = eigenvectors[:,0]
+	y = y - numpy.min(y)
+	return y / numpy.max(y)
+
+'''
+	Solves (I+L)X = B for all columns of B with the conjugate gradient
+	method with Jacobi preconditioner. All columns are updated together, so
+	every iteration needs one sparse matrix times dense matrix product
+	instead of one sparse matrix-vector product per column.
+'''
+def solveOpinions(identityPlusLaplacian, B, tolerance=1e-10, maxIterations=10000):
+	diagonal = identityPlusLaplacian.diagonal()[:,None]
+
+	X = numpy.zeros(B.shape)
+	R = numpy.array(B, dtype=numpy.float64)
+	Z = R / diagonal
+	P = Z.copy()
+	rz = numpy.sum(R * Z, axis=0)
+	normsB = numpy.maximum(numpy.linalg.norm(B, axis=0), 1e-300)
+
+	for iteration in range(maxIterations):
+		if numpy.all(numpy.linalg.norm(R, axis=0) <= tolerance * normsB):
+			break
+
+		AP = identityPlusLaplacian @ P
+		alpha = rz / numpy.maximum(numpy.sum(P * AP, axis=0), 1e-300)
+		X += alpha * P
+		R -= alpha * AP
+
+		Z = R / diagonal
+		rzNew = numpy.sum(R * Z, axis=0)
+		P = Z + (rzNew / numpy.maximum(rz, 1e-300)) * P
+		rz = rzNew
+
+	return X
+
+'''
+	Returns the measures as computed by Approx in Algorithm.jl, given the
+	solutions z and centeredZ of (I+L)z=s and (I+L)centeredZ=s-avg(s).
+'''
+def computeMeasures(identityPlusLaplacian, s, z, centeredZ):
+	avgs = numpy.mean(s)
+
+	' L x = (I+L)x - x '
+	Lz = identityPlusLaplacian @ z - z
+	LcenteredZ = identityPlusLaplacian @ centeredZ - centeredZ
+
+	measures = dict()
+	measures['aci'] = float(Lz @ Lz)
+	measures['ad'] = float(centeredZ @ LcenteredZ)
+	measures['ap'] = float(centeredZ @ centeredZ)
+	measures['ac'] = float(z @ z)
+	measures['aidc'] = measures['ad'] + measures['ac']
+	measures['sumop'] = float(avgs * len(s))
+	measures['avgop'] = float(avgs)
+	measures['norms'] = float(s @ s)
+
+	return measures
+
+'''
+	Generates the innate opinions of all opinion distributions, computes the
+	expressed opinions and the measures, and writes them to
+	prefix_<distribution>_{s,z,measures}.txt. The time in the measures files
+	is the time for solving all linear systems and computing the measures,
+	divided by the number of opinion distributions.
+'''
+def writeOpinionsAndMeasures(prefix, numVertices, us, vs, weights, opinionDistributions, rng):
+	identityPlusL = identityPlusLaplacian(numVertices, us, vs, weights)
+	laplacian = identityPlusL - scipy.sparse.identity(numVertices, format='csr')
+
+	innateOpinionsPerDistribution = [innateOpinions(opinionDistribution, numVertices, rng, laplacian) for opinionDistribution in opinionDistributions]
+
+	t = time.time()
+	rightHandSides = []
+	for s in innateOpinionsPerDistribution:
+		rightHandSides.append(s)
+		rightHandSides.append(s - numpy.mean(s))
+	solutions = solveOpinions(identityPlusL, numpy.column_stack(rightHandSides))
+
+	measuresPerDistribution = []
+	for i, s in enumerate(innateOpinionsPerDistribution):
+		measuresPerDistribution.append(computeMeasures(identityPlusL, s, solutions[:,2*i], solutions[:,2*i+1]))
+	totalTime = time.time() - t
+
+	for i, opinionDistribution in enumerate(opinionDistributions):
+		measures = measuresPerDistribution[i]
+		measures['time'] = totalTime / len(opinionDistributions)
+
+		writeVector(f'{prefix}_{opinionDistribution}_s.txt', innateOpinionsPerDistribution[i])
+		writeVector(f'{prefix}_{opinionDistribution}_z.txt', solutions[:,2*i])
+		writeMeasuresFile(f'{prefix}_{opinionDistribution}_measures.txt', measures)
+
+def writeGraphFile(graphFile, numVertices, us, vs, weights):
+	with open(graphFile, 'w') as fp:
+		fp.write(f'{numVertices}\n')
+		for u, v, weight in zip(us.tolist(), vs.tolist(), weights.tolist()):
+			fp.write(f'{u} {v} {weight}\n')
+
+def writeVector(filePath, values):
+	with open(filePath, 'w') as fp:
+		for value in values.tolist():
+			fp.write(f'{value}\n')
+
+def writeMeasuresFile(filePath, measures):
+	with open(filePath, 'w') as fp:
+		for name in ['time', 'aci', 'ad', 'ap', 'ac', 'aidc', 'sumop', 'avgop', 'norms']:
+			fp.write(f'{name} {measures[name]}\n')
+
+if __name__ == '__main__':
+	if len(sys.argv) < 2:
+		print(f'usage: python {sys.argv[0]} <dataset>[,weighted] [opinion distributions]')
+		sys.exit(1)
+
+	datasetAndType = sys.argv[1].split(',')
+	networkType = datasetAndType[1] if len(datasetAndType) > 1 else 'unweighted'
+
+	runPipeline(datasetAndType[0], networkType, sys.argv[2:] or opinionDistributions)
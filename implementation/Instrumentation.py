@@ -0,0 +1,184 @@
+import collections
+import functools
+import json
+import os
+import threading
+import time
+
+'''
+	Named spans and counters for profiling the experiments.
+
+	Spans measure the time of a block or of a function:
+		with Instrumentation.span('Graph.compact'):
+			...
+
+		@Instrumentation.timed('Estimator.estimateInnateOpinions')
+		def estimateInnateOpinions(...):
+
+	Counters accumulate numbers (e.g., walk steps or bytes read):
+		Instrumentation.count('GraphReader.bytesRead', len(data))
+
+	The instrumentation is disabled by default. Then span returns a shared
+	no-op context manager, timed functions only check the flag and count
+	returns immediately. Hot paths should check Instrumentation.enabled
+	before computing the value of a counter.
+
+	writeReport writes a summary table (total time and number of calls per
+	span, value per counter) and a trace in the Chrome trace event format,
+	which can be opened in chrome://tracing or https://ui.perfetto.dev.
+'''
+
+enabled = False
+
+' the trace keeps at most this many spans, the totals are always updated '
+maxTraceEvents = 1 << 20
+
+' name -> [number of calls, total time in seconds] '
+spanTotals = dict()
+counters = collections.Counter()
+traceEvents = []
+startTime = time.perf_counter()
+
+class NullSpan:
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		return False
+
+nullSpan = NullSpan()
+
+class Span:
+	def __init__(self, name, args):
+		self.name = name
+		self.args = args
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, *args):
+		recordSpan(self.name, self.start, time.perf_counter() - self.start, self.args)
+		return False
+
+def span(name, **args):
+	if not enabled:
+		return nullSpan
+	return Span(name, args)
+
+'''
+	Decorator that records a span with the given name for every call of the
+	function.
+'''
+def timed(name):
+	def decorator(function):
+		@functools.wraps(function)
+		def wrapper(*args, **kwargs):
+			if not enabled:
+				return function(*args, **kwargs)
+			with Span(name, None):
+				return function(*args, **kwargs)
+		return wrapper
+	return decorator
+
+def count(name, value=1):
+	if enabled:
+		counters[name] += value
+
+def recordSpan(name, start, duration, args):
+	totals = spanTotals.get(name)
+	if totals is None:
+		totals = spanTotals[name] = [0, 0.0]
+	totals[0] += 1
+	totals[1] += duration
+
+	if len(traceEvents) < maxTraceEvents:
+		event = {
+			'name': name,
+			'ph': 'X',
+			'ts': (start - startTime) * 1e6,
+			'dur': duration * 1e6,
+			'pid': os.getpid(),
+			'tid': threading.get_ident()
+		}
+		if args:
+			event['args'] = args
+		traceEvents.append(event)
+
+def reset():
+	global startTime
+	spanTotals.clear()
+	counters.clear()
+	traceEvents.clear()
+	startTime = time.perf_counter()
+
+'''
+	Returns the spans and counters recorded so far (e.g., in a worker
+	process) and clears them, without resetting the start time. The result
+	can be added to the data of another process with mergeState.
+'''
+def takeState():
+	state = {
+		'spanTotals': dict(spanTotals),
+		'counters': dict(counters),
+		'traceEvents': list(traceEvents)
+	}
+
+	spanTotals.clear()
+	counters.clear()
+	traceEvents.clear()
+
+	return state
+
+def mergeState(state):
+	for name, (calls, totalTime) in state['spanTotals'].items():
+		totals = spanTotals.setdefault(name, [0, 0.0])
+		totals[0] += calls
+		totals[1] += totalTime
+
+	counters.update(state['counters'])
+
+	numFreeEvents = max(0, maxTraceEvents - len(traceEvents))
+	traceEvents.extend(state['traceEvents'][:numFreeEvents])
+
+def summaryTable():
+	elapsedTime = time.perf_counter() - startTime
+
+	lines = [f'total time: {elapsedTime:.3f}s', '']
+	lines.append(f'{"span":<50} {"calls":>10} {"total [s]":>12} {"mean [ms]":>12}')
+	for name, (calls, totalTime) in sorted(spanTotals.items(), key=lambda item: -item[1][1]):
+		lines.append(f'{name:<50} {calls:>10} {totalTime:>12.3f} {1000*totalTime/calls:>12.3f}')
+
+	lines.append('')
+	lines.append(f'{"counter":<50} {"value":>23}')
+	for name, value in sorted(counters.items()):
+		lines.append(f'{name:<50} {value:>23}')
+
+	return '\n'.join(lines) + '\n'
+
+def writeChromeTrace(filePath):
+	events = list(traceEvents)
+	events.append({
+		'name': 'counters',
+		'ph': 'C',
+		'ts': (time.perf_counter() - startTime) * 1e6,
+		'pid': os.getpid(),
+		'args': dict(counters)
+	})
+
+	' counters and span arguments may be numpy scalars '
+	with open(filePath, 'w') as fp:
+		json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp, default=lambda value: value.item())
+
+'''
+	Prints the summary table and writes it to prefix_summary.txt, and writes
+	the trace to prefix_trace.json.
+'''
+def writeReport(prefix):
+	table = summaryTable()
+	print(table)
+
+	with open(f'{prefix}_summary.txt', 'w') as fp:
+		fp.write(table)
+
+	writeChromeTrace(f'{prefix}_trace.json')
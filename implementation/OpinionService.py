@@ -0,0 +1,559 @@
+import Estimator
+import Instrumentation
+
+import collections
+import http.server
+import json
+import numpy
+import os
+import queue
+import socketserver
+import sys
+import threading
+import time
+import urllib.parse
+
+'''
+	Long-lived service that answers opinion and measure queries on a loaded
+	graph, without running a full experiment in Eval:
+		service = OpinionService(G)
+		service.opinions([1, 2, 3], engine='native', parameters={'numSteps': 100, 'numWalks': 1000})
+		service.measures(1000, engine='native', parameters={'numSteps': 100, 'numWalks': 1000})
+
+	The estimates of single vertices are kept in an LRU cache (see
+	EstimateCache), keyed by the vertex, the engine and the parameters, so
+	repeated queries do not run the oracle again.
+
+	Cache misses are not estimated in the thread of the query. Instead, they
+	are put into a queue, from which a single batching thread collects all
+	requests that arrive within batchWindow seconds and estimates the
+	missing vertices of all requests with the same engine and parameters in
+	one call of the estimator. Since only this thread calls the estimators,
+	the oracle sessions are never used concurrently.
+
+	The engine is one of the engines of Estimator.estimateExpressedOpinions
+	('external', 'native', 'adaptive', 'push', 'hybrid') or 'innate' for the
+	innate opinions (see Estimator.estimateInnateOpinions).
+
+	The service listens to the changes of the graph (see Graph.notifyChange,
+	e.g., G.setInnateOpinion(u, 0.5) or G.updateEdgeWeight(u, v, 2.0) on a
+	dynamic graph) and only drops the cached estimates that may be affected
+	by a change (see affectedVertices). While the service is running, the
+	graph should only be changed through changeGraph, e.g.,
+		service.changeGraph(lambda: G.updateEdgeWeight(u, v, 2.0))
+	which runs the change on the batching thread between two estimations.
+	Estimates that were computed while the graph changed are not cached.
+	The engine 'external' reads the graph from its files, which do not
+	contain the changes, so it is rejected once the graph changed.
+
+	serve makes the service reachable over HTTP (address (host, port)) or a
+	Unix socket (address is a path), e.g.:
+		python OpinionService.py Toy Uniform 8080
+		curl 'localhost:8080/opinions?vertices=1,2,3&engine=native&numSteps=100&numWalks=1000'
+		curl 'localhost:8080/measures?numVertices=1000&engine=native&numSteps=100&numWalks=1000'
+		curl 'localhost:8080/stats'
+'''
+
+defaultParameters = {
+	'numSteps': 100,
+	'numWalks': 1000,
+	'numSamples': 100,
+	'repetitions': 1
+}
+
+'''
+	Thread-safe LRU cache of vertex estimates with at most maxEntries
+	entries. The least recently used entries are evicted first.
+'''
+class EstimateCache:
+	def __init__(self, maxEntries):
+		self.maxEntries = maxEntries
+		self.entries = collections.OrderedDict()
+		self.lock = threading.Lock()
+
+		self.hits = 0
+		self.misses = 0
+
+		' number of entries per engine and parameters (the second part of the keys) '
+		self.numEntriesPerParameters = collections.Counter()
+
+		' the supports of the entries that have one (see store), and for every vertex the keys whose support contains it '
+		self.supports = dict()
+		self.dependentKeys = collections.defaultdict(set)
+
+	'''
+		Returns the cached values of the given keys and the list of keys
+		that are not cached.
+	'''
+	def lookup(self, keys):
+		values = dict()
+		missingKeys = []
+		with self.lock:
+			for key in keys:
+				if key in self.entries:
+					self.entries.move_to_end(key)
+					values[key] = self.entries[key]
+				else:
+					missingKeys.append(key)
+
+			self.hits += len(values)
+			self.misses += len(missingKeys)
+
+		Instrumentation.count('OpinionService.cacheHits', len(values))
+		Instrumentation.count('OpinionService.cacheMisses', len(missingKeys))
+
+		return values, missingKeys
+
+	'''
+		Stores the given values. If supports is given, supports[key] are
+		the only vertices whose changes can affect values[key], and the
+		entry is dropped by invalidateDependents if one of them changes.
+	'''
+	def store(self, values, supports=None):
+		with self.lock:
+			for key, value in values.items():
+				if key not in self.entries:
+					self.numEntriesPerParameters[key[1]] += 1
+				self.removeSupport(key)
+				self.entries[key] = value
+				self.entries.move_to_end(key)
+
+				if supports is not None:
+					self.addSupport(key, supports[key])
+
+			while len(self.entries) > self.maxEntries:
+				key, _ = self.entries.popitem(last=False)
+				self.removeSupport(key)
+				self.removeParameters(key[1], 1)
+
+	' returns the engines and parameters that have cached entries '
+	def cachedParameters(self):
+		with self.lock:
+			return list(self.numEntriesPerParameters.keys())
+
+	'''
+		Removes the entries of the given vertices with the given engine and
+		parameters. If vertices is None, all entries with these parameters
+		are removed. Returns the number of removed entries.
+	'''
+	def invalidate(self, vertices, parameters):
+		with self.lock:
+			if vertices is None:
+				keys = [key for key in self.entries if key[1] == parameters]
+			else:
+				keys = [(u, parameters) for u in vertices if (u, parameters) in self.entries]
+
+			for key in keys:
+				del self.entries[key]
+				self.removeSupport(key)
+			self.removeParameters(parameters, len(keys))
+
+		Instrumentation.count('OpinionService.invalidatedEntries', len(keys))
+
+		return len(keys)
+
+	'''
+		Removes the entries whose supports (see store) contain one of the
+		given vertices. Returns the number of removed entries.
+	'''
+	def invalidateDependents(self, vertices):
+		with self.lock:
+			keys = set()
+			for w in vertices:
+				keys.update(self.dependentKeys.get(w, ()))
+
+			for key in keys:
+				del self.entries[key]
+				self.removeSupport(key)
+				self.removeParameters(key[1], 1)
+
+		Instrumentation.count('OpinionService.invalidatedEntries', len(keys))
+
+		return len(keys)
+
+	def addSupport(self, key, support):
+		self.supports[key] = support
+		for w in support.tolist():
+			self.dependentKeys[w].add(key)
+
+	def removeSupport(self, key):
+		support = self.supports.pop(key, None)
+		if support is None:
+			return
+
+		for w in support.tolist():
+			keys = self.dependentKeys[w]
+			keys.discard(key)
+			if not keys:
+				del self.dependentKeys[w]
+
+	def removeParameters(self, parameters, numEntries):
+		self.numEntriesPerParameters[parameters] -= numEntries
+		if self.numEntriesPerParameters[parameters] <= 0:
+			del self.numEntriesPerParameters[parameters]
+
+	def __len__(self):
+		return len(self.entries)
+
+' a set of vertices whose opinions should be estimated by the batching thread '
+class EstimationRequest:
+	def __init__(self, vertices, engine, parameters):
+		self.vertices = vertices
+		self.engine = engine
+		self.parameters = parameters
+
+		self.done = threading.Event()
+		self.opinions = None
+		self.error = None
+
+' a change of the graph that should be run by the batching thread '
+class GraphChange:
+	def __init__(self, change):
+		self.change = change
+
+		self.done = threading.Event()
+		self.result = None
+		self.error = None
+
+class OpinionService:
+	def __init__(self, G, cacheSize=1 << 20, batchWindow=0.002, maxAffectedVertices=100000):
+		self.G = G
+		self.cache = EstimateCache(cacheSize)
+		self.batchWindow = batchWindow
+		self.maxAffectedVertices = maxAffectedVertices
+
+		' incremented on every change of the graph, estimates are only cached if it did not change during their estimation '
+		self.graphVersion = 0
+		self.versionLock = threading.Lock()
+
+		' the push estimates depend on min(s) and max(s), see Estimator.estimateExpressedOpinionsWithPush '
+		self.opinionRange = opinionRange(G)
+
+		G.changeListeners.append(self.graphChanged)
+
+		self.requests = queue.Queue()
+		self.batchingThread = threading.Thread(target=self.processRequests, daemon=True)
+		self.batchingThread.start()
+
+	'''
+		Returns a dict with the estimated opinions of the given vertices.
+		Cached estimates are returned immediately, all others are estimated
+		by the batching thread. Raises a ValueError if a vertex is not in the
+		graph.
+	'''
+	def opinions(self, vertices, engine='native', parameters=None):
+		if engine == 'external' and self.graphVersion > 0:
+			raise ValueError('The external oracle reads the graph from its files and cannot be used after the graph changed.')
+
+		vertices = [int(u) for u in vertices]
+		for u in vertices:
+			if u < 0 or u >= self.G.numVertices:
+				raise ValueError(f'Vertex {u} is not in the graph with {self.G.numVertices} vertices.')
+
+		parameters = dict(defaultParameters, **(parameters or dict()))
+		key = parametersKey(engine, parameters)
+
+		cachedValues, missingKeys = self.cache.lookup([(u, key) for u in vertices])
+		opinions = {u: value for (u, _), value in cachedValues.items()}
+
+		if missingKeys:
+			request = EstimationRequest([u for u, _ in missingKeys], engine, parameters)
+			self.requests.put(request)
+			request.done.wait()
+			if request.error is not None:
+				raise request.error
+			opinions.update(request.opinions)
+
+		return opinions
+
+	'''
+		Estimates the measures from numVertices vertices that are sampled
+		uniformly at random (with replacement, every vertex is only counted
+		once as in Eval.runExperimentsEstimateMeasures). For the engine
+		'innate', the expressed opinions are the ground truth, otherwise the
+		innate opinions are.
+	'''
+	def measures(self, numVertices, engine='native', parameters=None):
+		sampledVertices = numpy.unique(numpy.random.choice(self.G.numVertices, size=numVertices, replace=True))
+		estimates = self.opinions(sampledVertices.tolist(), engine, parameters)
+
+		estimated = numpy.array([estimates[u] for u in sampledVertices.tolist()])
+		if engine == 'innate':
+			z = numpy.asarray(self.G.z, dtype=numpy.float64)[sampledVertices]
+			return Estimator.estimateMeasures(self.G, z, estimated, sumFromInnateOpinions=False)
+
+		s = numpy.asarray(self.G.s, dtype=numpy.float64)[sampledVertices]
+		return Estimator.estimateMeasures(self.G, estimated, s, sumFromInnateOpinions=True)
+
+	'''
+		Runs change (a function without arguments that changes the graph) on
+		the batching thread, so it never runs concurrently with an
+		estimation, and returns its result.
+	'''
+	def changeGraph(self, change):
+		request = GraphChange(change)
+		self.requests.put(request)
+		request.done.wait()
+		if request.error is not None:
+			raise request.error
+
+		return request.result
+
+	'''
+		Change listener of the graph: drops the cached estimates of all
+		vertices that may be affected by the change, for every engine and
+		parameters separately. If too many vertices may be affected, all
+		estimates with these parameters are dropped. The push estimates are
+		dropped through their supports (see EstimateCache.store), or all of
+		them if min(s) or max(s) changed.
+	'''
+	def graphChanged(self, kind, changedVertices):
+		with self.versionLock:
+			self.graphVersion += 1
+			self.cache.invalidateDependents(changedVertices)
+
+			opinionRangeChanged = False
+			if kind == 'opinion':
+				previousOpinionRange = self.opinionRange
+				self.opinionRange = opinionRange(self.G)
+				opinionRangeChanged = self.opinionRange != previousOpinionRange
+
+			for parameters in self.cache.cachedParameters():
+				engine = parameters[0]
+				if engine == 'push':
+					if opinionRangeChanged:
+						self.cache.invalidate(None, parameters)
+					continue
+
+				vertices = affectedVertices(self.G, kind, changedVertices, engine, dict(parameters[1:]), self.maxAffectedVertices)
+				self.cache.invalidate(vertices, parameters)
+
+	def stats(self):
+		return {
+			'numVertices': self.G.numVertices,
+			'numEdges': self.G.numEdges,
+			'cacheEntries': len(self.cache),
+			'cacheHits': self.cache.hits,
+			'cacheMisses': self.cache.misses,
+			'graphVersion': self.graphVersion
+		}
+
+	'''
+		Main loop of the batching thread: waits for a request, collects all
+		requests that arrive within batchWindow seconds, and estimates the
+		vertices of all requests with the same engine and parameters at once.
+		Changes of the graph are run in the order of the queue, i.e., after
+		the estimation of the requests before them.
+	'''
+	def processRequests(self):
+		while True:
+			requests = [self.requests.get()]
+			deadline = time.perf_counter() + self.batchWindow
+			while True:
+				timeout = deadline - time.perf_counter()
+				if timeout <= 0:
+					break
+				try:
+					requests.append(self.requests.get(timeout=timeout))
+				except queue.Empty:
+					break
+
+			estimationRequests = []
+			for request in requests:
+				if isinstance(request, GraphChange):
+					self.estimateRequests(estimationRequests)
+					estimationRequests = []
+					self.runChange(request)
+				else:
+					estimationRequests.append(request)
+			self.estimateRequests(estimationRequests)
+
+	def estimateRequests(self, requests):
+		groups = collections.defaultdict(list)
+		for request in requests:
+			groups[parametersKey(request.engine, request.parameters)].append(request)
+
+		for key, group in groups.items():
+			self.estimateGroup(key, group)
+
+	def runChange(self, request):
+		try:
+			request.result = request.change()
+		except Exception as error:
+			request.error = error
+		request.done.set()
+
+	def estimateGroup(self, key, requests):
+		vertices = sorted(set(u for request in requests for u in request.vertices))
+		Instrumentation.count('OpinionService.batchedRequests', len(requests))
+
+		graphVersion = self.graphVersion
+
+		' every request is answered (with an error if necessary), so the batching thread survives and no query waits forever '
+		try:
+			with Instrumentation.span('OpinionService.estimate', numVertices=len(vertices)):
+				supports = dict() if requests[0].engine == 'push' else None
+				opinions, _ = estimateOpinions(self.G, vertices, requests[0].engine, requests[0].parameters, supports)
+
+			' the graph changed during the estimation (outside of changeGraph), so the estimates may be stale '
+			with self.versionLock:
+				if self.graphVersion == graphVersion:
+					self.cache.store({(u, key): opinion for u, opinion in opinions.items()},
+									 {(u, key): support for u, support in supports.items()} if supports is not None else None)
+
+			for request in requests:
+				request.opinions = {u: opinions[u] for u in request.vertices}
+		except Exception as error:
+			for request in requests:
+				request.error = error
+		finally:
+			for request in requests:
+				request.done.set()
+
+' the cache key of an engine and its parameters '
+def parametersKey(engine, parameters):
+	return (engine,) + tuple(sorted(parameters.items()))
+
+'''
+	Returns the vertices whose estimates with the given engine and
+	parameters may change if the innate opinions (kind 'opinion') or the
+	incident edges (kind 'edge') of changedVertices change, or None if
+	there are more than maxVertices of them:
+	- a random walk with numSteps steps only reads the opinions, degrees and
+	  edges of the vertices within distance numSteps-1 of its start vertex,
+	- the estimate of an innate opinion only reads the edges of its vertex
+	  (and the expressed opinions, which are the ground truth).
+	The engines 'adaptive' and 'hybrid' run terminal walks of unbounded
+	length, so every estimate may be affected, and 'external' does not see
+	the changes at all. For these engines, None is returned. The push
+	estimates are not covered here, since they record their supports when
+	they are cached (see OpinionService.graphChanged).
+'''
+def affectedVertices(G, kind, changedVertices, engine, parameters, maxVertices=None):
+	if engine == 'innate':
+		return set(changedVertices) if kind == 'edge' else set()
+
+	if engine in ['adaptive', 'hybrid', 'external']:
+		return None
+
+	return G.ball(changedVertices, parameters['numSteps'] - 1, maxVertices)
+
+' (min(s), max(s)) of the innate opinions of G '
+def opinionRange(G):
+	s = numpy.asarray(G.s, dtype=numpy.float64)
+	if len(s) == 0:
+		return None
+
+	return float(s.min()), float(s.max())
+
+'''
+	Estimates the opinions of the given vertices with the given engine. For
+	the engine 'push', the supports of the estimates are stored in the dict
+	supports if it is given (see Estimator.estimateExpressedOpinionsWithPush).
+'''
+def estimateOpinions(G, vertices, engine, parameters, supports=None):
+	if engine == 'innate':
+		return Estimator.estimateInnateOpinions(G, vertices, parameters)
+	if engine == 'push':
+		return Estimator.estimateExpressedOpinionsWithPush(G, vertices, parameters, supports)
+
+	return Estimator.estimateExpressedOpinions(G, vertices, dict(parameters, engine=engine))
+
+'''
+	Handler for the HTTP endpoints /opinions, /measures and /stats. All
+	query parameters except for vertices, numVertices and engine are passed
+	to the estimator (as int if possible, otherwise as float).
+'''
+class OpinionRequestHandler(http.server.BaseHTTPRequestHandler):
+	service = None
+
+	def do_GET(self):
+		url = urllib.parse.urlparse(self.path)
+		query = {name: values[-1] for name, values in urllib.parse.parse_qs(url.query).items()}
+
+		try:
+			engine = query.pop('engine', 'native')
+			if url.path == '/opinions':
+				vertices = [int(u) for u in query.pop('vertices').split(',')]
+				opinions = self.service.opinions(vertices, engine, parseParameters(query))
+				response = {str(u): opinion for u, opinion in opinions.items()}
+			elif url.path == '/measures':
+				numVertices = int(query.pop('numVertices'))
+				response = self.service.measures(numVertices, engine, parseParameters(query))
+			elif url.path == '/stats':
+				response = self.service.stats()
+			else:
+				self.sendJSON(404, {'error': f'Unknown endpoint {url.path}.'})
+				return
+		except (KeyError, ValueError) as error:
+			self.sendJSON(400, {'error': str(error)})
+			return
+		except Exception as error:
+			self.sendJSON(500, {'error': f'{type(error).__name__}: {error}'})
+			return
+
+		self.sendJSON(200, response)
+
+	def sendJSON(self, status, content):
+		body = json.dumps(content, default=lambda value: value.item()).encode()
+		self.send_response(status)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	' Unix sockets have no client address '
+	def address_string(self):
+		if isinstance(self.client_address, tuple):
+			return super().address_string()
+		return 'unix'
+
+	def log_message(self, format, *args):
+		pass
+
+def parseParameters(query):
+	parameters = dict()
+	for name, value in query.items():
+		try:
+			parameters[name] = int(value)
+		except ValueError:
+			parameters[name] = float(value)
+
+	return parameters
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+'''
+	Serves the service until the process is interrupted. address is either
+	(host, port) for HTTP over TCP or the path of a Unix socket.
+'''
+def serve(service, address):
+	handler = type('Handler', (OpinionRequestHandler,), {'service': service})
+
+	if isinstance(address, str):
+		if os.path.exists(address):
+			os.remove(address)
+		server = ThreadingUnixHTTPServer(address, handler)
+	else:
+		server = http.server.ThreadingHTTPServer(address, handler)
+
+	print(f'Serving opinions on {address}.')
+	try:
+		server.serve_forever()
+	finally:
+		server.server_close()
+
+if __name__ == '__main__':
+	if len(sys.argv) != 4:
+		print(f'usage: python {sys.argv[0]} <dataset> <opinion distribution> <port or socket path>')
+		sys.exit(1)
+
+	import Eval
+	G = Eval.loadGraphForParameters(sys.argv[1], sys.argv[2])
+
+	address = sys.argv[3]
+	if address.isdigit():
+		address = ('localhost', int(address))
+
+	serve(OpinionService(G), address)
@@ -1,4 +1,13 @@
+import Graph
+import Instrumentation
+
+import numpy
 import os
+import subprocess
+import time
+
+' maximum number of random walks that are simulated at the same time '
+maxWalksPerBatch = 1 << 22
 
 def getInitCommand(graphFile,
 				   numSteps,
@@ -22,11 +31,21 @@ def estimateAllOpinions(graphFile,
 
 	return estimateOpinionsWithCommand(command)
 
+'''
+	By default, the queries are answered by the oracle session for graphFile
+	and innateOpinionsFile (see getSession). If useSession is False, a new
+	oracle process is started for the query.
+'''
 def estimateOpinionsOfGivenVertices(verticesToClassify,
 									graphFile,
 									numSteps,
 									numWalks,
-									innateOpinionsFile):
+									innateOpinionsFile,
+									useSession=True):
+	if useSession:
+		session = getSession(graphFile, innateOpinionsFile)
+		return session.estimateOpinions(verticesToClassify, numSteps, numWalks)
+
 	command = getInitCommand(graphFile, numSteps, numWalks, innateOpinionsFile)
 
 	uniqueVerticesToClassify = set(verticesToClassify)
@@ -36,19 +55,354 @@ def estimateOpinionsOfGivenVertices(verticesToClassify,
 	return estimateOpinionsWithCommand(command)
 
 def estimateOpinionsWithCommand(command):
-	stream = os.popen(command)
+	with Instrumentation.span('OracleModule.run'):
+		stream = os.popen(command)
+		lines = stream.readlines()
 
-	opinions = {}
+	if Instrumentation.enabled:
+		Instrumentation.count('OracleModule.bytesRead', sum(len(line) for line in lines))
 
-	lines = stream.readlines()
-	t = float(lines[0])
-	for i in range(1,len(lines)):
-		line = lines[i]
-		split = line.strip().split(' ')
-		u = int(split[0])
-		opinion = float(split[1])
+	with Instrumentation.span('OracleModule.parse'):
+		opinions = {}
 
-		opinions[u] = opinion
+		t = float(lines[0])
+		for i in range(1,len(lines)):
+			line = lines[i]
+			split = line.strip().split(' ')
+			u = int(split[0])
+			opinion = float(split[1])
+
+			opinions[u] = opinion
 
 	return opinions, t
 
+'''
+	A long-lived oracle process, which loads the graph once and then answers
+	query batches sent over a pipe (see the server mode in oracle.cpp). The
+	vertex ids and opinions are sent as packed int64 and float64 arrays.
+'''
+class OracleSession:
+	def __init__(self, graphFile, innateOpinionsFile):
+		self.graphFile = graphFile
+		self.innateOpinionsFile = innateOpinionsFile
+
+		command = ['./oracle', graphFile, '0', '0', innateOpinionsFile, '--server']
+		with Instrumentation.span('OracleModule.spawn'):
+			self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+
+	'''
+		Same as estimateOpinionsOfGivenVertices, but uses the running oracle.
+	'''
+	def estimateOpinions(self, verticesToClassify, numSteps, numWalks):
+		vertices = numpy.unique(numpy.asarray(verticesToClassify, dtype=numpy.int64))
+		header = numpy.array([numSteps, numWalks, len(vertices)], dtype=numpy.int64)
+
+		with Instrumentation.span('OracleModule.query', numVertices=len(vertices)):
+			self.process.stdin.write(header.tobytes())
+			self.process.stdin.write(vertices.tobytes())
+			self.process.stdin.flush()
+
+			t = numpy.frombuffer(self.read(8), dtype=numpy.float64)[0]
+			count = numpy.frombuffer(self.read(8), dtype=numpy.int64)[0]
+			ids = numpy.frombuffer(self.read(8*count), dtype=numpy.int64)
+			estimates = numpy.frombuffer(self.read(8*count), dtype=numpy.float64)
+
+		Instrumentation.count('OracleModule.walks', len(vertices) * numWalks)
+		Instrumentation.count('OracleModule.bytesRead', 16 + 16*count)
+
+		with Instrumentation.span('OracleModule.parse'):
+			opinions = dict(zip(ids.tolist(), estimates.tolist()))
+
+		return opinions, float(t)
+
+	def read(self, numBytes):
+		data = self.process.stdout.read(numBytes)
+		if len(data) != numBytes:
+			raise RuntimeError(f'The oracle for {self.graphFile} stopped unexpectedly.')
+		return data
+
+	def close(self):
+		self.process.stdin.close()
+		self.process.wait()
+		self.process.stdout.close()
+
+' the running oracle sessions, indexed by (graphFile, innateOpinionsFile) '
+sessions = dict()
+
+'''
+	Returns the oracle session for the given files and starts it if
+	necessary.
+'''
+def getSession(graphFile, innateOpinionsFile):
+	key = (graphFile, innateOpinionsFile)
+	if key not in sessions:
+		sessions[key] = OracleSession(graphFile, innateOpinionsFile)
+
+	return sessions[key]
+
+def closeSession(graphFile, innateOpinionsFile):
+	session = sessions.pop((graphFile, innateOpinionsFile), None)
+	if session is not None:
+		session.close()
+
+def closeAllSessions():
+	for key in list(sessions.keys()):
+		closeSession(*key)
+
+'''
+	In-process version of the oracle, which runs on the already loaded graph
+	G instead of calling ./oracle. It performs the same random walks as
+	estExpressedOpinion in oracle.cpp, but advances all walks of all query
+	vertices at once using numpy arrays.
+
+	Returns the estimated opinions and the time spent on the random walks,
+	just like estimateOpinionsWithCommand.
+'''
+@Instrumentation.timed('OracleModule.estimateOpinionsInProcess')
+def estimateOpinionsInProcess(G,
+							  verticesToClassify,
+							  numSteps,
+							  numWalks):
+	s = numpy.asarray(G.s, dtype=numpy.float64)
+
+	t = time.time()
+
+	vertices = numpy.unique(numpy.asarray(verticesToClassify, dtype=numpy.int64))
+	estimates = numpy.zeros(len(vertices))
+
+	verticesPerBatch = max(1, maxWalksPerBatch // numWalks)
+	for batchStart in range(0, len(vertices), verticesPerBatch):
+		batch = vertices[batchStart:batchStart+verticesPerBatch]
+		startVertices = numpy.repeat(batch, numWalks)
+
+		walkValues = simulateWalks(G, s, startVertices, numSteps)
+
+		owners = numpy.repeat(numpy.arange(len(batch)), numWalks)
+		estimates[batchStart:batchStart+len(batch)] = numpy.bincount(owners, weights=walkValues, minlength=len(batch))
+
+	estimates /= 2*numWalks
+
+	opinions = dict(zip(vertices.tolist(), estimates.tolist()))
+
+	totalTime = time.time() - t
+
+	return opinions, totalTime
+
+'''
+	Adaptive version of estimateOpinionsInProcess: instead of numWalks walks
+	per vertex, every vertex runs batches of walkBatchSize walks until the
+	empirical Bernstein confidence interval of its estimate has half-width
+	at most epsilon (or until it ran maxWalks walks).
+
+	The bound needs the range of the values to be known in advance. The
+	values of the walks of simulateWalks can only be bounded by numSteps
+	times the range of s, for which the bound would never be small enough.
+	Hence, we use the terminal walks of simulateTerminalWalks, whose values
+	are in [min(s), max(s)] and whose expectation is the expressed opinion.
+	For n walks with values in a range of length R and empirical variance V,
+	their mean is, with probability at least 1-delta', within
+	sqrt(2 V log(3/delta')/n) + 3 R log(3/delta')/n of its expectation
+	(Audibert, Munos and Szepesvari, 2009). We use
+	delta' = delta/(number of batches), so that the bound holds for all
+	batches at once. Vertices whose walks mostly stop in regions with
+	similar innate opinions have a small variance and stop early.
+
+	Returns the estimated opinions, the time spent on the random walks and a
+	dict with the number of walks that were used for every vertex.
+'''
+@Instrumentation.timed('OracleModule.estimateOpinionsAdaptively')
+def estimateOpinionsAdaptively(G,
+							   verticesToClassify,
+							   maxWalks,
+							   epsilon,
+							   delta=0.05,
+							   walkBatchSize=100):
+	s = numpy.asarray(G.s, dtype=numpy.float64)
+	rangeOfS = s.max() - s.min() if len(s) > 0 else 0
+
+	t = time.time()
+
+	vertices = numpy.unique(numpy.asarray(verticesToClassify, dtype=numpy.int64))
+	numVertices = len(vertices)
+
+	counts = numpy.zeros(numVertices, dtype=numpy.int64)
+	sums = numpy.zeros(numVertices)
+	sumSquares = numpy.zeros(numVertices)
+
+	numBatches = -(-maxWalks // walkBatchSize)
+	logTerm = numpy.log(3 * numBatches / delta)
+
+	active = numpy.arange(numVertices)
+	verticesPerChunk = max(1, maxWalksPerBatch // walkBatchSize)
+	while len(active) > 0:
+		for chunkStart in range(0, len(active), verticesPerChunk):
+			chunk = active[chunkStart:chunkStart+verticesPerChunk]
+			batchWalks = numpy.minimum(walkBatchSize, maxWalks - counts[chunk])
+
+			walkValues = simulateTerminalWalks(G, s, numpy.repeat(vertices[chunk], batchWalks))
+
+			owners = numpy.repeat(numpy.arange(len(chunk)), batchWalks)
+			counts[chunk] += batchWalks
+			sums[chunk] += numpy.bincount(owners, weights=walkValues, minlength=len(chunk))
+			sumSquares[chunk] += numpy.bincount(owners, weights=walkValues*walkValues, minlength=len(chunk))
+
+		n = counts[active]
+		means = sums[active] / n
+		variances = numpy.maximum(sumSquares[active] / n - means*means, 0)
+		halfWidths = numpy.sqrt(2 * variances * logTerm / n) + 3 * rangeOfS * logTerm / n
+
+		done = (halfWidths <= epsilon) | (n >= maxWalks)
+		active = active[~done]
+
+	estimates = sums / numpy.maximum(counts, 1)
+
+	opinions = dict(zip(vertices.tolist(), estimates.tolist()))
+	walkCounts = dict(zip(vertices.tolist(), counts.tolist()))
+
+	totalTime = time.time() - t
+
+	return opinions, totalTime, walkCounts
+
+'''
+	Estimates the expressed opinions of the given vertices for several
+	configurations (numSteps, numWalks) at once. Instead of simulating the
+	walks for each configuration, we simulate max(numWalks) walks with
+	max(numSteps) steps per vertex once. Since the walks of a smaller
+	configuration are prefixes of these walks, we obtain the estimate for
+	(numSteps, numWalks) by summing the values that the first numWalks walks
+	had after numSteps steps.
+
+	Returns a list with the opinions for each configuration and the time
+	spent on the random walks (for all configurations together).
+'''
+@Instrumentation.timed('OracleModule.estimateOpinionsForSweep')
+def estimateOpinionsForSweep(G,
+							 verticesToClassify,
+							 configurations):
+	s = numpy.asarray(G.s, dtype=numpy.float64)
+
+	t = time.time()
+
+	vertices = numpy.unique(numpy.asarray(verticesToClassify, dtype=numpy.int64))
+	estimates = [numpy.zeros(len(vertices)) for _ in configurations]
+
+	maxSteps = max(numSteps for (numSteps, _) in configurations)
+	maxWalks = max(numWalks for (_, numWalks) in configurations)
+	checkpoints = sorted(set(numSteps for (numSteps, _) in configurations))
+
+	verticesPerBatch = max(1, maxWalksPerBatch // maxWalks)
+	for batchStart in range(0, len(vertices), verticesPerBatch):
+		batch = vertices[batchStart:batchStart+verticesPerBatch]
+		startVertices = numpy.repeat(batch, maxWalks)
+
+		walkValuesAtCheckpoints = simulateWalks(G, s, startVertices, maxSteps, checkpoints)
+
+		for checkpoint, walkValues in zip(checkpoints, walkValuesAtCheckpoints):
+			' prefix sums over the walks of each vertex '
+			cumulatedValues = numpy.cumsum(walkValues.reshape(len(batch), maxWalks), axis=1)
+
+			for i, (numSteps, numWalks) in enumerate(configurations):
+				if numSteps == checkpoint:
+					estimates[i][batchStart:batchStart+len(batch)] = cumulatedValues[:,numWalks-1] / (2*numWalks)
+
+	opinions = [dict(zip(vertices.tolist(), estimate.tolist())) for estimate in estimates]
+
+	totalTime = time.time() - t
+
+	return opinions, totalTime
+
+'''
+	Performs one random walk of length at most numSteps from each vertex in
+	startVertices and returns the value of each walk, i.e., the sum of
+	s[v]/(1 + totalEdgeWeight(v)) over the vertices v visited by the walk.
+
+	In each step, a walk stays at its current vertex v with probability 1/2.
+	Otherwise, it moves to one of the deg(v) neighbors of v or stops, each
+	with probability 1/(deg(v)+1).
+
+	If checkpoints (a sorted list of step counts) is given, a list with the
+	values of the walks after each of these numbers of steps is returned
+	instead.
+'''
+def simulateWalks(G, s, startVertices, numSteps, checkpoints=None):
+	walkValues = numpy.zeros(len(startVertices))
+	walkValuesAtCheckpoints = []
+
+	walks = numpy.arange(len(startVertices))
+	currentVertices = numpy.asarray(startVertices, dtype=numpy.int64)
+	rows = G.rowArrays()
+
+	numWalkSteps = 0
+	for step in range(numSteps):
+		if len(walks) == 0:
+			break
+		numWalkSteps += len(walks)
+
+		starts, weightStarts, degrees = rows.rows(currentVertices)
+		totalWeights = numpy.where(degrees > 0, rows.cumweights[numpy.maximum(weightStarts+degrees-1, 0)], 0)
+
+		walkValues[walks] += s[currentVertices] / (1 + totalWeights)
+
+		movesToTake = numpy.random.random(len(walks))
+		leaves = movesToTake <= 0.5
+		neighborIndices = numpy.floor(2*movesToTake*(degrees+1)).astype(numpy.int64)
+		stops = leaves & (neighborIndices >= degrees)
+		moves = leaves & ~stops
+
+		currentVertices[moves] = rows.indices[starts[moves] + neighborIndices[moves]]
+
+		if stops.any():
+			walks = walks[~stops]
+			currentVertices = currentVertices[~stops]
+
+		if checkpoints is not None and step+1 in checkpoints:
+			walkValuesAtCheckpoints.append(walkValues.copy())
+
+	Instrumentation.count('OracleModule.walks', len(startVertices))
+	Instrumentation.count('OracleModule.walkSteps', numWalkSteps)
+
+	if checkpoints is not None:
+		' walks that stopped early have the same value at all later checkpoints '
+		while len(walkValuesAtCheckpoints) < len(checkpoints):
+			walkValuesAtCheckpoints.append(walkValues.copy())
+		return walkValuesAtCheckpoints
+
+	return walkValues
+
+'''
+	Simulates the random walks of P = M^{-1} A (see Graph.forwardPush) from
+	the given start vertices: a walk at v stops with probability 1/M_v and
+	otherwise moves to a neighbor w with probability w(v,w)/M_v. Returns the
+	innate opinions of the vertices at which the walks stopped. For a walk
+	from v, their expectation is z_v, and unlike the walk values of
+	simulateWalks, they are bounded by the range of s.
+'''
+def simulateTerminalWalks(G, s, startVertices):
+	rows = G.rowArrays()
+
+	terminalValues = numpy.zeros(len(startVertices))
+	walks = numpy.arange(len(startVertices))
+	currentVertices = numpy.array(startVertices, dtype=numpy.int64)
+
+	numWalkSteps = 0
+	while len(walks) > 0:
+		numWalkSteps += len(walks)
+
+		starts, weightStarts, degrees = rows.rows(currentVertices)
+		totalWeights = numpy.where(degrees > 0, rows.cumweights[numpy.maximum(weightStarts+degrees-1, 0)], 0)
+
+		' targets below 0 (with probability 1/M_v) stop the walk, all others select a neighbor '
+		targets = numpy.random.random(len(walks)) * (1 + totalWeights) - 1
+		stops = targets < 0
+		terminalValues[walks[stops]] = s[currentVertices[stops]]
+
+		moves = ~stops
+		weightStarts = weightStarts[moves]
+		entries = Graph.searchSortedRows(rows.cumweights, weightStarts, weightStarts + degrees[moves], targets[moves])
+		walks = walks[moves]
+		currentVertices = rows.indices[entries - weightStarts + starts[moves]].astype(numpy.int64)
+
+	Instrumentation.count('OracleModule.walks', len(startVertices))
+	Instrumentation.count('OracleModule.walkSteps', numWalkSteps)
+
+	return terminalValues
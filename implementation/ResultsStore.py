@@ -0,0 +1,195 @@
+import Instrumentation
+
+import atexit
+import os
+import sqlite3
+import sys
+
+'''
+	Results sink backed by an SQLite database.
+
+	There is one typed table per kind of result (opinions, stats, measures)
+	and experiment type (givenS, which also covers givenSIncreases and the
+	givenSBucket experiments, and givenZ). Every row stores the dataset,
+	the opinion distribution and the experiment type, followed by the
+	columns of the corresponding CSV file. The walks table stores the number
+	of walks per vertex of the adaptive oracle (see
+	Estimator.estimateExpressedOpinionsAdaptively), where numWalks is the
+	maximum number of walks.
+
+	The rows are buffered in memory and inserted with executemany inside a
+	single transaction once batchSize rows are pending (or on flush). The
+	database uses write-ahead logging, so several processes can write to it
+	at the same time: each process opens its own store (a store must be
+	closed before forking, see Scheduler.runTasks) and waits for the write
+	lock for up to timeout seconds.
+
+	exportToCSV writes the tables to the CSV files that were previously
+	written by Eval, so the plotting scripts can be used as before:
+		python ResultsStore.py ../results/results.sqlite ../results/
+'''
+
+keyColumns = [('dataset', 'TEXT'), ('opinionDistribution', 'TEXT'), ('experimentType', 'TEXT')]
+
+tableColumns = {
+	'opinions_givenS': [('vertexId', 'INTEGER'), ('trueOpinions', 'REAL'), ('estimatedOpinion', 'REAL'), ('numSteps', 'INTEGER'), ('numWalks', 'INTEGER')],
+	'opinions_givenZ': [('vertexId', 'INTEGER'), ('trueOpinions', 'REAL'), ('estimatedOpinion', 'REAL'), ('numSamples', 'INTEGER'), ('repetitions', 'INTEGER')],
+	'stats_givenS': [('numSampledVertices', 'INTEGER'), ('numSteps', 'INTEGER'), ('NumWalks', 'INTEGER'), ('time', 'REAL'), ('numActualVertices', 'INTEGER')],
+	'stats_givenZ': [('numSampledVertices', 'INTEGER'), ('numSamples', 'INTEGER'), ('repetitions', 'INTEGER'), ('time', 'REAL'), ('numActualVertices', 'INTEGER')],
+	'measures_givenS': [('measure', 'TEXT'), ('trueValue', 'REAL'), ('estimatedValue', 'REAL'), ('numSteps', 'INTEGER'), ('numWalks', 'INTEGER'), ('numSampledVertices', 'INTEGER')],
+	'measures_givenZ': [('measure', 'TEXT'), ('trueValue', 'REAL'), ('estimatedValue', 'REAL'), ('numSamples', 'INTEGER'), ('repetitions', 'INTEGER'), ('numSampledVertices', 'INTEGER')],
+	'walks_givenS': [('vertexId', 'INTEGER'), ('numWalksUsed', 'INTEGER'), ('numSteps', 'INTEGER'), ('numWalks', 'INTEGER'), ('epsilon', 'REAL')]
+}
+
+' the names of the exported CSV files for each kind of result '
+csvFileNames = {
+	'opinions': '{dataset}_opinions_{opinionDistribution}_{experimentType}.csv',
+	'stats': '{dataset}_opinions_{opinionDistribution}_{experimentType}_stats.csv',
+	'measures': '{dataset}_measures_{opinionDistribution}_{experimentType}.csv',
+	'walks': '{dataset}_walks_{opinionDistribution}_{experimentType}.csv'
+}
+
+def tableName(kind, experimentType):
+	if 'givenS' in experimentType:
+		return f'{kind}_givenS'
+	return f'{kind}_givenZ'
+
+class ResultsStore:
+	def __init__(self, databasePath, batchSize=100000, timeout=600.0):
+		self.databasePath = databasePath
+		self.batchSize = batchSize
+		self.timeout = timeout
+
+		self.connection = None
+		self.pendingRows = dict()
+		self.numPendingRows = 0
+
+		atexit.register(self.close)
+
+	' returns the connection of the store, which is opened if necessary '
+	def connect(self):
+		if self.connection is not None:
+			return self.connection
+
+		self.connection = sqlite3.connect(self.databasePath, timeout=self.timeout)
+
+		self.connection.execute('PRAGMA journal_mode=WAL')
+		self.connection.execute('PRAGMA synchronous=NORMAL')
+		with self.connection:
+			for table, columns in tableColumns.items():
+				columnDefinitions = ', '.join(f'{name} {columnType}' for name, columnType in keyColumns + columns)
+				self.connection.execute(f'CREATE TABLE IF NOT EXISTS {table} ({columnDefinitions})')
+
+		return self.connection
+
+	'''
+		Adds rows to a table. Every row contains the columns of the table
+		(see tableColumns) without the key columns, which are prepended.
+	'''
+	def addRows(self, kind, dataset, opinionDistribution, experimentType, rows):
+		self.connect()
+
+		table = tableName(kind, experimentType)
+		key = (dataset, opinionDistribution, experimentType)
+		tableRows = self.pendingRows.setdefault(table, [])
+		numRows = len(tableRows)
+		tableRows.extend(key + tuple(row) for row in rows)
+		self.numPendingRows += len(tableRows) - numRows
+
+		if self.numPendingRows >= self.batchSize:
+			self.flush()
+
+	def addOpinions(self, dataset, opinionDistribution, experimentType, vertices, trueOpinions, estimatedOpinions, parameterValues):
+		rows = [(int(u), float(trueOpinion), float(estimatedOpinion)) + parameterValues
+				for u, trueOpinion, estimatedOpinion in zip(vertices, trueOpinions, estimatedOpinions)]
+		self.addRows('opinions', dataset, opinionDistribution, experimentType, rows)
+
+	def addStats(self, dataset, opinionDistribution, experimentType, numSampledVertices, parameterValues, time, numActualVertices):
+		row = (int(numSampledVertices),) + parameterValues + (float(time), int(numActualVertices))
+		self.addRows('stats', dataset, opinionDistribution, experimentType, [row])
+
+	'''
+		walkCounts maps every vertex to the number of walks that the adaptive
+		oracle used for it.
+	'''
+	def addWalkCounts(self, dataset, opinionDistribution, experimentType, walkCounts, parameterValues, epsilon):
+		rows = [(int(u), int(numWalksUsed)) + parameterValues + (float(epsilon),)
+				for u, numWalksUsed in walkCounts.items()]
+		self.addRows('walks', dataset, opinionDistribution, experimentType, rows)
+
+	'''
+		measureValues contains (measure, trueValue, estimatedValue) triples.
+	'''
+	def addMeasures(self, dataset, opinionDistribution, experimentType, measureValues, parameterValues, numSampledVertices):
+		rows = [(measure, float(trueValue), float(estimatedValue)) + parameterValues + (int(numSampledVertices),)
+				for measure, trueValue, estimatedValue in measureValues]
+		self.addRows('measures', dataset, opinionDistribution, experimentType, rows)
+
+	' inserts all pending rows in a single transaction '
+	@Instrumentation.timed('ResultsStore.flush')
+	def flush(self):
+		if self.numPendingRows == 0:
+			return
+
+		with self.connection:
+			for table, rows in self.pendingRows.items():
+				if not rows:
+					continue
+				placeholders = ', '.join('?' * (len(keyColumns) + len(tableColumns[table])))
+				self.connection.executemany(f'INSERT INTO {table} VALUES ({placeholders})', rows)
+
+		Instrumentation.count('ResultsStore.rowsWritten', self.numPendingRows)
+		self.pendingRows = dict()
+		self.numPendingRows = 0
+
+	def close(self):
+		if self.connection is None:
+			return
+
+		self.flush()
+		self.connection.close()
+		self.connection = None
+
+	'''
+		Writes every (dataset, opinionDistribution, experimentType) of every
+		table to its CSV file in outputFolderPath (see csvFileNames). Existing
+		files are overwritten. Returns the paths of the written files.
+	'''
+	@Instrumentation.timed('ResultsStore.exportToCSV')
+	def exportToCSV(self, outputFolderPath):
+		connection = self.connect()
+		self.flush()
+		os.makedirs(outputFolderPath, exist_ok=True)
+
+		filePaths = []
+		for table, columns in tableColumns.items():
+			kind = table.split('_')[0]
+			columnNames = [name for name, _ in columns]
+
+			keys = connection.execute(f'SELECT DISTINCT dataset, opinionDistribution, experimentType FROM {table} ORDER BY dataset, opinionDistribution, experimentType').fetchall()
+			for dataset, opinionDistribution, experimentType in keys:
+				fileName = csvFileNames[kind].format(dataset=dataset,
+													  opinionDistribution=opinionDistribution,
+													  experimentType=experimentType)
+				filePath = os.path.join(outputFolderPath, fileName)
+
+				cursor = connection.execute(f'SELECT {", ".join(columnNames)} FROM {table} WHERE dataset=? AND opinionDistribution=? AND experimentType=? ORDER BY rowid',
+											(dataset, opinionDistribution, experimentType))
+				with open(filePath, 'w') as fp:
+					fp.write(','.join(columnNames) + '\n')
+					for row in cursor:
+						fp.write(','.join(str(value) for value in row) + '\n')
+
+				filePaths.append(filePath)
+
+		return filePaths
+
+if __name__ == '__main__':
+	if len(sys.argv) != 3:
+		print(f'usage: python {sys.argv[0]} <database> <output folder>')
+		sys.exit(1)
+
+	store = ResultsStore(sys.argv[1])
+	filePaths = store.exportToCSV(sys.argv[2])
+	store.close()
+	print(f'Exported {len(filePaths)} CSV files to {sys.argv[2]}.')
@@ -0,0 +1,303 @@
+import Eval
+import Graph
+import Instrumentation
+import OracleModule
+
+import multiprocessing
+import multiprocessing.util
+import numpy
+import os
+import random
+from multiprocessing import shared_memory
+
+'''
+	Runs the experiments of Eval on a process pool.
+
+	For every dataset and opinion distribution, the graph is loaded once by
+	the main process and copied into shared memory, from which all workers
+	use it without copying (see shareGraph and attachGraph). The parameter
+	grid is expanded into independent tasks (one per repetition and
+	parameter set or degree bucket). Every task gets its own seed from a
+	numpy.random.SeedSequence, so the results do not depend on which worker
+	runs a task. The workers write their results directly to the results
+	database (see ResultsStore): the main process closes its connection
+	before the pool is started, and every worker opens its own store in
+	initializeWorker and closes it when it exits.
+
+	The parameter sets come with their engine (see Eval.oracleEngine), so
+	the results do not depend on the number of workers. The seeds only make
+	the results reproducible for the in-process engines: the external
+	./oracle seeds its random walks from the clock. With the external
+	engine, every worker runs its own oracle session with a single OpenMP
+	thread (so the workers do not oversubscribe the cores), which is closed
+	when the worker exits.
+'''
+
+' the graph and its shared memory blocks in a worker process '
+workerGraph = None
+workerSharedMemories = []
+workerBucketizedVertices = dict()
+
+def runExperimentsWithParameters(datasets,
+								 opinionDistributions,
+								 parameters,
+								 numVertexSamples,
+								 experimentType,
+								 numWorkers=None,
+								 seed=0):
+	seedSequence = numpy.random.SeedSequence(seed)
+
+	for opinionDistribution in opinionDistributions:
+		for dataset in datasets:
+			print(f'Running for dataset {dataset} {opinionDistribution} {experimentType} in parallel.')
+
+			tasks = []
+			if Eval.usesWalkSweep(experimentType):
+				taskFunction = runSweepTask
+				for repetition in range(Eval.numRepetitions):
+					tasks.append((dataset,
+								  opinionDistribution,
+								  numVertexSamples,
+								  parameters,
+								  experimentType))
+			else:
+				taskFunction = runMeasuresTask
+				for repetition in range(Eval.numRepetitions):
+					for parameterSet in parameters:
+						tasks.append((dataset,
+									  opinionDistribution,
+									  numVertexSamples,
+									  parameterSet,
+									  experimentType))
+
+			runTasks(dataset, opinionDistribution, taskFunction, tasks, seedSequence, numWorkers)
+
+def runExperimentsWithDegreeBuckets(datasets,
+									opinionDistributions,
+									parameterSet,
+									numBuckets=20,
+									verticesPerBucket=500,
+									numWorkers=None,
+									seed=0):
+	seedSequence = numpy.random.SeedSequence(seed)
+
+	for dataset in datasets:
+		for opinionDistribution in opinionDistributions:
+			print(f'Running degree buckets for dataset {dataset} {opinionDistribution} in parallel.')
+
+			tasks = []
+			for repetition in range(Eval.numRepetitions):
+				for numBucket in range(numBuckets):
+					tasks.append((dataset,
+								  opinionDistribution,
+								  parameterSet,
+								  numBuckets,
+								  numBucket,
+								  verticesPerBucket))
+
+			results = runTasks(dataset, opinionDistribution, runDegreeBucketTask, tasks, seedSequence, numWorkers)
+
+			errorsBucket = [[] for i in range(numBuckets)]
+			timesBucket = [[] for i in range(numBuckets)]
+			errorsAll = []
+			timesAll = []
+			for task, (errors, time) in zip(tasks, results):
+				numBucket = task[4]
+				errorsBucket[numBucket].extend(errors)
+				timesBucket[numBucket].append(time)
+				errorsAll.extend(errors)
+				timesAll.append(time)
+
+			Eval.plotDegreeBucketResults(dataset,
+										 opinionDistribution,
+										 numBuckets,
+										 errorsBucket,
+										 timesBucket,
+										 errorsAll,
+										 timesAll)
+
+'''
+	Runs the tasks for one dataset and opinion distribution on a process
+	pool and returns the return values of the tasks (in the order of the
+	tasks).
+'''
+def runTasks(dataset, opinionDistribution, taskFunction, tasks, seedSequence, numWorkers=None):
+	if numWorkers is None:
+		numWorkers = os.cpu_count()
+
+	G = Eval.loadGraphForParameters(dataset, opinionDistribution)
+	sharedMemories, description = shareGraph(G)
+	del G
+
+	seeds = seedSequence.spawn(len(tasks))
+	tasksWithSeeds = [(taskFunction, task, taskSeed) for task, taskSeed in zip(tasks, seeds)]
+
+	' the workers must not inherit pending rows or an open connection (it is opened again when needed) '
+	Eval.getResultsStore().close()
+
+	results = []
+	try:
+		with multiprocessing.Pool(numWorkers, initializer=initializeWorker, initargs=(description,)) as pool:
+			for result, instrumentationState in pool.imap(runTask, tasksWithSeeds):
+				if instrumentationState is not None:
+					Instrumentation.mergeState(instrumentationState)
+				results.append(result)
+
+			' let the workers exit normally, so that they close their oracle sessions '
+			pool.close()
+			pool.join()
+	finally:
+		releaseSharedMemory(sharedMemories)
+
+	return results
+
+'''
+	Copies the CSR arrays and the opinions of the compact graph G into
+	shared memory. Returns the shared memory blocks (which must be released
+	with releaseSharedMemory) and a picklable description for attachGraph.
+'''
+def shareGraph(G):
+	G.compact()
+
+	arrays = {
+		'indptr': G.indptr,
+		'indices': G.indices,
+		'cumweights': G.cumweights,
+		'z': numpy.asarray(G.z, dtype=numpy.float64),
+		's': numpy.asarray(G.s, dtype=numpy.float64)
+	}
+
+	sharedMemories = []
+	description = {
+		'arrays': dict(),
+		'numVertices': G.numVertices,
+		'numEdges': G.numEdges,
+		'totalEdgeWeights': G.totalEdgeWeights,
+		'measures': G.measures,
+		'graphFile': G.graphFile,
+		'expressedOpinionsFile': G.expressedOpinionsFile,
+		'innateOpinionsFile': G.innateOpinionsFile
+	}
+
+	for name, array in arrays.items():
+		sharedMemory = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+		sharedArray = numpy.ndarray(array.shape, dtype=array.dtype, buffer=sharedMemory.buf)
+		sharedArray[:] = array
+		del sharedArray
+
+		sharedMemories.append(sharedMemory)
+		description['arrays'][name] = (sharedMemory.name, array.shape, array.dtype.str)
+
+	return sharedMemories, description
+
+'''
+	Returns a compact graph whose arrays live in the shared memory blocks
+	described by description (see shareGraph), together with the blocks.
+'''
+def attachGraph(description):
+	sharedMemories = []
+	arrays = dict()
+	for name, (sharedMemoryName, shape, dtype) in description['arrays'].items():
+		sharedMemory = shared_memory.SharedMemory(name=sharedMemoryName)
+		sharedMemories.append(sharedMemory)
+		arrays[name] = numpy.ndarray(shape, dtype=numpy.dtype(dtype), buffer=sharedMemory.buf)
+
+	G = Graph.Graph()
+	G.setCSR(arrays['indptr'], arrays['indices'], arrays['cumweights'])
+	G.z = arrays['z']
+	G.s = arrays['s']
+
+	G.numVertices = description['numVertices']
+	G.numEdges = description['numEdges']
+	G.totalEdgeWeights = description['totalEdgeWeights']
+	G.measures = description['measures']
+	G.graphFile = description['graphFile']
+	G.expressedOpinionsFile = description['expressedOpinionsFile']
+	G.innateOpinionsFile = description['innateOpinionsFile']
+
+	return G, sharedMemories
+
+def releaseSharedMemory(sharedMemories):
+	for sharedMemory in sharedMemories:
+		sharedMemory.close()
+		sharedMemory.unlink()
+
+def initializeWorker(description):
+	global workerGraph, workerSharedMemories
+	workerGraph, workerSharedMemories = attachGraph(description)
+	workerBucketizedVertices.clear()
+
+	' oracle sessions started by this worker use one thread and are closed when it exits '
+	os.environ['OMP_NUM_THREADS'] = '1'
+	multiprocessing.util.Finalize(None, OracleModule.closeAllSessions, exitpriority=10)
+
+	' the results store of this worker, which writes its pending rows and checkpoints the log when it exits '
+	Eval.resultsStore = Eval.openResultsStore()
+	Eval.resultsStore.connect()
+	multiprocessing.util.Finalize(None, Eval.resultsStore.close, exitpriority=10)
+
+	' drop the spans and counters inherited from the main process '
+	Instrumentation.takeState()
+
+'''
+	Runs a single task in a worker with its own seed. The results of the
+	task are committed to the results database before it returns. Returns
+	the return value of the task together with the spans and counters that
+	were recorded by the task (or None if the instrumentation is disabled).
+'''
+def runTask(taskWithSeed):
+	taskFunction, task, taskSeed = taskWithSeed
+
+	numpySeed, randomSeed = taskSeed.generate_state(2)
+	numpy.random.seed(numpySeed)
+	random.seed(int(randomSeed))
+
+	result = taskFunction(*task)
+	Eval.getResultsStore().flush()
+
+	instrumentationState = None
+	if Instrumentation.enabled:
+		instrumentationState = Instrumentation.takeState()
+
+	return result, instrumentationState
+
+def runMeasuresTask(dataset,
+					opinionDistribution,
+					numVertexSamples,
+					parameterSet,
+					experimentType):
+	Eval.runExperimentsEstimateMeasures(workerGraph,
+										dataset,
+										numVertexSamples,
+										opinionDistribution,
+										parameterSet,
+										experimentType)
+
+def runSweepTask(dataset,
+				 opinionDistribution,
+				 numVertexSamples,
+				 parameters,
+				 experimentType):
+	Eval.runExperimentsEstimateMeasuresSweep(workerGraph,
+											 dataset,
+											 numVertexSamples,
+											 opinionDistribution,
+											 parameters,
+											 experimentType)
+
+def runDegreeBucketTask(dataset,
+						opinionDistribution,
+						parameterSet,
+						numBuckets,
+						numBucket,
+						verticesPerBucket):
+	if numBuckets not in workerBucketizedVertices:
+		workerBucketizedVertices[numBuckets] = workerGraph.bucketizedVertices(numBuckets)
+
+	return Eval.runExperimentsForDegreeBucket(workerGraph,
+											  dataset,
+											  opinionDistribution,
+											  parameterSet,
+											  workerBucketizedVertices[numBuckets][numBucket],
+											  numBucket,
+											  verticesPerBucket)
@@ -0,0 +1,109 @@
+import GroundTruth
+
+import numpy
+import os
+
+'''
+	Generators for synthetic datasets in the format of
+	include/OpinionQuantities-mine/outputs, i.e., for a dataset name they
+	write name_G.txt and, for every opinion distribution, the files
+	name_<distribution>_s.txt, name_<distribution>_z.txt and
+	name_<distribution>_measures.txt. The expressed opinions and the measures
+	are computed exactly (up to the tolerance of the solver) with GroundTruth.
+
+	Every generator returns the edges as arrays (us, vs, weights) without
+	self-loops and without parallel edges.
+'''
+
+def erdosRenyiEdges(numVertices, averageDegree, rng):
+	numEdges = int(round(numVertices * averageDegree / 2))
+	us = rng.integers(0, numVertices, size=numEdges)
+	vs = rng.integers(0, numVertices, size=numEdges)
+
+	return simpleEdges(numVertices, us, vs, numpy.ones(numEdges))
+
+'''
+	Chung--Lu graph whose expected degrees follow a power law with the given
+	exponent. Both endpoints of every edge are drawn proportional to the
+	expected degrees.
+'''
+def chungLuEdges(numVertices, averageDegree, rng, exponent=2.5):
+	numEdges = int(round(numVertices * averageDegree / 2))
+	expectedDegrees = numpy.arange(1, numVertices+1) ** (-1.0 / (exponent - 1))
+	probabilities = expectedDegrees / numpy.sum(expectedDegrees)
+
+	' shuffle the ids so that the degree is not correlated with the id '
+	permutation = rng.permutation(numVertices)
+	us = permutation[rng.choice(numVertices, size=numEdges, p=probabilities)]
+	vs = permutation[rng.choice(numVertices, size=numEdges, p=probabilities)]
+
+	return simpleEdges(numVertices, us, vs, numpy.ones(numEdges))
+
+'''
+	Stochastic block model with numBlocks blocks of (almost) equal size. A
+	fraction fractionWithinBlocks of the edges is inside of the blocks, the
+	other edges go between uniformly random vertices.
+'''
+def stochasticBlockModelEdges(numVertices, averageDegree, rng, numBlocks=10, fractionWithinBlocks=0.8):
+	numEdges = int(round(numVertices * averageDegree / 2))
+	blockStarts = numpy.arange(numBlocks+1) * numVertices // numBlocks
+
+	us = rng.integers(0, numVertices, size=numEdges)
+	blocks = numpy.searchsorted(blockStarts, us, side='right') - 1
+	withinBlock = rng.random(numEdges) < fractionWithinBlocks
+
+	blockSizes = blockStarts[blocks+1] - blockStarts[blocks]
+	vs = numpy.where(withinBlock,
+					 blockStarts[blocks] + (rng.random(numEdges) * blockSizes).astype(numpy.int64),
+					 rng.integers(0, numVertices, size=numEdges))
+
+	return simpleEdges(numVertices, us, vs, numpy.ones(numEdges))
+
+'''
+	Chung--Lu graph with Pareto distributed edge weights (with minimum 1).
+'''
+def heavyTailedWeightedEdges(numVertices, averageDegree, rng, shape=1.5):
+	us, vs, weights = chungLuEdges(numVertices, averageDegree, rng)
+	weights = 1 + rng.pareto(shape, size=len(us))
+
+	return us, vs, weights
+
+generators = {
+	'ErdosRenyi': erdosRenyiEdges,
+	'ChungLu': chungLuEdges,
+	'SBM': stochasticBlockModelEdges,
+	'HeavyTailed': heavyTailedWeightedEdges
+}
+
+'''
+	Removes self-loops and parallel edges (keeping the first occurrence).
+'''
+def simpleEdges(numVertices, us, vs, weights):
+	smaller = numpy.minimum(us, vs).astype(numpy.int64)
+	larger = numpy.maximum(us, vs).astype(numpy.int64)
+
+	_, firstOccurrences = numpy.unique(smaller * numVertices + larger, return_index=True)
+	firstOccurrences = firstOccurrences[smaller[firstOccurrences] != larger[firstOccurrences]]
+	firstOccurrences.sort()
+
+	return us[firstOccurrences], vs[firstOccurrences], weights[firstOccurrences]
+
+'''
+	Generates a graph with the given generator (see generators) and writes the
+	dataset name to outputFolder. Returns the path prefix of the dataset.
+'''
+def writeSyntheticDataset(outputFolder,
+						  name,
+						  generator,
+						  numVertices,
+						  averageDegree,
+						  opinionDistributions=['Uniform'],
+						  seed=0):
+	rng = numpy.random.default_rng(seed)
+	us, vs, weights = generators[generator](numVertices, averageDegree, rng)
+
+	prefix = os.path.join(outputFolder, name)
+	GroundTruth.writeGraphFile(f'{prefix}_G.txt', numVertices, us, vs, weights)
+	GroundTruth.writeOpinionsAndMeasures(prefix, numVertices, us, vs, weights, opinionDistributions, rng)
+
+	return prefix
@@ -1,11 +1,29 @@
 import Eval
 import Disagreement
+import Instrumentation
 
 datasets = ['Advogato','GooglePlus','TwitterFollows','YouTube','Flickr','Pokec','Flixster','LiveJournal']
 
 opinionDistributions = ['Uniform','Eigenvalue','Exponential']
 
+' set this to the number of cores to run the experiments in parallel '
+Eval.numWorkers = 1
+
+' oracle of the random walks, external for ./oracle or native for the seeded in-process oracle (see Eval.oracleEngine) '
+Eval.oracleEngine = 'external'
+
+' set this to True to also run the stratified experiments (see Eval.runExperimentsEstimateMeasuresStratified) '
+Eval.stratifiedExperiments = False
+
+' set this to True to write a timing report to ../results/instrumentation_* '
+Instrumentation.enabled = False
+
 Eval.runExperiments(datasets, opinionDistributions)
 Eval.runExperimentsWithDegreeBuckets(datasets, opinionDistributions)
 Disagreement.runExperimentsDisagreement(datasets, opinionDistributions)
 
+' write the results database to the CSV files used by the plotting scripts '
+Eval.exportResultsToCSV()
+
+if Instrumentation.enabled:
+	Instrumentation.writeReport('../results/instrumentation')
@@ -1,6 +1,18 @@
 /*
  * compile with
  * 		g++-11 -O3 -Wall -fopenmp -std=c++11 oracle.cpp -o oracle
+ *
+ * usage:
+ * 		./oracle graphFile numSteps numWalks innateOpinionsFile vertex1 vertex2 ...
+ * 		./oracle graphFile numSteps numWalks innateOpinionsFile --estAllOpinions
+ * 		./oracle graphFile numSteps numWalks innateOpinionsFile --server
+ *
+ * In server mode, the graph is loaded once and the oracle answers query
+ * batches from stdin until stdin is closed. All numbers are in native byte
+ * order. A query consists of three int64 values numSteps, numWalks and
+ * numVertices, followed by numVertices int64 vertex ids. The reply consists
+ * of the time for the query as a double, an int64 count, and then count int64
+ * vertex ids followed by count doubles with their estimated opinions.
  */
 #include <fstream>
 #include <iostream>
@@ -14,6 +26,8 @@
 #include <algorithm>
 #include <random>
 
+#include <cstdint>
+#include <cstdio>
 #include <cstring>
 #include <math.h>
 #include <stdlib.h>
@@ -46,6 +60,8 @@ std::map<vertexId,double> estAllExpressedOpinions(Graph& G, std::vector<double>&
 
 vertexId uniformlyRandomNeighbor(Graph& G, vertexId u, double moveToTake);
 
+void runServer(Graph& G, std::vector<double>& s);
+
 std::default_random_engine generator;
 
 Graph readGraph(std::string graphfile) {
@@ -53,7 +69,7 @@ Graph readGraph(std::string graphfile) {
 
 	std::ifstream inputfile(graphfile);
 	if (inputfile.fail()) {
-		std::cout << "ERROR: Could not open input file: " << graphfile << std::endl;
+		std::cerr << "ERROR: Could not open input file: " << graphfile << std::endl;
 		return G;
 	}
 
@@ -86,7 +102,7 @@ std::vector<double> readOpinions(std::string filepath)
 
 	std::ifstream inputfile(filepath);
 	if (inputfile.fail()) {
-		std::cout << "ERROR: Could not open input file: " << filepath << std::endl;
+		std::cerr << "ERROR: Could not open input file: " << filepath << std::endl;
 		return opinions;
 	}
 
@@ -111,6 +127,11 @@ main(int argc, char** argv) {
 
 	generator.seed(std::chrono::system_clock::now().time_since_epoch().count());
 
+	if (strcmp(argv[5], "--server") == 0) {
+		runServer(G, s);
+		return 0;
+	}
+
 	auto startTime = std::chrono::high_resolution_clock::now();
 
 	std::map<vertexId,double> opinions;
@@ -141,6 +162,42 @@ main(int argc, char** argv) {
 	return 0;
 }
 
+void runServer(Graph& G, std::vector<double>& s) {
+	int64_t header[3];
+	while (fread(header, sizeof(int64_t), 3, stdin) == 3) {
+		numSteps = header[0];
+		numWalks = header[1];
+		int64_t numVertices = header[2];
+
+		std::vector<int64_t> queries(numVertices);
+		if (numVertices > 0 &&
+				fread(queries.data(), sizeof(int64_t), numVertices, stdin) != (size_t)numVertices) {
+			break;
+		}
+		std::vector< vertexId > vertices(queries.begin(), queries.end());
+
+		auto startTime = std::chrono::high_resolution_clock::now();
+		std::map<vertexId,double> opinions = estExpressedOpinions(G, vertices, s);
+		auto endTime = std::chrono::high_resolution_clock::now();
+		auto duration = std::chrono::duration_cast<std::chrono::microseconds>(endTime - startTime);
+		double time = (double)duration.count()/1000000;
+
+		int64_t count = opinions.size();
+		std::vector<int64_t> ids;
+		std::vector<double> values;
+		for (auto vertexOpinion : opinions) {
+			ids.push_back(vertexOpinion.first);
+			values.push_back(vertexOpinion.second);
+		}
+
+		fwrite(&time, sizeof(double), 1, stdout);
+		fwrite(&count, sizeof(int64_t), 1, stdout);
+		fwrite(ids.data(), sizeof(int64_t), count, stdout);
+		fwrite(values.data(), sizeof(double), count, stdout);
+		fflush(stdout);
+	}
+}
+
 std::map<vertexId,double> estAllExpressedOpinions(Graph& G, std::vector<double>&s) {
 	std::vector< vertexId > vertices;
 	for (long unsigned int i = 0; i < G.neighbors.size(); i++) {
@@ -0,0 +1,23 @@
+import os
+import sys
+
+' the modules of implementation/ import each other by their plain names '
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Benchmark
+
+import pytest
+
+'''
+	Writes a small random dataset (see Benchmark.writeRandomGraphFile) and
+	returns the paths of its graph, expressed opinions, innate opinions and
+	measures files.
+'''
+@pytest.fixture
+def datasetFiles(tmp_path):
+	numVertices = 300
+	prefix = str(tmp_path / 'Random')
+	Benchmark.writeRandomGraphFile(f'{prefix}_G.txt', numVertices, 2000, seed=1)
+	Benchmark.writeRandomOpinionFiles(prefix, numVertices, seed=1)
+
+	return (f'{prefix}_G.txt', f'{prefix}_z.txt', f'{prefix}_s.txt', f'{prefix}_measures.txt')
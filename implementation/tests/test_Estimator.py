@@ -0,0 +1,36 @@
+import Estimator
+
+import numpy
+import pytest
+
+@pytest.mark.parametrize('chunkSizes', [[1000], [1, 999], [10]*100, [0, 500, 0, 500]])
+def test_runningStatisticsMatchSufficientStatistics(chunkSizes):
+	rng = numpy.random.default_rng(0)
+	z = rng.random(sum(chunkSizes))
+	s = rng.random(sum(chunkSizes))
+
+	runningStatistics = Estimator.RunningStatistics()
+	start = 0
+	for chunkSize in chunkSizes:
+		runningStatistics.update(z[start:start+chunkSize], s[start:start+chunkSize])
+		start += chunkSize
+
+	expected = Estimator.sufficientStatistics(z, s)
+	statistics = runningStatistics.statistics()
+
+	assert statistics.keys() == expected.keys()
+	for name, value in expected.items():
+		assert statistics[name] == pytest.approx(value, rel=1e-12, abs=1e-9)
+
+def test_runningStatisticsWithLargeOffset():
+	' the centered moments stay accurate when the opinions are far from 0 '
+	rng = numpy.random.default_rng(1)
+	z = 1e6 + rng.random(10000)
+	s = 1e6 + rng.random(10000)
+
+	runningStatistics = Estimator.RunningStatistics()
+	for chunk in numpy.array_split(numpy.arange(10000), 37):
+		runningStatistics.update(z[chunk], s[chunk])
+
+	difference = z - s
+	assert runningStatistics.statistics()['sumDifferenceSquared'] == pytest.approx(numpy.dot(difference, difference), rel=1e-6)
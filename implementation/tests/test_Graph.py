@@ -0,0 +1,101 @@
+import Graph
+import GraphReader
+
+import numpy
+import pytest
+
+' the probability of every entry when sampling with the alias table (probabilities, aliases) '
+def aliasTableDistribution(probabilities, aliases):
+	n = len(probabilities)
+	distribution = numpy.zeros(n)
+	numpy.add.at(distribution, numpy.arange(n), probabilities / n)
+	numpy.add.at(distribution, aliases, (1 - probabilities) / n)
+	return distribution
+
+@pytest.mark.parametrize('weights', [
+	[1.0],
+	[1.0, 1.0, 1.0, 1.0],
+	[0.5, 2.0, 1.0],
+	[1e-9, 1.0, 3.0, 0.0, 7.5],
+	list(numpy.random.default_rng(0).random(100))
+])
+def test_aliasTableProbabilities(weights):
+	weights = numpy.array(weights)
+	probabilities, aliases = Graph.buildAliasTable(weights)
+
+	assert numpy.all((probabilities >= 0) & (probabilities <= 1))
+	assert numpy.allclose(aliasTableDistribution(probabilities, aliases), weights / weights.sum())
+
+def test_aliasTablesOfGraph(datasetFiles):
+	G = GraphReader.graphFromSparseCSV(*datasetFiles, separator=' ', compact=True)
+
+	for u in range(G.numVertices):
+		weights = G.edgeWeights(u)
+		if len(weights) == 0:
+			continue
+		probabilities, aliases = G.aliasTable(u)
+		assert numpy.allclose(aliasTableDistribution(probabilities, aliases), weights / weights.sum())
+
+def assertMatchesCumsum(tree, weights):
+	assert len(tree) == len(weights)
+	assert numpy.allclose(list(tree), numpy.cumsum(weights))
+	assert numpy.allclose([tree.prefixSum(i) for i in range(len(weights))], numpy.cumsum(weights))
+	assert numpy.allclose([tree[i] for i in range(len(weights))], numpy.cumsum(weights))
+	assert tree.totalWeight == pytest.approx(sum(weights))
+
+@pytest.mark.parametrize('numWeights', [0, 1, 2, 7, 64, 100])
+def test_fenwickTreeMatchesCumsum(numWeights):
+	rng = numpy.random.default_rng(numWeights)
+	weights = rng.random(numWeights).tolist()
+
+	tree = Graph.FenwickTree(weights)
+	assertMatchesCumsum(tree, weights)
+
+	' random updates, appends and pops '
+	for _ in range(300):
+		operation = rng.integers(3)
+		if operation == 0 and weights:
+			i = int(rng.integers(len(weights)))
+			weights[i] = float(rng.random())
+			tree.update(i, weights[i])
+		elif operation == 1:
+			weights.append(float(rng.random()))
+			tree.append(weights[-1])
+		elif weights:
+			assert tree.pop() == weights.pop()
+
+		assertMatchesCumsum(tree, weights)
+
+def test_fenwickTreeFind():
+	rng = numpy.random.default_rng(0)
+	weights = rng.random(50)
+	weights[[3, 17]] = 0.0
+	tree = Graph.FenwickTree(weights)
+
+	cumulatedWeights = numpy.cumsum(weights)
+	for target in rng.random(1000) * cumulatedWeights[-1]:
+		expected = min(numpy.searchsorted(cumulatedWeights, target, side='right'), len(weights) - 1)
+		assert tree.find(target) == expected
+
+def test_dynamicGraphUpdates(datasetFiles):
+	G = GraphReader.graphFromSparseCSV(*datasetFiles, separator=' ', compact=True)
+	G.makeDynamic()
+
+	rng = numpy.random.default_rng(0)
+	us, vs = G.sampleEdges(200)
+	for u, v in zip(us.tolist(), vs.tolist()):
+		if rng.random() < 0.5:
+			G.updateEdgeWeight(u, v, float(1 + rng.random()))
+		else:
+			G.removeEdge(u, v)
+			G.addEdge(u, v, 2.0)
+
+	totalWeight = 0.0
+	for u in range(G.numVertices):
+		weights = G.edgeWeights(u)
+		assert numpy.allclose(list(G.cumulatedWeights[u]), numpy.cumsum(weights))
+		assert G.totalEdgeWeight(u) == pytest.approx(weights.sum())
+		totalWeight += weights.sum()
+
+	' every edge is counted at both of its endpoints '
+	assert G.totalEdgeWeights == pytest.approx(totalWeight / 2)
@@ -0,0 +1,104 @@
+import Benchmark
+import DiskGraph
+import GraphCache
+import GraphReader
+
+import numpy
+import os
+import pytest
+
+def writeGraphFile(tmp_path, lines):
+	graphFile = tmp_path / 'G.txt'
+	graphFile.write_text('\n'.join(lines) + '\n')
+	return str(graphFile)
+
+@pytest.mark.parametrize('chunkSize', [GraphReader.bulkChunkSize, 997])
+def test_bulkReaderMatchesLineReader(datasetFiles, monkeypatch, chunkSize):
+	' small chunks split lines at the chunk boundaries '
+	monkeypatch.setattr(GraphReader, 'bulkChunkSize', chunkSize)
+
+	G = GraphReader.graphFromSparseCSV(*datasetFiles, separator=' ')
+	H = GraphReader.graphFromSparseCSV(*datasetFiles, separator=' ', compact=True)
+
+	assert H.isCompact
+	assert Benchmark.graphsAreIdentical(G, H)
+
+def test_bulkReaderWithoutWeights(tmp_path):
+	graphFile = writeGraphFile(tmp_path, ['3', '0,1', '1,2', '2,1'])
+
+	n, us, vs, weights = GraphReader.readEdgeArrays(graphFile, ',')
+
+	assert n == 3
+	assert us.tolist() == [0, 1, 2]
+	assert vs.tolist() == [1, 2, 1]
+	assert weights.tolist() == [1.0, 1.0, 1.0]
+
+@pytest.mark.parametrize('lines', [
+	['3', '0 1 1.0', '1 x 1.0'],
+	['3', '0 1 1.0', '1 2 abc'],
+	['3', '0 1.5 1.0'],
+	['3', '0 1 1.0', '1 2'],
+	['3', '0 1 1.0', '1 2 1.0 4.0']
+])
+def test_bulkReaderRejectsMalformedLines(tmp_path, lines):
+	graphFile = writeGraphFile(tmp_path, lines)
+
+	with pytest.raises(ValueError):
+		GraphReader.readEdgeArrays(graphFile, ' ')
+
+def test_binaryOpinionsRoundTrip(tmp_path):
+	opinions = numpy.random.default_rng(0).random(1000)
+	binaryFilePath = str(tmp_path / 'opinions.bin')
+	GraphReader.writeOpinionsBinary(binaryFilePath, opinions)
+
+	dtype, n, _, sourceStamp = GraphReader.readOpinionsHeader(binaryFilePath)
+	assert (dtype, n, sourceStamp) == (numpy.dtype(numpy.float64), 1000, (-1, -1))
+	assert numpy.array_equal(GraphReader.readOpinionsBinary(binaryFilePath, verifyChecksum=True), opinions)
+
+def test_binaryOpinionsDetectCorruption(tmp_path):
+	binaryFilePath = str(tmp_path / 'opinions.bin')
+	GraphReader.writeOpinionsBinary(binaryFilePath, numpy.arange(100, dtype=numpy.float64))
+
+	with open(binaryFilePath, 'r+b') as fp:
+		fp.seek(GraphReader.opinionsHeaderSize + 8)
+		fp.write(b'\x01')
+	with pytest.raises(ValueError, match='checksum'):
+		GraphReader.readOpinionsBinary(binaryFilePath, verifyChecksum=True)
+
+	with open(binaryFilePath, 'r+b') as fp:
+		fp.truncate(GraphReader.opinionsHeaderSize + 80)
+	with pytest.raises(ValueError, match='truncated'):
+		GraphReader.readOpinionsBinary(binaryFilePath)
+
+def test_convertedOpinionsFollowTheTextFile(tmp_path):
+	textFilePath = tmp_path / 'opinions.txt'
+	textFilePath.write_text('0.25\n0.5\n0.75\n')
+	binaryFilePath = GraphReader.convertOpinionsFile(str(textFilePath))
+
+	assert GraphReader.isConverted(binaryFilePath, str(textFilePath))
+	assert isinstance(GraphReader.readOpinions(str(textFilePath)), numpy.memmap)
+
+	' a changed text file is read instead, even if the binary file is newer '
+	textFilePath.write_text('0.1\n0.2\n0.3\n0.4\n')
+	os.utime(binaryFilePath)
+	assert not GraphReader.isConverted(binaryFilePath, str(textFilePath))
+	assert list(GraphReader.readOpinions(str(textFilePath))) == [0.1, 0.2, 0.3, 0.4]
+
+	' a corrupted binary file is converted again '
+	GraphReader.convertOpinionsFile(str(textFilePath))
+	with open(binaryFilePath, 'r+b') as fp:
+		fp.seek(GraphReader.opinionsHeaderSize)
+		fp.write(b'\x07')
+	assert list(GraphCache.loadOpinions(str(textFilePath))) == [0.1, 0.2, 0.3, 0.4]
+
+def test_numberOfOpinionsMustMatchTheGraph(datasetFiles):
+	graphFile, expressedOpinionsFile, innateOpinionsFile, measuresFile = datasetFiles
+	with open(expressedOpinionsFile, 'w') as fp:
+		fp.write('0.5\n' * 10)
+
+	with pytest.raises(ValueError, match='10 opinions'):
+		GraphReader.graphFromSparseCSV(*datasetFiles, separator=' ', compact=True)
+	with pytest.raises(ValueError, match='10 opinions'):
+		GraphCache.loadGraph(*datasetFiles, separator=' ')
+	with pytest.raises(ValueError, match='10 opinions'):
+		DiskGraph.loadGraph(*datasetFiles, separator=' ')
@@ -0,0 +1,144 @@
+import Estimator
+import GraphReader
+import OpinionService
+
+import http.client
+import http.server
+import json
+import numpy
+import pytest
+import threading
+
+@pytest.fixture
+def dynamicGraph(datasetFiles):
+	G = GraphReader.graphFromSparseCSV(*datasetFiles, separator=' ', compact=True)
+	G.makeDynamic()
+	G.s = numpy.array(G.s)
+	return G
+
+def cachedVertices(service, engine, parameters):
+	key = OpinionService.parametersKey(engine, dict(OpinionService.defaultParameters, **parameters))
+	return set(u for (u, parameters) in service.cache.entries if parameters == key)
+
+def test_pushEstimatesAreNeverStaleAfterChanges(dynamicGraph):
+	G = dynamicGraph
+	service = OpinionService.OpinionService(G)
+	parameters = {'rMax': 1e-3}
+	vertices = list(range(0, G.numVertices, 3))
+
+	rng = numpy.random.default_rng(0)
+	for i in range(20):
+		service.opinions(vertices, 'push', parameters)
+
+		u = int(rng.integers(G.numVertices))
+		if i % 2 == 0 and len(G.neighbors[u]) > 0:
+			v = G.neighbors[u][0]
+			service.changeGraph(lambda: G.updateEdgeWeight(u, v, 3.0))
+		else:
+			service.changeGraph(lambda: G.setInnateOpinion(u, float(rng.random())))
+
+		' only the estimates that depend on the change are dropped '
+		assert 0 < len(cachedVertices(service, 'push', parameters))
+
+		cachedOpinions = service.opinions(vertices, 'push', parameters)
+		opinions, _ = Estimator.estimateExpressedOpinionsWithPush(G, vertices, dict(OpinionService.defaultParameters, **parameters))
+		assert cachedOpinions == opinions
+
+def test_walkEstimatesWithinReachAreDropped(dynamicGraph):
+	G = dynamicGraph
+	service = OpinionService.OpinionService(G)
+	parameters = {'numSteps': 2, 'numWalks': 10}
+	service.opinions(range(G.numVertices), 'native', parameters)
+
+	u = next(u for u in range(G.numVertices) if len(G.neighbors[u]) > 0)
+	v = G.neighbors[u][0]
+	service.changeGraph(lambda: G.updateEdgeWeight(u, v, 5.0))
+
+	' walks with 2 steps only read the vertices within distance 1 of their start vertex '
+	affected = G.ball([u, v], 1)
+	assert cachedVertices(service, 'native', parameters) == set(range(G.numVertices)) - affected
+
+@pytest.mark.parametrize('engine, parameters', [
+	('hybrid', {'rMax': 1e-2, 'epsilon': 0.1}),
+	('adaptive', {'numWalks': 200, 'epsilon': 0.1})
+])
+def test_unboundedWalkEstimatesAreAllDropped(dynamicGraph, engine, parameters):
+	G = dynamicGraph
+	service = OpinionService.OpinionService(G)
+	service.opinions(range(50), engine, parameters)
+	assert len(cachedVertices(service, engine, parameters)) == 50
+
+	service.changeGraph(lambda: G.setInnateOpinion(0, 0.5))
+
+	assert len(cachedVertices(service, engine, parameters)) == 0
+
+def test_externalEngineIsRejectedAfterChanges(dynamicGraph):
+	G = dynamicGraph
+	service = OpinionService.OpinionService(G)
+	service.changeGraph(lambda: G.setInnateOpinion(0, 0.5))
+
+	with pytest.raises(ValueError):
+		service.opinions([1], 'external')
+
+def test_changeGraphReturnsAndRaises(dynamicGraph):
+	service = OpinionService.OpinionService(dynamicGraph)
+
+	assert service.changeGraph(lambda: 42) == 42
+	with pytest.raises(KeyError):
+		service.changeGraph(lambda: {}[0])
+
+def test_verticesOutsideTheGraphAreRejected(dynamicGraph):
+	service = OpinionService.OpinionService(dynamicGraph)
+
+	for u in [-1, dynamicGraph.numVertices]:
+		with pytest.raises(ValueError):
+			service.opinions([0, u], 'native', {'numSteps': 2, 'numWalks': 10})
+
+def test_failedEstimationsDoNotStopTheBatchingThread(dynamicGraph, monkeypatch):
+	service = OpinionService.OpinionService(dynamicGraph)
+	parameters = {'numSteps': 2, 'numWalks': 10}
+
+	' an estimator whose result misses the requested vertices '
+	monkeypatch.setattr(OpinionService, 'estimateOpinions', lambda *arguments: (dict(), 0.0))
+	with pytest.raises(KeyError):
+		service.opinions([1, 2], 'native', parameters)
+
+	monkeypatch.undo()
+	assert service.opinions([1, 2], 'native', parameters).keys() == {1, 2}
+	assert service.batchingThread.is_alive()
+
+@pytest.fixture
+def serverAddress(dynamicGraph):
+	service = OpinionService.OpinionService(dynamicGraph)
+	handler = type('Handler', (OpinionService.OpinionRequestHandler,), {'service': service})
+	server = http.server.ThreadingHTTPServer(('localhost', 0), handler)
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+
+	yield server.server_address
+
+	server.shutdown()
+	server.server_close()
+
+def getJSON(address, path):
+	connection = http.client.HTTPConnection(*address)
+	connection.request('GET', path)
+	response = connection.getresponse()
+	content = json.loads(response.read())
+	connection.close()
+	return response.status, content
+
+def test_httpErrors(serverAddress, monkeypatch):
+	status, content = getJSON(serverAddress, '/opinions?vertices=1,2&numSteps=2&numWalks=10')
+	assert status == 200 and content.keys() == {'1', '2'}
+
+	status, content = getJSON(serverAddress, '/opinions?vertices=1,100000&numSteps=2&numWalks=10')
+	assert status == 400 and 'not in the graph' in content['error']
+
+	status, _ = getJSON(serverAddress, '/unknown')
+	assert status == 404
+
+	def failingEstimator(*arguments):
+		raise RuntimeError('oracle failed')
+	monkeypatch.setattr(OpinionService, 'estimateOpinions', failingEstimator)
+	status, content = getJSON(serverAddress, '/opinions?vertices=3&numSteps=2&numWalks=10')
+	assert status == 500 and 'oracle failed' in content['error']
@@ -0,0 +1,57 @@
+import DiskGraph
+import Estimator
+import GraphCache
+import GraphReader
+import OracleModule
+
+import numpy
+import pytest
+
+' the same graph as a compact graph, a lazy view on its disk index and a dynamic graph '
+@pytest.fixture
+def graphVersions(datasetFiles):
+	compactGraph = GraphCache.loadGraph(*datasetFiles, separator=' ')
+	diskGraph = DiskGraph.loadGraph(*datasetFiles, separator=' ')
+	dynamicGraph = GraphReader.graphFromSparseCSV(*datasetFiles, separator=' ', compact=True)
+	dynamicGraph.makeDynamic()
+
+	return compactGraph, diskGraph, dynamicGraph
+
+@pytest.mark.parametrize('parameters', [
+	{'engine': 'native', 'numSteps': 20, 'numWalks': 50},
+	{'engine': 'adaptive', 'numSteps': 20, 'numWalks': 300, 'epsilon': 0.05},
+	{'engine': 'push', 'numSteps': 20, 'numWalks': 50, 'rMax': 1e-3},
+	{'engine': 'hybrid', 'numSteps': 20, 'numWalks': 50, 'rMax': 1e-2, 'epsilon': 0.05}
+])
+def test_enginesAgreeOnAllGraphVersions(graphVersions, parameters):
+	vertices = list(range(0, 300, 7))
+
+	estimates = []
+	for G in graphVersions:
+		numpy.random.seed(0)
+		opinions, _ = Estimator.estimateExpressedOpinions(G, vertices, parameters)
+		estimates.append(opinions)
+
+	assert estimates[0] == estimates[1] == estimates[2]
+
+	' the engines do not convert the graph of the caller '
+	compactGraph, diskGraph, dynamicGraph = graphVersions
+	assert compactGraph.isCompact
+	assert not diskGraph.isCompact
+	assert dynamicGraph.isDynamic and not dynamicGraph.isCompact
+
+def test_sweepMatchesSingleConfiguration(graphVersions):
+	G = graphVersions[0]
+	vertices = list(range(0, 300, 5))
+	configurations = [(5, 10), (20, 10), (5, 40), (20, 40)]
+
+	numpy.random.seed(1)
+	sweepOpinions, _ = OracleModule.estimateOpinionsForSweep(G, vertices, configurations)
+
+	' the largest configuration uses exactly the same walks, so its estimates are bit-identical '
+	numpy.random.seed(1)
+	opinions, _ = OracleModule.estimateOpinionsInProcess(G, vertices, 20, 40)
+	assert sweepOpinions[-1] == opinions
+
+	for opinions in sweepOpinions:
+		assert opinions.keys() == set(vertices)
@@ -0,0 +1,54 @@
+import Benchmark
+import Eval
+import Scheduler
+
+import os
+import pytest
+
+'''
+	Runs a givenS and a givenZ experiment on a random dataset with the
+	given number of workers and returns the exported CSV files as a dict
+	from their names to their sorted lines (the workers insert their rows
+	in any order). The times in the stats files are left out.
+'''
+def runAndExport(tmp_path, monkeypatch, numWorkers):
+	monkeypatch.setattr(Eval, 'experimentsOutputFolderPath', str(tmp_path / f'results{numWorkers}'))
+	monkeypatch.setattr(Eval, 'resultsStore', None)
+	monkeypatch.setattr(Eval, 'numRepetitions', 2)
+	monkeypatch.setattr(Eval, 'oracleEngine', 'native')
+
+	for experimentType, parameters in [('givenS', [{'numSteps': 10, 'numWalks': 20}, {'numSteps': 20, 'numWalks': 10}]),
+									   ('givenZ', [{'numSamples': 10, 'repetitions': 2}])]:
+		parameters = [Eval.withOracleEngine(parameterSet) for parameterSet in parameters]
+		Scheduler.runExperimentsWithParameters(['Random'], ['Uniform'], parameters, [20, 50], experimentType, numWorkers=numWorkers, seed=5)
+
+	Eval.exportResultsToCSV()
+	Eval.getResultsStore().close()
+
+	files = dict()
+	for fileName in os.listdir(Eval.experimentsOutputFolderPath):
+		if not fileName.endswith('.csv'):
+			continue
+		with open(os.path.join(Eval.experimentsOutputFolderPath, fileName)) as fp:
+			lines = fp.read().splitlines()
+		if fileName.endswith('_stats.csv'):
+			timeColumn = lines[0].split(',').index('time')
+			lines = [','.join(value for i, value in enumerate(line.split(',')) if i != timeColumn) for line in lines]
+		files[fileName] = sorted(lines)
+
+	return files
+
+def test_resultsDoNotDependOnTheNumberOfWorkers(tmp_path, monkeypatch):
+	' Eval.loadGraphForParameters reads the datasets relative to implementation/ '
+	outputsFolderPath = tmp_path / 'include' / 'OpinionQuantities-mine' / 'outputs'
+	os.makedirs(outputsFolderPath)
+	os.makedirs(tmp_path / 'implementation')
+	Benchmark.writeRandomGraphFile(str(outputsFolderPath / 'Random_G.txt'), 200, 1000, seed=2)
+	Benchmark.writeRandomOpinionFiles(str(outputsFolderPath / 'Random_Uniform'), 200, seed=2)
+	monkeypatch.chdir(tmp_path / 'implementation')
+
+	filesWithOneWorker = runAndExport(tmp_path, monkeypatch, 1)
+	filesWithTwoWorkers = runAndExport(tmp_path, monkeypatch, 2)
+
+	assert len(filesWithOneWorker) >= 4
+	assert filesWithOneWorker == filesWithTwoWorkers